@@ -17,8 +17,17 @@ EXIF_TAGS = {
     529: ['YCbCrCoefficients', 'rational'],
     531: ['YCbCrPositioning', 'digit'],
     532: ['ReferenceBlackWhite', 'rational'],
+    256: ['ImageWidth', 'digit'],
+    257: ['ImageLength', 'digit'],
+    258: ['BitsPerSample', 'digit'],
+    259: ['Compression', 'digit'],
+    262: ['PhotometricInterpretation', 'digit'],
+    513: ['JPEGInterchangeFormat', 'digit'],
+    514: ['JPEGInterchangeFormatLength', 'digit'],
+    315: ['Artist', 'string'],
     33432: ['Copyright', 'string'],
-    34665: ['ExifOffset', 'digit'],      
+    34665: ['ExifOffset', 'digit'],
+    34853: ['GPSInfo', 'digit'],
     # SUB TAGS
     33434: ['ExposureTime', 'rational'],
     33437: ['FNumber', 'rational'],
@@ -40,8 +49,63 @@ EXIF_TAGS = {
     37385: ['Flash', 'digit'],
     37386: ['FocalLength', 'rational'],
     37510: ['UserComment', 'string'],
+    37500: ['MakerNote', 'undefined'],
+    37520: ['SubsecTime', 'string'],
+    37521: ['SubsecTimeOriginal', 'string'],
+    37522: ['SubsecTimeDigitized', 'string'],
     40960: ['FlashPixVersion', 'string'],
-    40961: ['ColorSpace', 'digit']         # 0xaa001
+    40961: ['ColorSpace', 'digit'],         # 0xaa001
+    40962: ['PixelXDimension', 'digit'],
+    40963: ['PixelYDimension', 'digit'],
+    40965: ['InteroperabilityOffset', 'digit'],
+    41495: ['SensingMethod', 'digit'],
+    41729: ['SceneType', 'undefined'],
+    41985: ['CustomRendered', 'digit'],
+    41986: ['ExposureMode', 'digit'],
+    41987: ['WhiteBalance', 'digit'],
+    41988: ['DigitalZoomRatio', 'rational'],
+    41989: ['FocalLengthIn35mmFilm', 'digit'],
+    41990: ['SceneCaptureType', 'digit'],
+    42016: ['ImageUniqueID', 'string'],
+    42033: ['BodySerialNumber', 'string'],
+    42035: ['LensMake', 'string'],
+    42036: ['LensModel', 'string'],
+}
+
+# GPS IFD tags (numbers overlap with main tags so they are stored separately)
+GPS_TAGS = {
+    0: ['GPSVersionID', 'digit'],
+    1: ['GPSLatitudeRef', 'string'],
+    2: ['GPSLatitude', 'rational'],
+    3: ['GPSLongitudeRef', 'string'],
+    4: ['GPSLongitude', 'rational'],
+    5: ['GPSAltitudeRef', 'digit'],
+    6: ['GPSAltitude', 'rational'],
+    7: ['GPSTimeStamp', 'rational'],
+    8: ['GPSSatellites', 'string'],
+    9: ['GPSStatus', 'string'],
+    10: ['GPSMeasureMode', 'string'],
+    11: ['GPSDOP', 'rational'],
+    12: ['GPSSpeedRef', 'string'],
+    13: ['GPSSpeed', 'rational'],
+    16: ['GPSImgDirectionRef', 'string'],
+    17: ['GPSImgDirection', 'rational'],
+    18: ['GPSMapDatum', 'string'],
+    27: ['GPSProcessingMethod', 'undefined'],
+    29: ['GPSDateStamp', 'string'],
+}
+
+# Interoperability IFD tags
+INTEROP_TAGS = {
+    1: ['InteroperabilityIndex', 'string'],
+    2: ['InteroperabilityVersion', 'string'],
+}
+
+# tags pointing to sub-IFDs: tag -> name of sub-IFD
+EXIF_SUB_IFD_POINTERS = {
+    34665: 'Exif',
+    34853: 'GPS',
+    40965: 'Interop',
 }
 
 data_format_bytes = {
@@ -56,7 +120,25 @@ data_format_bytes = {
     9: 4,  # signed long
     10: 8, # signed rational
     11: 4, # single float
-    12: 8  # double float
+    12: 8, # double float
+    13: 4  # IFD offset
+}
+
+# struct format of single component for each data format (ascii and undefined are read as raw bytes)
+data_format_struct = {
+    1: 'B',
+    2: 's',
+    3: 'H',
+    4: 'L',
+    5: 'L',
+    6: 'b',
+    7: 's',
+    8: 'h',
+    9: 'l',
+    10: 'l',
+    11: 'f',
+    12: 'd',
+    13: 'L'
 }
 
 
@@ -66,4 +148,12 @@ color_type_bytes = {
     3:1,
     4:2,
     6:4
-}
\ No newline at end of file
+}
+
+# color type used to save data with given number of channels
+channels_color_type = {
+    1:0,
+    2:4,
+    3:2,
+    4:6
+}
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+logger = logging.getLogger("loger")
+
+
+class AsyncRunner:
+    '''
+    Runs blocking stages of image processing outside of event loop.
+    File I/O goes to thread pool, CPU heavy stages (decoding, RSA encryption) go to thread or process pool.
+    Number of requests processed at once is limited by semaphore, other requests wait without blocking event loop.
+    '''
+
+    def __init__(self, max_concurrency: int = 64, use_processes: bool = False, cpu_workers: int = None,
+                 io_workers: int = None, cpu_executor: Executor = None, io_executor: Executor = None):
+        '''
+        Args:
+            *max_concurrency -> int = 64: max number of requests processed at once
+            *use_processes -> bool = False: if True CPU stages are run in process pool (pure Python RSA holds GIL)
+            *cpu_workers -> int = None: number of CPU workers (default os.cpu_count())
+            *io_workers -> int = None: number of I/O threads (default ThreadPoolExecutor value)
+            *cpu_executor -> Executor = None: own executor for CPU stages (not shut down by runner)
+            *io_executor -> Executor = None: own executor for file I/O (not shut down by runner)
+        '''
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._owned = []
+        if cpu_executor is None:
+            workers = cpu_workers or os.cpu_count()
+            cpu_executor = ProcessPoolExecutor(workers) if use_processes else ThreadPoolExecutor(workers, thread_name_prefix="png-cpu")
+            self._owned.append(cpu_executor)
+        if io_executor is None:
+            io_executor = ThreadPoolExecutor(io_workers, thread_name_prefix="png-io")
+            self._owned.append(io_executor)
+        self.cpu_executor = cpu_executor
+        self.io_executor = io_executor
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def limit(self):
+        '''
+        Concurrency limiter, each public coroutine holds one slot until it finishes
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    async def run_cpu(self, func, *args, **kwargs):
+        '''
+        Runs CPU heavy function in CPU executor, with process pool function and arguments have to be picklable
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, functools.partial(func, *args, **kwargs))
+
+    async def run_io(self, func, *args, **kwargs):
+        '''
+        Runs blocking I/O function (or function releasing GIL, e.g. zlib) in I/O thread pool
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, functools.partial(func, *args, **kwargs))
+
+    def close(self) -> None:
+        for executor in self._owned:
+            executor.shutdown(wait=True)
+        self._owned = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+_default_runner = None
+
+
+def get_default_runner() -> AsyncRunner:
+    '''
+    Returns shared runner with thread executors, created on first use
+    '''
+    global _default_runner
+    if _default_runner is None:
+        _default_runner = AsyncRunner()
+    return _default_runner
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    # data is written to temporary file first, so readers never see partially written image
+    tmp_path = f"{path}.tmp{os.getpid()}_{id(data)}"
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+async def read_file(path: str, runner: AsyncRunner = None) -> bytes:
+    '''
+    Reads whole file without blocking event loop
+    '''
+    runner = runner or get_default_runner()
+    return await runner.run_io(_read_bytes, path)
+
+
+async def write_file(path: str, data: bytes, runner: AsyncRunner = None) -> None:
+    '''
+    Writes file without blocking event loop, file is replaced atomically
+    '''
+    runner = runner or get_default_runner()
+    await runner.run_io(_write_bytes, path, data)
@@ -0,0 +1,215 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Dict, List
+import numpy as np
+from e_media1.chunksclasses import ScanlineStream
+from e_media1.additional_data import color_type_bytes
+
+
+logger = logging.getLogger("loger")
+
+# pairs of neighbouring pixels: (row offset, column offset)
+DIRECTIONS = {
+    'horizontal': (0, 1),
+    'vertical': (1, 0),
+    'diagonal': (1, 1)
+}
+
+
+@dataclass
+class CipherMetrics:
+    '''
+    Quality metrics of encrypted image. Good cipher gives flat histograms (entropy close to 8 bits),
+    correlation of neighbouring pixels close to 0, NPCR close to 99.6 %, UACI close to 33.5 % and no duplicate blocks.
+    '''
+    histograms: np.array
+    entropy: List[float]
+    correlation: Dict[str, List[float]]
+    duplicate_block_ratio: float
+    blocks: int
+    npcr: float = None
+    uaci: float = None
+    pixels: int = 0
+    path: str = None
+
+    def to_dict(self, histograms: bool = False) -> dict:
+        result = {
+            'path': self.path,
+            'pixels': self.pixels,
+            'entropy': self.entropy,
+            'correlation': self.correlation,
+            'duplicate_block_ratio': self.duplicate_block_ratio,
+            'blocks': self.blocks,
+            'npcr': self.npcr,
+            'uaci': self.uaci,
+        }
+        if histograms:
+            result['histograms'] = self.histograms.tolist()
+        return result
+
+    def to_json(self, path: str = None, histograms: bool = True) -> str:
+        '''
+        Serializes metrics to JSON, if path is given JSON is also saved to file
+        '''
+        text = json.dumps(self.to_dict(histograms), indent=2)
+        if path is not None:
+            with open(path, 'w') as output_file:
+                output_file.write(text)
+        return text
+
+
+class CipherAnalyzer:
+    '''
+    Streaming computation of cipher metrics. Image is passed in bands of rows (height x width x channels),
+    only sums, histograms, block digests and last row of previous band are kept between bands.
+    '''
+
+    def __init__(self, channels: int, block_size: int = 256):
+        self.channels = channels
+        self.block_size = block_size
+        self.histograms = np.zeros((channels, 256), dtype=np.int64)
+        # per direction and channel: n, sum x, sum y, sum x^2, sum y^2, sum xy
+        self.sums = {direction: np.zeros((6, channels), dtype=np.float64) for direction in DIRECTIONS}
+        self.pixels = 0
+        self.changed = 0
+        self.absolute_difference = 0
+        self.compared = 0
+        self.blocks = 0
+        self._digests = set()
+        self._carry = np.empty(0, dtype=np.uint8)
+        self._previous_row = None
+
+    def update(self, band: np.array, reference: np.array = None) -> None:
+        '''
+        Adds band of rows to metrics
+
+        Args:
+            *band -> np.array: rows of encrypted image (rows x width x channels), uint8
+            *reference -> np.array = None: same rows of original image, needed for NPCR/UACI
+        '''
+        if band.ndim == 2:
+            band = band[:, :, np.newaxis]
+        if band.shape[0] == 0:
+            return
+        flat = band.reshape(-1, self.channels)
+        offsets = np.arange(self.channels) * 256
+        self.histograms += np.bincount((flat + offsets).ravel(), minlength=256 * self.channels).reshape(self.channels, 256)
+        self.pixels += flat.shape[0]
+
+        rows = band if self._previous_row is None else np.concatenate((self._previous_row, band))
+        for direction, (row_offset, col_offset) in DIRECTIONS.items():
+            height, width = rows.shape[0] - row_offset, rows.shape[1] - col_offset
+            if height <= 0 or width <= 0:
+                continue
+            # only pairs with at least one pixel in new band (previous row was already paired horizontally)
+            first = rows[:height, :width] if row_offset else band[:, :width]
+            second = rows[row_offset:, col_offset:] if row_offset else band[:, col_offset:]
+            x = first.reshape(-1, self.channels).astype(np.float64)
+            y = second.reshape(-1, self.channels).astype(np.float64)
+            self.sums[direction] += np.stack((np.full(self.channels, x.shape[0]), x.sum(axis=0), y.sum(axis=0),
+                                              np.einsum('ij,ij->j', x, x), np.einsum('ij,ij->j', y, y), np.einsum('ij,ij->j', x, y)))
+        self._previous_row = band[-1:].copy()
+
+        if reference is not None:
+            reference = reference.reshape(band.shape)
+            self.changed += int(np.count_nonzero(band != reference))
+            self.absolute_difference += int(np.abs(band.astype(np.int16) - reference).sum())
+            self.compared += band.size
+
+        data = np.concatenate((self._carry, band.reshape(-1)))
+        full = data.size - data.size % self.block_size
+        blocks = data[:full].reshape(-1, self.block_size)
+        self._digests.update(hashlib.blake2b(block, digest_size=8).digest() for block in blocks)
+        self.blocks += blocks.shape[0]
+        self._carry = data[full:].copy()
+
+    def result(self, path: str = None) -> CipherMetrics:
+        probabilities = self.histograms / max(self.pixels, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -np.sum(np.where(probabilities > 0, probabilities * np.log2(probabilities), 0), axis=1)
+        correlation = dict()
+        for direction, (n, sx, sy, sxx, syy, sxy) in self.sums.items():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+            # constant channel has undefined correlation
+            correlation[direction] = [None if np.isnan(v) else round(float(v), 6) for v in value]
+        metrics = CipherMetrics(
+            histograms=self.histograms.copy(),
+            entropy=[round(float(value), 6) for value in entropy],
+            correlation=correlation,
+            duplicate_block_ratio=(self.blocks - len(self._digests)) / self.blocks if self.blocks else 0.0,
+            blocks=self.blocks,
+            pixels=self.pixels,
+            path=path)
+        if self.compared:
+            metrics.npcr = 100 * self.changed / self.compared
+            metrics.uaci = 100 * self.absolute_difference / (255 * self.compared)
+        return metrics
+
+
+def analyze(encrypted: np.array, original: np.array = None, block_size: int = 256) -> CipherMetrics:
+    '''
+    Computes cipher metrics of whole image array
+
+    Args:
+        *encrypted -> np.array: encrypted image data (height x width x channels)
+        *original -> np.array = None: original image data for NPCR/UACI
+        *block_size -> int = 256: size of cipher block checked for duplicates (RSA ciphertext block)
+
+    Return:
+        *metrics -> CipherMetrics
+    '''
+    channels = encrypted.shape[2] if encrypted.ndim == 3 else 1
+    analyzer = CipherAnalyzer(channels, block_size)
+    analyzer.update(encrypted, original)
+    return analyzer.result()
+
+
+def _bands(stream: ScanlineStream, rows: int):
+    width = stream.IHDR.width
+    channels = color_type_bytes.get(stream.IHDR.color)
+    scanlines = iter(stream)
+    while True:
+        band = list(itertools.islice(scanlines, rows))
+        if not band:
+            return
+        yield np.stack(band).reshape(len(band), width, channels)
+
+
+def analyze_file(path: str, reference_path: str = None, block_size: int = 256, rows: int = 64) -> CipherMetrics:
+    '''
+    Computes cipher metrics of PNG file decoded in bands of rows, memory use does not depend on image height.
+    Reference image is decoded in lockstep. Palette images are analyzed as indices (data which is encrypted).
+
+    Args:
+        *path -> str: path to encrypted PNG file
+        *reference_path -> str = None: path to original PNG file for NPCR/UACI
+        *block_size -> int = 256: size of cipher block checked for duplicates
+        *rows -> int = 64: number of rows in band
+
+    Return:
+        *metrics -> CipherMetrics
+    '''
+    with open(path, 'rb') as image_binary, ExitStack() as files:
+        stream = ScanlineStream(image_binary)
+        analyzer = CipherAnalyzer(color_type_bytes.get(stream.IHDR.color), block_size)
+        bands = _bands(stream, rows)
+        if reference_path is None:
+            pairs = ((band, None) for band in bands)
+        else:
+            reference = ScanlineStream(files.enter_context(open(reference_path, 'rb')))
+            if (reference.IHDR.width, reference.IHDR.height, reference.IHDR.color) != (stream.IHDR.width, stream.IHDR.height, stream.IHDR.color):
+                raise ValueError(f"Images {path} and {reference_path} have different dimensions or color type")
+            pairs = zip(bands, _bands(reference, rows))
+        for band, reference_band in pairs:
+            analyzer.update(band, reference_band)
+    metrics = analyzer.result(path)
+    logger.info(f"Cipher metrics of {os.path.basename(path)}: entropy {metrics.entropy}, "
+                f"correlation (h) {metrics.correlation['horizontal']}, duplicate blocks {metrics.duplicate_block_ratio:.2%}"
+                + (f", NPCR {metrics.npcr:.2f} %, UACI {metrics.uaci:.2f} %" if metrics.npcr is not None else ""))
+    return metrics
@@ -0,0 +1,317 @@
+import datetime
+import logging
+import struct
+import zlib
+from tabulate import tabulate
+from e_media1.basechunks import Chunk, register_chunk
+
+
+logger = logging.getLogger("loger")
+
+RENDERING_INTENTS = {
+    0: 'Perceptual',
+    1: 'Relative colorimetric',
+    2: 'Saturation',
+    3: 'Absolute colorimetric'
+}
+
+# number of significant bits stored in sBIT for each color type
+SBIT_CHANNELS = {
+    0: ['Gray'],
+    2: ['Red', 'Green', 'Blue'],
+    3: ['Red', 'Green', 'Blue'],
+    4: ['Gray', 'Alpha'],
+    6: ['Red', 'Green', 'Blue', 'Alpha']
+}
+
+
+def _split_keyword(data: bytes):
+    '''
+    Splits chunk data at first null separator into latin-1 keyword and remaining bytes
+    '''
+    keyword, _, rest = bytes(data).partition(b'\x00')
+    return keyword.decode('latin-1'), rest
+
+
+@register_chunk(b'tEXt')
+class tEXtChunk(Chunk):
+    __slots__ = ('keyword', '_text')
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        self.keyword, _ = _split_keyword(data)
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = _split_keyword(self.Data)[1].decode('latin-1')
+        return self._text
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        print(f"tEXt {self.keyword}: {self.text}")
+
+
+@register_chunk(b'zTXt')
+class zTXtChunk(Chunk):
+    '''
+    Compressed text, decompressed only when text is accessed
+    '''
+    __slots__ = ('keyword', '_text')
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        self.keyword, _ = _split_keyword(data)
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            _, rest = _split_keyword(self.Data)
+            # first byte is compression method (0 - zlib)
+            self._text = zlib.decompress(rest[1:]).decode('latin-1')
+        return self._text
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        print(f"zTXt {self.keyword}: {self.text}")
+
+
+@register_chunk(b'iTXt')
+class iTXtChunk(Chunk):
+    '''
+    International (UTF-8) text, optionally compressed. Text is decoded only when accessed.
+    '''
+    __slots__ = ('keyword', 'compressed', 'language', 'translated_keyword', '_text_offset', '_text')
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        self.keyword, rest = _split_keyword(data)
+        if len(rest) < 2:
+            logger.error("Wrong iTXt chunk data: missing compression flag and method")
+            rest = b'\x00\x00'
+        self.compressed = rest[0] == 1
+        language, _, rest = rest[2:].partition(b'\x00')
+        translated_keyword, _, text = rest.partition(b'\x00')
+        self.language = language.decode('ascii', errors='replace')
+        self.translated_keyword = translated_keyword.decode('utf-8', errors='replace')
+        self._text_offset = len(data) - len(text)
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            text = bytes(self.Data[self._text_offset:])
+            if self.compressed:
+                text = zlib.decompress(text)
+            self._text = text.decode('utf-8', errors='replace')
+        return self._text
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        print(f"iTXt {self.keyword} [{self.language}]: {self.text}")
+
+
+@register_chunk(b'iCCP')
+class iCCPChunk(Chunk):
+    '''
+    Embedded ICC profile, decompressed only when profile is accessed
+    '''
+    __slots__ = ('profile_name', '_profile')
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        self.profile_name, _ = _split_keyword(data)
+        self._profile = None
+
+    @property
+    def profile(self) -> bytes:
+        if self._profile is None:
+            _, rest = _split_keyword(self.Data)
+            self._profile = zlib.decompress(rest[1:])
+        return self._profile
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        print(f"iCCP Profile: {self.profile_name} ({len(self.profile)} bytes)")
+
+
+@register_chunk(b'sRGB')
+class sRGBChunk(Chunk):
+    __slots__ = ('rendering_intent',)
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        try:
+            self.rendering_intent = data[0]
+        except IndexError as e:
+            logger.error(f"Wrong sRGB chunk data: {e}")
+            self.rendering_intent = None
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        if self.rendering_intent is None:
+            print("sRGB Rendering Intent: invalid data")
+        else:
+            print(f"sRGB Rendering Intent: {RENDERING_INTENTS.get(self.rendering_intent, self.rendering_intent)}")
+
+
+@register_chunk(b'pHYs')
+class pHYsChunk(Chunk):
+    __slots__ = ('pixels_per_unit_x', 'pixels_per_unit_y', 'unit')
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        try:
+            self.pixels_per_unit_x, self.pixels_per_unit_y, self.unit = struct.unpack('>IIB', data[:9])
+        except struct.error as e:
+            logger.error(f"Wrong pHYs chunk data: {e}")
+            self.pixels_per_unit_x = self.pixels_per_unit_y = self.unit = None
+
+    def dpi(self):
+        '''
+        Returns resolution in dots per inch or None if unit is unknown
+        '''
+        if self.unit != 1:
+            return None
+        return self.pixels_per_unit_x * 0.0254, self.pixels_per_unit_y * 0.0254
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        if self.unit is None:
+            print("pHYs Data: invalid data")
+            return
+        unit = 'meter' if self.unit == 1 else 'unknown unit'
+        print(f"pHYs Data: {self.pixels_per_unit_x} x {self.pixels_per_unit_y} pixels per {unit}")
+
+
+@register_chunk(b'tIME')
+class tIMEChunk(Chunk):
+    __slots__ = ('time',)
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        try:
+            year, month, day, hour, minute, second = struct.unpack('>HBBBBB', data[:7])
+            # leap second (60) is allowed by PNG specification
+            self.time = datetime.datetime(year, month, day, hour, minute, min(second, 59))
+        except (struct.error, ValueError) as e:
+            logger.error(f"Wrong tIME chunk data: {e}")
+            self.time = None
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        if self.time is None:
+            print("tIME Last Modification: invalid date")
+        else:
+            print(f"tIME Last Modification: {self.time.isoformat()}")
+
+
+class ColorTypeDependentChunk(Chunk):
+    '''
+    Base class for chunks which data layout depends on color type from IHDR
+    '''
+    __slots__ = ('color_type',)
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+        self.color_type = None
+
+    def bind_header(self, ihdr) -> None:
+        self.color_type = ihdr.color
+
+
+@register_chunk(b'tRNS')
+class tRNSChunk(ColorTypeDependentChunk):
+    __slots__ = ()
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+
+    def values(self):
+        '''
+        Decodes transparency data
+
+        Return:
+            * for color type 3: tuple with alpha of each palette entry
+            * for color type 0: gray level (int) treated as transparent
+            * for color type 2: (red, green, blue) color treated as transparent
+        '''
+        if self.color_type == 3:
+            return tuple(self.Data)
+        if self.color_type == 0:
+            return struct.unpack('>H', self.Data[:2])[0]
+        if self.color_type == 2:
+            return struct.unpack('>HHH', self.Data[:6])
+        raise ValueError(f"tRNS chunk not allowed for color type {self.color_type}")
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        try:
+            print(f"tRNS Data: {self.values()}")
+        except ValueError as e:
+            logger.error(e)
+            print(f"tRNS Data (raw): {bytes(self.Data).hex()}")
+
+
+@register_chunk(b'bKGD')
+class bKGDChunk(ColorTypeDependentChunk):
+    __slots__ = ()
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+
+    def values(self):
+        '''
+        Decodes background color: palette index (color type 3), gray level (0, 4) or (red, green, blue) (2, 6)
+        '''
+        if self.color_type == 3:
+            return self.Data[0]
+        if self.color_type in (0, 4):
+            return struct.unpack('>H', self.Data[:2])[0]
+        return struct.unpack('>HHH', self.Data[:6])
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        print(f"bKGD Background Color: {self.values()}")
+
+
+@register_chunk(b'sBIT')
+class sBITChunk(ColorTypeDependentChunk):
+    __slots__ = ()
+
+    def __init__(self, lenght, type, data, crc):
+        super().__init__(lenght, type, data, crc)
+
+    def values(self) -> dict:
+        '''
+        Decodes number of significant bits of each channel
+        '''
+        channels = SBIT_CHANNELS.get(self.color_type, [f"Channel {i}" for i in range(len(self.Data))])
+        return dict(zip(channels, self.Data))
+
+    def __str__(self) -> str:
+        return super().__str__()
+
+    def presentData(self):
+        table = tabulate([list(self.values().values())], headers=list(self.values().keys()))
+        print(f"sBIT Significant Bits:\n{table}\n")
@@ -1,12 +1,13 @@
-from dataclasses import dataclass
 import io
 import logging
 import struct
+import sys
+import zlib
+import numpy as np
 from tabulate import tabulate
 import pprint
-from typing import Tuple,Dict
-import matplotlib.pyplot as plt
-from e_media1.additional_data import EXIF_TAGS, data_format_bytes
+from typing import Tuple,Dict,Iterable
+from e_media1.exif import ExifIndex
 
 
 logger = logging.getLogger("loger")
@@ -14,48 +15,120 @@ logger = logging.getLogger("loger")
 
 
 
-@dataclass
-class Chunk():
+# all chunks of the same type share one bytes object with type name
+_CHUNK_TYPES: Dict[bytes, bytes] = dict()
+
+CHUNK_HEADER = struct.Struct('>I4s')
+CHUNK_CRC = struct.Struct('>I')
+
+
+def intern_chunk_type(chunk_type: bytes) -> bytes:
+    '''
+    Returns shared (interned) instance of 4-byte chunk type
+    '''
+    chunk_type = bytes(chunk_type)
+    return _CHUNK_TYPES.setdefault(chunk_type, chunk_type)
+
+
+# registry of classes used to parse chunks: chunk type -> chunk class
+chunk_bytes_parsing: Dict[bytes, type] = dict()
+
+
+def register_chunk(chunk_type: bytes):
     '''
-    Klasa bazowa dla kazdego chunka w obrazie PNG
+    Class decorator registering chunk class used for parsing given chunk type
     '''
+    def decorator(chunk_class):
+        chunk_bytes_parsing[intern_chunk_type(chunk_type)] = chunk_class
+        return chunk_class
+    return decorator
+
 
-    Lenght: bytes
-    Type: bytes
-    Data: bytes
-    CRC: bytes
+class Chunk():
+    '''
+    Klasa bazowa dla kazdego chunka w obrazie PNG.
+    Lenght i CRC przechowywane sa jako int, bajty naglowka tworzone sa dopiero przy zapisie.
+    Follows stores type of last critical chunk read before this one (position of ancillary chunk in file).
+    '''
+    __slots__ = ('Lenght', 'Type', 'Data', 'CRC', 'follows')
 
     def __init__(self,lenght,type,data,crc):
-        self.Lenght = lenght
-        self.Type = type
+        # bytes are still accepted for length and CRC (as read directly from file)
+        self.Lenght = lenght if isinstance(lenght, int) else int.from_bytes(lenght)
+        self.Type = intern_chunk_type(type)
         self.Data = data
-        self.CRC = crc
+        self.CRC = crc if isinstance(crc, int) else int.from_bytes(crc)
+        self.follows = None
 
     def __str__(self) -> str:
         return self.Type.decode()
 
-
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(Lenght={self.Lenght}, Type={self.Type}, CRC={self.CRC:08x})"
 
     def get_all_chunk_bytes(self) -> bytes:
         '''
         Returns all chunk data as sequence of bytes in required line-up
         '''
-        return bytes(self.Lenght + self.Type + self.Data + self.CRC)
+        return b''.join((CHUNK_HEADER.pack(self.Lenght, self.Type), self.Data, CHUNK_CRC.pack(self.CRC)))
+
+    def write_to(self, stream) -> None:
+        '''
+        Writes chunk to binary stream without concatenating chunk data with header
+        '''
+        stream.write(CHUNK_HEADER.pack(self.Lenght, self.Type))
+        stream.write(self.Data)
+        stream.write(CHUNK_CRC.pack(self.CRC))
     
     def get_chunk_data_bytes(self) -> bytes:
         return bytes(self.Data)
-    
+
+    def bind_header(self, ihdr) -> None:
+        '''
+        Called by parser with IHDR chunk, chunks which data depends on color type store it here
+        '''
+        pass
+
+    def presentData(self) -> None:
+        print(f"{self.Type.decode(errors='replace')} Chunk: {self.Lenght} bytes")
+
+
+def measure_chunks(chunks: Iterable[Chunk]) -> Dict[str, int]:
+    '''
+    Counts chunk objects and memory used by them (without chunk data payload)
+
+    Args:
+        *chunks -> Iterable[Chunk]: parsed chunks
+
+    Return:
+        *stats -> Dict[str, int]: number of chunks, number of python objects and their size in bytes
+    '''
+    chunks_number = 0
+    objects = dict()
+    for chunk in chunks:
+        chunks_number += 1
+        objects[id(chunk)] = sys.getsizeof(chunk) + sys.getsizeof(getattr(chunk, '__dict__', None) or ())
+        for value in (chunk.Lenght, chunk.Type, chunk.CRC):
+            objects.setdefault(id(value), sys.getsizeof(value))
+    return dict(chunks=chunks_number, objects=len(objects), bytes=sum(objects.values()))
+
+
+@register_chunk(b'IHDR')
 class IHDRChunk(Chunk):
+    __slots__ = ('width', 'height', 'depth', 'color', 'compression', 'filtration', 'interlace')
+
     def __init__(self, lenght,type,data,crc):
         super().__init__(lenght,type,data,crc)
-        self.width = int.from_bytes(self.Data[0:4])
-        self.height = int.from_bytes(self.Data[4:8])
-        self.depth = int.from_bytes(self.Data[8:9])
-        self.color = int.from_bytes(self.Data[9:10])
-        self.compression = int.from_bytes(self.Data[10:11])
-        self.filtration = int.from_bytes(self.Data[11:12])
-        self.interlace = int.from_bytes(self.Data[12:13])
+        (self.width, self.height, self.depth, self.color,
+         self.compression, self.filtration, self.interlace) = struct.unpack('>IIBBBBB', self.Data[:13])
+
 
+    def with_color_type(self, color: int):
+        '''
+        Returns new IHDR chunk with the same parameters but different color type
+        '''
+        data = struct.pack('>IIBBBBB', self.width, self.height, self.depth, color, self.compression, self.filtration, self.interlace)
+        return IHDRChunk(len(data), self.Type, data, zlib.crc32(self.Type + data) & 0xffffffff)
 
     def DecodeData(self):
         '''
@@ -71,7 +144,10 @@ class IHDRChunk(Chunk):
         return super().__str__()
 
 
+@register_chunk(b'IEND')
 class IENDChunk(Chunk):
+    __slots__ = ()
+
     def __init__(self, lenght, type, data, crc):
         super().__init__(lenght, type, data, crc)
 
@@ -79,15 +155,41 @@ class IENDChunk(Chunk):
         return super().__str__()
 
    
+@register_chunk(b'PLTE')
 class PLTEChunk(Chunk):
+    __slots__ = ('palette',)
+
     def __init__(self, lenght, type, data, crc):
         super().__init__(lenght, type, data, crc)
-        lenght_digit = int.from_bytes(lenght)
-        pallete_list = []
-        for i in range(0,lenght_digit, 3):
-            color = int.from_bytes((data[i:i+3]))
-            pallete_list.append(color)
-        self.palette = pallete_list
+        entries = self.Lenght // 3
+        # palette stored as (N, 3) array of RGB entries, (N, 4) after applying tRNS
+        self.palette = np.frombuffer(data, dtype=np.uint8, count=entries * 3).reshape(entries, 3)
+
+    def apply_transparency(self, alpha) -> None:
+        '''
+        Adds alpha channel to palette (values from tRNS chunk). Entries without alpha value are opaque.
+
+        Args:
+            *alpha: alpha values of first palette entries
+        '''
+        alpha = np.frombuffer(bytes(alpha), dtype=np.uint8)[:len(self.palette)]
+        palette = np.full((len(self.palette), 4), 255, dtype=np.uint8)
+        palette[:, :3] = self.palette[:, :3]
+        palette[:len(alpha), 3] = alpha
+        self.palette = palette
+
+    def expand(self, indices: np.array, out: np.array = None) -> np.array:
+        '''
+        Turns palette indices into RGB(A) values with single lookup
+
+        Args:
+            *indices -> np.array: palette indices (any shape)
+            *out -> np.array = None: preallocated output array
+
+        Return:
+            *colors -> np.array: array with shape indices.shape + (3,) or (4,) with tRNS
+        '''
+        return np.take(self.palette, indices, axis=0, mode='clip', out=out)
 
 
     def __str__(self) -> str:
@@ -97,13 +199,18 @@ class PLTEChunk(Chunk):
         '''
         Shows color palette of image
         '''
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots(figsize=(8, 2))
-        ax.imshow([self.palette], aspect='auto')
+        ax.imshow(self.palette[np.newaxis], aspect='auto')
         ax.axis('off')
         plt.show()
 
 
+@register_chunk(b'IDAT')
 class IDATChunk(Chunk):
+    __slots__ = ()
+
     def __init__(self, lenght, type, data, crc):
         super().__init__(lenght, type, data, crc)
     
@@ -112,7 +219,10 @@ class IDATChunk(Chunk):
     
     
 
+@register_chunk(b'gAMA')
 class gAMAChunk(Chunk):
+    __slots__ = ('gamma',)
+
     def __init__(self, lenght, type, data, crc):
         super().__init__(lenght, type, data, crc)
         self.gamma = int.from_bytes(data,'big') / 100000
@@ -126,9 +236,23 @@ class gAMAChunk(Chunk):
         print(f"Gama Data: {self.gamma}")
 
 
+@register_chunk(b'eXIf')
 class eXIFChunk(Chunk):
+    __slots__ = ('_exif',)
+
     def __init__(self, lenght, type, data, crc):
         super().__init__(lenght, type, data, crc)
+        self._exif = None
+
+    @property
+    def exif(self) -> ExifIndex:
+        '''
+        Index of all IFD entries, built on first access and cached on chunk
+        '''
+        if self._exif is None:
+            logger.info("Starting process of reading eXIF data chunk..")
+            self._exif = ExifIndex(self.Data)
+        return self._exif
 
     def readEXIF(self) -> Tuple[Dict,Dict]:
         '''
@@ -138,101 +262,16 @@ class eXIFChunk(Chunk):
                 *None
             
             Return:
-                * entries -> dict: containing eXIF data corespoding to certain MAIN tags read from primary file directory
-                * sub_entries -> dict: containing eXIF data corespoding to certain SUB_MAIN tags read from additional file directory
+                * entries -> dict: containing eXIF data corespoding to certain MAIN tags read from primary file directories (IFD0, IFD1)
+                * sub_entries -> dict: containing eXIF data corespoding to certain SUB_MAIN tags read from additional file directories (Exif, GPS, Interop)
             '''
-        logger.info("Starting process of reading eXIF data chunk..")
-        stream = io.BytesIO(self.Data)
-
-        # checking byte align: MM - big endian | II - small endian
-        byte_align = stream.read(2)
-        endian = '>' if byte_align == b'MM' else '<'
-
-        # offset to first File Directory
-        _tag_mark = stream.read(2)
-        First_IFD_Offset = int.from_bytes(stream.read(4))
-
-        # reading first IFD
+        entries, sub_entries = dict(), dict()
         try:
-            entries, next_ifd_offset = eXIFChunk.read_ifd(stream,First_IFD_Offset,endian)
-
-            # if next_if_offest exist we also read it
-            while next_ifd_offset != 0:
-                next_entries, next_ifd_offset = eXIFChunk.read_ifd(stream,next_ifd_offset,endian)  
-                entries.update(next_entries)  
+            entries = self.exif.to_dict('IFD0', 'IFD1')
+            sub_entries = self.exif.to_dict('Exif', 'GPS', 'Interop')
         except Exception as e:
-            logging.error(f"Exception during IFD Read: {e}")
-
-
-        try:
-            # reading sub_exif - helpful data about camera etc.
-            sub_entries, _ = eXIFChunk.read_ifd(stream,entries['ExifOffset'],endian)
-        except Exception as e:
-            logging.error(f"Exception during SUB-IFD read: {e}")
-
+            logger.error(f"Exception during IFD Read: {e}")
         return entries,sub_entries
-
-    @staticmethod
-    def read_ifd(stream: io.BytesIO, offset: bytes, endian: str) -> Tuple[Dict,int]:
-            '''
-            Read eXIF data from single IFD
-
-            Args:
-                *stream -> BytesIO: stream from which function will read data
-                *offset -> bytes: bytes which are localization of File Directory
-                *endian -> str: type of byte align
-            
-            Return:
-                * entries -> dict: containing eXIF data corespoding to certain tags
-                * next_ifd_offset -> long: contating offset to next File Directory. Can be 0 if next directory does not exists.
-            '''
-            stream.seek(offset)
-
-            # number of "catalogues" with IFD Data.
-            num_entries = struct.unpack(endian + 'H', stream.read(2))[0]  
-            entries = dict()
-
-            # each catalogue has 12 bytes of data
-            for _ in range(num_entries):
-                '''
-                Structure:
-                    - Tag (informacja o danej - co oznacza) - 2 bajty
-                    - Data Format (informacja o typie/formacie danej) - 2 bajty
-                    - Components Number (Ilosc komponentow) - 4 bajty -> (Data Format * Components Number) daja ilosc bajtow jakie zajmuja dane w pamieci:
-                        * jezeli powyzej 4 bajtow to *Values* zawiera offset do obszaru pamieci z faktycznymi danymi
-                        * jezeli 4 bajty lub mniej *Values* ma faktyczne dane
-                    - Values (obszar gdzie zawieraja sie fizyczne dane pod powyzszym warunkiem)
-                '''
-                entry = stream.read(8)  
-                tag, data_format, count = struct.unpack(endian + 'HHL', entry)
-                number_of_bytes = data_format_bytes.get(data_format) * count
-
-                if number_of_bytes > 4:
-                    offset_value = int.from_bytes(stream.read(4))
-                    position = stream.tell()
-                    stream.seek(offset_value)
-                    data_stream = stream.read(number_of_bytes)
-                    stream.seek(position)
-                else:
-                    data_stream = stream.read(number_of_bytes)
-                    x = stream.read(4-number_of_bytes)
-                try:
-                    # sprawdzamy typ taga zeby wiedziec jak go dekodowac
-                    if EXIF_TAGS[tag][1] == 'string':
-                        data = data_stream.rstrip(b'\x00').decode()
-                    elif EXIF_TAGS[tag][1] == 'rational':
-                        nominator,denominator = struct.unpack(endian + "LL", data_stream)
-                        data = nominator / denominator
-                    else:
-                        data = int.from_bytes(data_stream)
-
-                    entries[EXIF_TAGS[tag][0]] = data
-                except Exception as e:
-                    logger.error(f"Error reading IFD catalogue: {e}")
-
-            #offset do nastepnego IFD
-            next_ifd_offset = struct.unpack(endian + 'L', stream.read(4))[0]  
-            return entries, next_ifd_offset
     
     def __str__(self) -> str:
         return super().__str__()
@@ -247,7 +286,10 @@ class eXIFChunk(Chunk):
         pprint.pprint(sub_ifd)
 
 
+@register_chunk(b'cHRM')
 class cHRMChunk(Chunk):
+    __slots__ = ('white_point_x', 'white_point_y', 'red_x', 'red_y', 'green_x', 'green_y', 'blue_x', 'blue_y')
+
     def __init__(self, lenght, type, data, crc):
         super().__init__(lenght, type, data, crc)
         stream = io.BytesIO(data)
@@ -0,0 +1,118 @@
+import logging
+import os
+import random
+
+try:
+    import gmpy2
+    GMPY2_AVAILABLE = True
+except ImportError:
+    GMPY2_AVAILABLE = False
+
+logger = logging.getLogger("loger")
+
+# GMP arithmetic is used when gmpy2 is installed, E_MEDIA1_NO_GMP=1 forces built-in int
+USE_GMP = GMPY2_AVAILABLE and not os.environ.get("E_MEDIA1_NO_GMP")
+BACKEND = 'gmpy2' if USE_GMP else 'builtin'
+
+
+def to_backend(value: int):
+    '''
+    Converts number used many times (key exponent, modulus) to backend type once, instead of on every operation
+    '''
+    return gmpy2.mpz(value) if USE_GMP else value
+
+
+def powmod(base, exponent, modulus):
+    return gmpy2.powmod(base, exponent, modulus) if USE_GMP else pow(base, exponent, modulus)
+
+
+def from_bytes(data: bytes):
+    '''
+    Big endian bytes to number of backend type
+    '''
+    return gmpy2.mpz.from_bytes(data, 'big') if USE_GMP else int.from_bytes(data, 'big')
+
+
+def to_bytes(value, length: int) -> bytes:
+    '''
+    Number to big endian bytes with given length (works for int and mpz)
+    '''
+    return value.to_bytes(length, 'big')
+
+
+def miller_rabin(n: int, k: int = 128) -> bool:
+    '''
+    Miller-Rabin primality test with k random witnesses (built-in int implementation)
+    '''
+    if n == 2 or n == 3:
+        return True
+    if n <= 1 or n % 2 == 0:
+        return False
+    s = 0
+    r = n - 1
+    while r & 1 == 0:
+        s += 1
+        r //= 2
+    for _ in range(k):
+        a = random.randrange(2, n - 1)
+        x = pow(a, r, n)
+        if x != 1 and x != n - 1:
+            j = 1
+            while j < s and x != n - 1:
+                x = pow(x, 2, n)
+                if x == 1:
+                    return False
+                j += 1
+            if x != n - 1:
+                return False
+    return True
+
+
+def is_prime(n: int, k: int = 128) -> bool:
+    '''
+    Probabilistic primality test with k Miller-Rabin rounds, done by GMP when available
+    '''
+    if USE_GMP:
+        return bool(gmpy2.is_prime(n, k))
+    return miller_rabin(n, k)
+
+
+if __name__ == '__main__':
+    import time
+    from e_media1.logger_setup import setup_color_logging
+
+    setup_color_logging()
+    logger.info(f"gmpy2 available: {GMPY2_AVAILABLE}, backend: {BACKEND}")
+    if not GMPY2_AVAILABLE:
+        raise SystemExit("gmpy2 is not installed - nothing to compare")
+
+    rng = random.Random(0)
+    modulus = rng.getrandbits(2048) | 1 | (1 << 2047)
+    exponent = rng.getrandbits(2048)
+    blocks = [rng.getrandbits(2040).to_bytes(255, 'big') for _ in range(50)]
+    candidates = [rng.getrandbits(1024) | 1 for _ in range(200)]
+
+    def measure(operation, repeats: int = 1) -> float:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = operation()
+        return (time.perf_counter() - start) / repeats, result
+
+    mpz_exponent, mpz_modulus = gmpy2.mpz(exponent), gmpy2.mpz(modulus)
+    benchmarks = {
+        'powmod (2048 bit, 50 blocks)': (
+            lambda: [pow(int.from_bytes(block, 'big'), exponent, modulus).to_bytes(256, 'big') for block in blocks],
+            lambda: [gmpy2.powmod(gmpy2.mpz.from_bytes(block, 'big'), mpz_exponent, mpz_modulus).to_bytes(256, 'big') for block in blocks]),
+        'bytes conversion (50 blocks)': (
+            lambda: [int.from_bytes(block, 'big').to_bytes(255, 'big') for block in blocks],
+            lambda: [gmpy2.mpz.from_bytes(block, 'big').to_bytes(255, 'big') for block in blocks]),
+        'Miller-Rabin (200 x 1024 bit)': (
+            lambda: [miller_rabin(candidate, 128) for candidate in candidates],
+            lambda: [bool(gmpy2.is_prime(candidate, 128)) for candidate in candidates]),
+    }
+    for name, (builtin_operation, gmp_operation) in benchmarks.items():
+        builtin_time, builtin_result = measure(builtin_operation)
+        gmp_time, gmp_result = measure(gmp_operation)
+        identical = builtin_result == gmp_result
+        logger.info(f"{name}: builtin {builtin_time * 1000:.1f} ms, gmpy2 {gmp_time * 1000:.1f} ms, "
+                    f"speedup {builtin_time / gmp_time:.1f}x, identical results: {identical}")
@@ -1,13 +1,21 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import Dict, List, Iterable, Iterator, Tuple
 import logging
 from e_media1.basechunks import *
+# registering decoders of remaining ancillary chunks (tEXt, zTXt, iCCP, ...)
+from e_media1.ancillarychunks import *
 from e_media1.filtering_methods import ReconstructingMethods,FilteringMethods
-from e_media1.encrypt import ECB, CBC
+from e_media1.encrypt import RSA, ECB, CBC, cipher_modes, save_manifest, load_manifest
+from e_media1.decode_cache import DecodeCache
+from e_media1.aio import AsyncRunner, get_default_runner, read_file, write_file
+from e_media1.scratch import ScratchSpace, IN_MEMORY
+from e_media1.shared_pool import SharedMemoryPool
 from e_media1.additional_data import *
 import numpy as np
 import png
 import zlib
+import itertools
+import io
 import logging
 import os
 from pathlib import Path
@@ -58,35 +66,70 @@ class CriticalChunks:
         return zlib.decompress(concatinatedData)
     
 
-    def reconstruct_IDAT_data(self) -> np.array:
+    def iter_scanlines(self) -> Iterator[np.array]:
+        '''
+        Function yielding reconstructed scanlines one by one, IDAT data is decompressed incrementally
+        '''
+        return iter_scanlines(self.IHDR, (chunk.Data for chunk in self.IDAT))
+
+    def decode_region(self, row_start: int, row_stop: int, col_slice: slice = None) -> np.array:
+        '''
+        Function decoding only band of rows (row_start:row_stop) and chosen columns, decompression stops after last requested row
+        '''
+        return decode_region(self.IHDR, (chunk.Data for chunk in self.IDAT), row_start, row_stop, col_slice)
+
+    def decode_thumbnail(self, scale: int) -> np.array:
+        '''
+        Function decoding box filtered image reduced 2, 4 or 8 times without full resolution array
+        '''
+        return decode_thumbnail(self.IHDR, (chunk.Data for chunk in self.IDAT), scale, self.PLTE)
+
+    def expand_palette(self, indices: np.array, scratch: ScratchSpace = None) -> np.array:
+        '''
+        Function turning palette indices (color type 3) into RGB or RGBA (with tRNS) data.
+        Data of other color types is returned unchanged.
+
+        Args:
+            *indices -> np.array: decoded IDAT data (height x width x 1)
+            *scratch -> ScratchSpace = None: allocator of output array (e.g. memory mapped)
+
+        Return:
+            *expanded -> np.array: data with shape (height x width x 3) or (height x width x 4)
+        '''
+        if self.IHDR.color != 3 or self.PLTE is None:
+            return indices
+        if scratch is None:
+            return self.PLTE.expand(indices[:, :, 0])
+        expanded = scratch.empty(indices.shape[:2] + self.PLTE.palette.shape[1:])
+        return self.PLTE.expand(indices[:, :, 0], out=expanded)
+
+    def reconstruct_IDAT_data(self, expand_palette: bool = False, scratch: ScratchSpace = None) -> np.array:
         '''
         Function used to reconstruct IDAT Data from compressed form.
         Data is not only compressed but also filtered so we need to inverse it and filter it out.
 
+        Args:
+            *expand_palette -> bool = False: if True palette indices are turned into RGB(A) values
+            *scratch -> ScratchSpace = None: allocator of output array, scanlines are written into it in place
+
         Return:
-            *Reconstructed -> List: List storing filtered out data
+            *Reconstructed -> np.array: array storing filtered out data (height x width x bytes per pixel)
         '''
         height = self.IHDR.height
         width = self.IHDR.width
-        decompressed_data = self.decompress_IDAT_data()
         bytes_per_pixel = color_type_bytes.get(self.IHDR.color,None)
-        expected_IDAT_data_length = height * (1 + width * bytes_per_pixel)
-        if(len(decompressed_data) != expected_IDAT_data_length):
-            logger.error(f"Decompressed Data Lenght not correct: {len(decompressed_data)} vs expected: {expected_IDAT_data_length}")
-        Reconstructed = []
-        i = 0
         if bytes_per_pixel is None:
             logger.error("Wrong Color Type")
-        for row in range(height):
-            filter_method = decompressed_data[i]
-            i += 1
-            method = filtering_methods.get(filter_method)
-            for col in range(width * bytes_per_pixel):
-                x = decompressed_data[i]
-                i+=1
-                reconstructed = method(x, row, col, Reconstructed, width, bytes_per_pixel)
-                Reconstructed.append(reconstructed & 0xff)
-        Reconstructed = np.array(Reconstructed,dtype=np.uint8).reshape(height,width,bytes_per_pixel)
+        Reconstructed = (scratch or IN_MEMORY).empty((height, width * bytes_per_pixel))
+        rows = 0
+        for row, scanline in enumerate(self.iter_scanlines()):
+            Reconstructed[row] = scanline
+            rows += 1
+        if rows != height:
+            logger.error(f"Decompressed Data Lenght not correct: {rows} rows vs expected: {height}")
+        Reconstructed = Reconstructed.reshape(height,width,bytes_per_pixel)
+        if expand_palette:
+            return self.expand_palette(Reconstructed, scratch)
         return Reconstructed
     
     def create_IDAT_Chunk(self, encrypted_data: bytes, max_chunk_size: int = 65524) -> List[IDATChunk]:
@@ -107,11 +150,9 @@ class CriticalChunks:
         for start in range(0, total_length, max_chunk_size):
             end = start + max_chunk_size
             chunk_data = encrypted_data[start:end]
-            length = struct.pack("!I", len(chunk_data))
             crc_data = chunk_type + chunk_data
-            new_crc = zlib.crc32(crc_data)
-            new_crc = struct.pack('>I', new_crc & 0xffffffff)
-            idat_chunk = IDATChunk(length, chunk_type, chunk_data, new_crc)
+            new_crc = zlib.crc32(crc_data) & 0xffffffff
+            idat_chunk = IDATChunk(len(chunk_data), chunk_type, chunk_data, new_crc)
             chunks.append(idat_chunk)
 
         return chunks
@@ -167,14 +208,27 @@ class Image:
     rawIDATData: np.array
     path_to_save: str
     hidden_chunk: Chunk
+    scratch: ScratchSpace
 
-    def __init__(self, image_binary_data, save_path: str):
+    def __init__(self, image_binary_data, save_path: str, decode_cache: DecodeCache = None, expand_palette: bool = False, scratch: ScratchSpace = None):
         self.path_to_save = save_path
+        # working arrays (decoded, encrypted and decrypted data) are memory mapped if scratch directory is given
+        self.scratch = scratch
         _critical,_ancillary,hidden_chunk = self.read_image_binary_data(image_binary_data)
         self.criticalChunks = CriticalChunks(_critical)
         self.ancillaryChunks = AncillaryChunks(_ancillary)
         self.hidden_chunk = hidden_chunk
-        self.rawIDATData = self.criticalChunks.reconstruct_IDAT_data()
+        if self.criticalChunks.PLTE is not None:
+            for chunk in self.ancillaryChunks.ChunkList:
+                if chunk.Type == b'tRNS':
+                    self.criticalChunks.PLTE.apply_transparency(chunk.Data)
+        if decode_cache is not None:
+            # decoded data is read-only memory map when found in cache
+            self.rawIDATData = decode_cache.get_or_decode(self.criticalChunks)
+        else:
+            self.rawIDATData = self.criticalChunks.reconstruct_IDAT_data(scratch=scratch)
+        if expand_palette:
+            self.rawIDATData = self.criticalChunks.expand_palette(self.rawIDATData, scratch)
 
     @staticmethod
     def read_image_binary_data(image_binary_data):
@@ -186,10 +240,13 @@ class Image:
             while image_binary_data:
                 try:
                     # odczytujemy dane z chunka
-                    _length = image_binary_data.read(4)
-                    _type = image_binary_data.read(4)
-                    _data = image_binary_data.read(int.from_bytes(_length))
-                    _crc = image_binary_data.read(4)
+                    header = image_binary_data.read(CHUNK_HEADER.size)
+                    if len(header) < CHUNK_HEADER.size:
+                        logger.error("End of file reached before IEND chunk")
+                        break
+                    _length, _type = CHUNK_HEADER.unpack(header)
+                    _data = image_binary_data.read(_length)
+                    _crc = CHUNK_CRC.unpack(image_binary_data.read(CHUNK_CRC.size))[0]
 
                     # jezeli typu nie ma w slowniku inicjowana jest klasa bazowa
                     chunk_class = chunk_bytes_parsing.get(_type,Chunk)
@@ -200,21 +257,24 @@ class Image:
                     if letter.isupper():
                         CriticalChunkList.append(chunk)
                     else:
-                        if chunk.Type in chunk_bytes_parsing.keys():
-                            AncillaryChunkList.append(chunk)
+                        if CriticalChunkList:
+                            chunk.bind_header(CriticalChunkList[0])
+                            chunk.follows = CriticalChunkList[-1].Type
+                        AncillaryChunkList.append(chunk)
                 except Exception as e:
                     logger.error(f"Error during loading chunk {e}")
                     continue
                 if chunk.Type == b'IEND':
                     break
             try:
-                _length = image_binary_data.read(4)
-                _type = image_binary_data.read(4)
-                _data = image_binary_data.read(int.from_bytes(_length))
-                _crc = image_binary_data.read(4)  
+                _length, _type = CHUNK_HEADER.unpack(image_binary_data.read(CHUNK_HEADER.size))
+                _data = image_binary_data.read(_length)
+                _crc = CHUNK_CRC.unpack(image_binary_data.read(CHUNK_CRC.size))[0]
                 hidden_chunk = Chunk(_length,_type,_data,_crc)
             except:
                 hidden_chunk = None
+            stats = measure_chunks(itertools.chain(CriticalChunkList, AncillaryChunkList))
+            logger.debug(f"Parsed {stats['chunks']} chunks: {stats['objects']} objects, {stats['bytes']} bytes without chunk data")
             return CriticalChunkList, AncillaryChunkList, hidden_chunk
         else:
             raise ValueError("Wrong File Format!")
@@ -233,13 +293,15 @@ class Image:
         '''
         
         img_binary_file.write(SIGNATURE)
-        img_binary_file.write(self.criticalChunks.IHDR.get_all_chunk_bytes())
+        self.criticalChunks.IHDR.write_to(img_binary_file)
         if exclude_ancillary is False:
-            img_binary_file.write(self.ancillaryChunks.return_chunk_data())
+            for chunk in self.ancillaryChunks.ChunkList:
+                chunk.write_to(img_binary_file)
         if self.criticalChunks.PLTE is not None:
-            img_binary_file.write(self.criticalChunks.PLTE.get_all_chunk_bytes())
-        img_binary_file.write(self.criticalChunks.return_whole_IDAT())
-        img_binary_file.write(self.criticalChunks.IEND.get_all_chunk_bytes())
+            self.criticalChunks.PLTE.write_to(img_binary_file)
+        for chunk in self.criticalChunks.IDAT:
+            chunk.write_to(img_binary_file)
+        self.criticalChunks.IEND.write_to(img_binary_file)
         return img_binary_file
 
 
@@ -287,74 +349,156 @@ class Image:
         
     
 
-    def encrypt_and_decrypt_image_using_ecb(self, library_func:bool = False) -> None:
+    def encrypt_and_decrypt_image_using_ecb(self, library_func:bool = False, encrypt_compressed:bool = False, pool: SharedMemoryPool = None) -> Dict[str, str]:
         '''
         Encrypt image data with ECB algorithm
 
         Args:
             *encrypt_compressed -> bool = False: If True compressed IDAT data is encrypted (we skip process of filtering out the data)
             *library_func -> bool = False: If True we use external library function to perform encryption (crypthography library)
+            *pool -> SharedMemoryPool = None: If given blocks are encrypted and decrypted by worker processes
         
         Return:
-            *None
+            *paths -> Dict[str, str]: paths to 'encrypted' and 'decrypted' images saved in this call
+                                      (empty for compressed data, which is saved under other names)
         '''
+        paths = dict()
+        if encrypt_compressed:
+            self.encrypt_and_decrypt_compressed('ecb')
+            return paths
         encrypted_filename = "ecb_encrypt.png"
         decrypted_filename = "ecb_decrypt.png"
-        path = Path(self.path_to_save + encrypted_filename)
 
         try:
-            ecb = ECB(image_shape=self.rawIDATData.shape)
-            encrypted, padded_data = ecb.encrypt(self.rawIDATData)
+            ecb = ECB(image_shape=self.rawIDATData.shape, scratch=self.scratch)
+            if pool is not None:
+                encrypted, padded_data = ecb.encrypt_parallel(self.rawIDATData, pool)
+            else:
+                encrypted, padded_data = ecb.encrypt(self.rawIDATData)
             
-            self.save_image_by_chunks(encrypted_filename, encrypted,padded_data)
+            paths['encrypted'] = self.save_image_by_chunks(encrypted_filename, encrypted,padded_data)
 
             if library_func:
                 encrypted = ecb.encrypt_with_library(self.rawIDATData)
                 self.save_images_with_png_library(self.path_to_save, filename='ecb_encrypt_library.png',data=encrypted)
         except Exception as e:
             logger.error(f"Error with ECB encryption in encrypt_image_using_ecb function: {e}")
+        # only image encrypted in this call is decrypted (never file left by previous run)
+        if paths.get('encrypted') is None:
+            return dict()
         try:
-            if os.path.exists(path):
-                with open(path,'r+b') as encrypted_binary_img:
-                    image = Image(encrypted_binary_img, self.path_to_save)
-                if image.hidden_chunk is not None:
-                        int_hidden_chunk_data = np.frombuffer(image.hidden_chunk.get_chunk_data_bytes(),dtype=np.uint8)
+            with open(paths['encrypted'],'r+b') as encrypted_binary_img:
+                image = Image(encrypted_binary_img, self.path_to_save, scratch=self.scratch)
+            if image.hidden_chunk is not None:
+                    int_hidden_chunk_data = np.frombuffer(image.hidden_chunk.get_chunk_data_bytes(),dtype=np.uint8)
+            if pool is not None:
+                decrypted = ecb.decrypt_parallel(image.rawIDATData, int_hidden_chunk_data, pool)
+            else:
                 decrypted = ecb.decrypt(image.rawIDATData, int_hidden_chunk_data)
-                self.save_image_by_chunks(decrypted_filename,decrypted)
+            paths['decrypted'] = self.save_image_by_chunks(decrypted_filename,decrypted)
         except Exception as e:
             logger.error(f"Error with ECB decryption in encrypt_image_using_ecb function: {e}")
+        return {name: path for name, path in paths.items() if path is not None}
 
-    def encrypt_and_decrypt_image_using_cbc(self):
+    def encrypt_ecb_incremental(self, ecb: ECB, file_name: str = "ecb_encrypt.png") -> int:
+        '''
+        Encrypts image with ECB and keeps per-block digest manifest next to encrypted image ({file_name}.manifest.npz).
+        If encrypted image and manifest made with the same keys already exist, only blocks which plaintext changed
+        are encrypted - ciphertext and cnKS tail of existing image are patched and image is saved again.
+
+        Args:
+            *ecb -> ECB: cipher with keys (e.g. ECB.from_key_file), image_shape is set to shape of image data
+            *file_name -> str = "ecb_encrypt.png": name of encrypted image
+
+        Return:
+            *encrypted_blocks -> int: number of blocks encrypted in this run
+        '''
+        path = f"{self.path_to_save}/{file_name}"
+        manifest_path = f"{path}.manifest.npz"
+        ecb.image_shape = self.rawIDATData.shape
+        manifest = load_manifest(manifest_path) if os.path.exists(path) else None
+        digests = None
+        if manifest is not None and manifest['key'] == ecb.key_fingerprint() and manifest['image_shape'] == self.rawIDATData.shape:
+            try:
+                with open(path, 'rb') as encrypted_binary_img:
+                    image = Image(encrypted_binary_img, self.path_to_save, scratch=self.scratch)
+                encrypted = np.array(image.rawIDATData)
+                padded = np.frombuffer(image.hidden_chunk.get_chunk_data_bytes(), dtype=np.uint8).copy()
+                digests, encrypted_blocks = ecb.encrypt_incremental(self.rawIDATData, encrypted, padded, manifest['digests'])
+            except Exception as e:
+                logger.error(f"Incremental encryption not possible, whole image is encrypted: {e}")
+                digests = None
+        if digests is None:
+            encrypted, padded = ecb.encrypt(self.rawIDATData)
+            digests = ecb.block_digests(self.rawIDATData)
+            encrypted_blocks = len(digests)
+        if self.save_image_by_chunks(file_name, encrypted, padded) is None:
+            # manifest of image which was not saved would mark blocks of old image as up to date
+            raise ValueError(f"Saving {file_name} failed, manifest was not updated")
+        save_manifest(manifest_path, digests, self.rawIDATData.shape, ecb.key_fingerprint())
+        return encrypted_blocks
+
+    def encrypt_and_decrypt_image_using_cbc(self, encrypt_compressed:bool = False, pool: SharedMemoryPool = None) -> Dict[str, str]:
         '''
         Encrypt image data with CBC algorithm
 
         Args:
-            *None
+            *encrypt_compressed -> bool = False: If True compressed IDAT data is encrypted (we skip process of filtering out the data)
+            *pool -> SharedMemoryPool = None: If given blocks are decrypted by worker processes (encryption is sequential)
         
         Return:
-            *None
+            *paths -> Dict[str, str]: paths to 'encrypted' and 'decrypted' images saved in this call
+                                      (empty for compressed data, which is saved under other names)
         '''
+        paths = dict()
+        if encrypt_compressed:
+            self.encrypt_and_decrypt_compressed('cbc')
+            return paths
         encrypted_filename = "cbc_encrypt.png"
         decrypted_filename = "cbc_decrypt.png"
-        path = Path(self.path_to_save + encrypted_filename)
         try:
-            cbc = CBC(image_shape=self.rawIDATData.shape)
+            cbc = CBC(image_shape=self.rawIDATData.shape, scratch=self.scratch)
             encrypted,padded = cbc.encrypt(self.rawIDATData)
-            self.save_image_by_chunks(encrypted_filename, encrypted, padded)
+            paths['encrypted'] = self.save_image_by_chunks(encrypted_filename, encrypted, padded)
         except Exception as e:
             logger.error(f"Error with CBC encryption in encrypt_image_using_cbc function: {e}")
+        if paths.get('encrypted') is None:
+            return dict()
         try:
-            with open(path,'r+b') as encrypted_binary_img:
-                image = Image(encrypted_binary_img, self.path_to_save)
+            with open(paths['encrypted'],'r+b') as encrypted_binary_img:
+                image = Image(encrypted_binary_img, self.path_to_save, scratch=self.scratch)
             if image.hidden_chunk is not None:
                 int_hidden_chunk_data = np.frombuffer(image.hidden_chunk.get_chunk_data_bytes(),dtype=np.uint8)
-            decrypted = cbc.decrypt(image.rawIDATData,int_hidden_chunk_data)
-            self.save_image_by_chunks(decrypted_filename,decrypted)
+            if pool is not None:
+                decrypted = cbc.decrypt_parallel(image.rawIDATData, int_hidden_chunk_data, pool)
+            else:
+                decrypted = cbc.decrypt(image.rawIDATData,int_hidden_chunk_data)
+            paths['decrypted'] = self.save_image_by_chunks(decrypted_filename,decrypted)
         except Exception as e:
             logger.error(f"Error with CBC decryption in encrypt_image_using_cbc function: {e}")
+        return {name: path for name, path in paths.items() if path is not None}
 
 
-    def save_image_by_chunks(self, file_name:str, image_data: np.array, padding_to_be_save_after_IEND:np.array = None):
+    def encrypt_and_decrypt_compressed(self, mode: str = 'aes') -> bool:
+        '''
+        Encrypts compressed IDAT data (without decompression and filtering) with ECB, CBC or AES. Ciphertext is stored
+        in private ciPH chunks of encrypted image and decrypted image has IDAT chunks identical to original ones.
+
+        Args:
+            *mode -> str = 'aes': 'ecb', 'cbc' or 'aes'
+
+        Return:
+            *restored -> bool: True if decrypted IDAT chunks are identical to original
+        '''
+        from e_media1.compressed_crypto import encrypt_and_decrypt_compressed
+
+        try:
+            return encrypt_and_decrypt_compressed(self.criticalChunks, self.ancillaryChunks.ChunkList, self.path_to_save, mode)
+        except Exception as e:
+            logger.error(f"Error with {mode.upper()} encryption of compressed data: {e}")
+            return False
+
+    def save_image_by_chunks(self, file_name:str, image_data: np.array, padding_to_be_save_after_IEND:np.array = None) -> str:
         '''
         Function to save data with 'raw' method, just by writting bytes to file with option to hide data after IEND chunk
 
@@ -364,34 +508,131 @@ class Image:
             * padding_to_be_save_after_IEND (np.array): data to be hidden after IEND chunk
         
         Return:
-            *None
+            *path -> str: path to saved image, None if saving failed
         '''
         logger.info(f"Saving image {file_name}")
+        path = f"{self.path_to_save}/{file_name}"
         try:
-            with open(f"{self.path_to_save}/{file_name}",'wb') as output_file:
+            png_bytes = self.serialize_by_chunks(image_data, padding_to_be_save_after_IEND)
+            with open(path,'wb') as output_file:
+                output_file.write(png_bytes)
+            return path
+        except Exception as e:
+            logger.error(f"Saving image failed: {e}")
+            return None
 
-                #writing signature and IHDR chunk
-                output_file.write(SIGNATURE)
-                output_file.write(self.criticalChunks.IHDR.get_all_chunk_bytes())
-                if self.criticalChunks.PLTE is not None:
-                    output_file.write(self.criticalChunks.PLTE.get_all_chunk_bytes())
+    def serialize_by_chunks(self, image_data: np.array, padding_to_be_save_after_IEND: np.array = None) -> bytes:
+        '''
+        Function building bytes of PNG file with given data (file content of save_image_by_chunks)
 
-                compressed_data  = zlib.compress(FilteringMethods.NoneFilter(image_data))
-                self.criticalChunks.IDAT = self.criticalChunks.create_IDAT_Chunk(compressed_data)
-                output_file.write(self.criticalChunks.return_whole_IDAT())
+        Args:
+            *image_data (np.array): data which is main contend of image
+            * padding_to_be_save_after_IEND (np.array): data to be hidden after IEND chunk
 
-                output_file.write(self.criticalChunks.IEND.get_all_chunk_bytes())
+        Return:
+            *png_bytes -> bytes: content of PNG file
+        '''
+        output_file = io.BytesIO()
+
+        #writing signature and IHDR chunk
+        output_file.write(SIGNATURE)
+        ihdr = self.criticalChunks.IHDR
+        plte = self.criticalChunks.PLTE
+        channels = image_data.shape[2]
+        if channels != color_type_bytes.get(ihdr.color):
+            # e.g. palette expanded to RGB(A) - header has to describe saved data
+            ihdr = ihdr.with_color_type(channels_color_type[channels])
+            plte = None
+        ihdr.write_to(output_file)
+        if plte is not None:
+            plte.write_to(output_file)
+
+        compressed_data  = zlib.compress(FilteringMethods.NoneFilter(image_data))
+        # IDAT of image is not replaced, so image can be saved from many threads and keeps original data
+        idat_chunks = self.criticalChunks.create_IDAT_Chunk(compressed_data)
+        for chunk in idat_chunks:
+            chunk.write_to(output_file)
+
+        self.criticalChunks.IEND.write_to(output_file)
+
+        if padding_to_be_save_after_IEND is not None:
+            custom_type = b'cnKS'  # Custom chunk type, 4 bytes, must be uppercase
+            padded_bytes = padding_to_be_save_after_IEND.flatten().tobytes()
+            custom_crc = zlib.crc32(custom_type + padded_bytes) & 0xffffffff  # CRC
+            chunk = Chunk(len(padded_bytes),custom_type,padded_bytes,custom_crc)
+            chunk.write_to(output_file)
+        return output_file.getvalue()
+
+    @classmethod
+    async def aopen(cls, path: str, save_path: str, decode_cache: DecodeCache = None, expand_palette: bool = False, runner: AsyncRunner = None) -> 'Image':
+        '''
+        Asynchronous counterpart of constructor, file is read in I/O executor and decoded in CPU executor
 
-                if padding_to_be_save_after_IEND is not None:
-                    custom_type = b'cnKS'  # Custom chunk type, 4 bytes, must be uppercase
-                    padded_bytes = padding_to_be_save_after_IEND.flatten().tobytes()
-                    custom_length = struct.pack('>I', len(padding_to_be_save_after_IEND))  # Length of the data
-                    custom_crc = struct.pack('>I', zlib.crc32(custom_type + padded_bytes) & 0xffffffff)  # CRC
-                    chunk = Chunk(custom_length,custom_type,padded_bytes,custom_crc)
-                    output_file.write(chunk.get_all_chunk_bytes())
+        Args:
+            *path -> str: path to PNG file
+            *save_path -> str: directory of output images
+            *runner -> AsyncRunner = None: executors and concurrency limiter (shared default runner if None)
 
-        except Exception as e:
-            logger.error(f"Saving image failed: {e}")
+        Return:
+            *image -> Image: decoded image
+        '''
+        runner = runner or get_default_runner()
+        async with runner.limit():
+            image_bytes = await read_file(path, runner)
+            return await runner.run_cpu(_image_from_bytes, image_bytes, save_path, decode_cache, expand_palette)
+
+    async def asave(self, file_name: str, image_data: np.array, padding_to_be_save_after_IEND: np.array = None, runner: AsyncRunner = None) -> str:
+        '''
+        Asynchronous counterpart of save_image_by_chunks
+
+        Return:
+            *path -> str: path to saved image
+        '''
+        runner = runner or get_default_runner()
+        async with runner.limit():
+            return await self._asave(file_name, image_data, padding_to_be_save_after_IEND, runner)
+
+    async def _asave(self, file_name: str, image_data: np.array, padding: np.array, runner: AsyncRunner) -> str:
+        logger.info(f"Saving image {file_name}")
+        # serialization is dominated by zlib compression, which releases GIL, so it runs in thread
+        png_bytes = await runner.run_io(self.serialize_by_chunks, image_data, padding)
+        path = f"{self.path_to_save}/{file_name}"
+        await write_file(path, png_bytes, runner)
+        return path
+
+    async def aencrypt(self, mode: str = 'ecb', decrypt: bool = True, runner: AsyncRunner = None) -> Dict[str, str]:
+        '''
+        Asynchronous counterpart of encrypt_and_decrypt_image_using_ecb / _cbc. Key generation, encryption
+        and decryption are run in CPU executor, saving and reading images in I/O executor.
+
+        Args:
+            *mode -> str = 'ecb': 'ecb' or 'cbc'
+            *decrypt -> bool = True: if True saved encrypted image is read back, decrypted and saved
+            *runner -> AsyncRunner = None: executors and concurrency limiter (shared default runner if None)
+
+        Return:
+            *paths -> Dict[str, str]: paths to 'encrypted' and 'decrypted' images
+        '''
+        cipher_class = cipher_modes.get(mode)
+        # only RSA modes encrypt decoded pixel data, AES is used for compressed data
+        if cipher_class is None or not issubclass(cipher_class, RSA):
+            raise ValueError(f"Unknown encryption mode: {mode}")
+        runner = runner or get_default_runner()
+        async with runner.limit():
+            try:
+                cipher = await runner.run_cpu(cipher_class, image_shape=self.rawIDATData.shape)
+                cipher, encrypted, padded = await runner.run_cpu(_encrypt_data, cipher, self.rawIDATData)
+                paths = dict(encrypted=await self._asave(f"{mode}_encrypt.png", encrypted, padded, runner))
+                if decrypt:
+                    image_bytes = await read_file(paths['encrypted'], runner)
+                    image = await runner.run_cpu(_image_from_bytes, image_bytes, self.path_to_save)
+                    hidden_data = np.frombuffer(image.hidden_chunk.get_chunk_data_bytes(), dtype=np.uint8)
+                    decrypted = await runner.run_cpu(cipher.decrypt, image.rawIDATData, hidden_data)
+                    paths['decrypted'] = await self._asave(f"{mode}_decrypt.png", decrypted, None, runner)
+                return paths
+            except Exception as e:
+                logger.error(f"Error with {mode.upper()} encryption in aencrypt function: {e}")
+                raise
 
 
 
@@ -410,15 +651,329 @@ class Image:
             self.criticalChunks.PLTE.show_palette()
 
 
-chunk_bytes_parsing = {
-    b'IHDR':IHDRChunk,
-    b'IEND':IENDChunk,
-    b'PLTE':PLTEChunk,
-    b'IDAT':IDATChunk,
-    b'cHRM':cHRMChunk,
-    b'gAMA':gAMAChunk,
-    b'eXIf':eXIFChunk,
-}
+def _image_from_bytes(image_bytes: bytes, save_path: str, decode_cache: DecodeCache = None, expand_palette: bool = False) -> Image:
+    # module level function, so it can be run in process pool
+    return Image(io.BytesIO(image_bytes), save_path, decode_cache=decode_cache, expand_palette=expand_palette)
+
+
+def _encrypt_data(cipher, raw_data: np.array):
+    # cipher is returned, because encryption sets its state (added bytes) needed for decryption
+    encrypted, padded = cipher.encrypt(raw_data)
+    return cipher, encrypted, padded
+
+
+def iter_filtered_scanlines(ihdr: IHDRChunk, idat_payloads: Iterable[bytes]) -> Iterator[Tuple[int, bytes]]:
+    '''
+    Decompresses IDAT payloads incrementally and yields filtered scanlines
+
+    Args:
+        *ihdr -> IHDRChunk: header of image
+        *idat_payloads -> Iterable[bytes]: Data of consecutive IDAT chunks, next payload is taken only when needed
+
+    Return:
+        *Iterator[Tuple[int, bytes]]: filter type and filtered scanline (without filter type byte)
+    '''
+    bytes_per_pixel = color_type_bytes.get(ihdr.color, None)
+    if bytes_per_pixel is None:
+        raise ValueError(f"Wrong Color Type: {ihdr.color}")
+    stride = ihdr.width * bytes_per_pixel
+    # decompressed output is limited so that single huge IDAT chunk is also streamed
+    max_output = max(stride + 1, 1 << 16)
+    decompressor = zlib.decompressobj()
+    buffer = bytearray()
+    row = 0
+    for payload in itertools.chain(idat_payloads, [b'']):
+        data = payload
+        while True:
+            if data:
+                buffer += decompressor.decompress(data, max_output)
+                data = decompressor.unconsumed_tail
+            elif not payload:
+                buffer += decompressor.flush()
+            position = 0
+            while row < ihdr.height and len(buffer) - position > stride:
+                yield buffer[position], bytes(buffer[position + 1:position + 1 + stride])
+                position += stride + 1
+                row += 1
+            # dropping already consumed bytes
+            del buffer[:position]
+            if row == ihdr.height or not data:
+                break
+        if row == ihdr.height:
+            return
+
+
+def iter_scanlines(ihdr: IHDRChunk, idat_payloads: Iterable[bytes]) -> Iterator[np.array]:
+    '''
+    Yields reconstructed (defiltered) scanlines, only previous scanline is kept in memory
+
+    Args:
+        *ihdr -> IHDRChunk: header of image
+        *idat_payloads -> Iterable[bytes]: Data of consecutive IDAT chunks
+
+    Return:
+        *Iterator[np.array]: reconstructed scanlines with width * bytes_per_pixel bytes
+    '''
+    bytes_per_pixel = color_type_bytes.get(ihdr.color, None)
+    previous = None
+    for filter_type, scanline in iter_filtered_scanlines(ihdr, idat_payloads):
+        previous = ReconstructingMethods.reconstruct_scanline(filter_type, scanline, previous, bytes_per_pixel)
+        yield previous
+
+
+def decode_region(ihdr: IHDRChunk, idat_payloads: Iterable[bytes], row_start: int, row_stop: int, col_slice: slice = None, max_pending: int = 64) -> np.array:
+    '''
+    Decodes horizontal band of image. Rows before the band are only decompressed, they are defiltered only
+    when band depends on them (Up, Average and Paeth filters use previous row, None and Sub do not).
+    Decompression stops after last requested row, remaining IDAT payloads are not consumed.
+
+    Args:
+        *ihdr -> IHDRChunk: header of image
+        *idat_payloads -> Iterable[bytes]: Data of consecutive IDAT chunks
+        *row_start -> int: first decoded row
+        *row_stop -> int: row after last decoded row
+        *col_slice -> slice = None: columns (pixels) returned from each row
+        *max_pending -> int = 64: max number of filtered rows kept before they are defiltered to bound memory
+
+    Return:
+        *region -> np.array: array with shape (row_stop - row_start, columns, bytes per pixel)
+    '''
+    if not 0 <= row_start < row_stop <= ihdr.height:
+        raise ValueError(f"Wrong row range: {row_start}:{row_stop} for image with {ihdr.height} rows")
+    bytes_per_pixel = color_type_bytes.get(ihdr.color, None)
+    col_slice = col_slice if col_slice is not None else slice(None)
+    columns = len(range(ihdr.width)[col_slice])
+    region = np.empty((row_stop - row_start, columns, bytes_per_pixel), dtype=np.uint8)
+
+    def defilter(pending, previous):
+        for filter_type, scanline in pending:
+            previous = ReconstructingMethods.reconstruct_scanline(filter_type, scanline, previous, bytes_per_pixel)
+        return previous
+
+    previous = None
+    # filtered rows which band may depend on, first of them depends on "previous"
+    pending = []
+    defiltered_before = 0
+    scanlines = iter_filtered_scanlines(ihdr, idat_payloads)
+    try:
+        for row, (filter_type, scanline) in enumerate(scanlines):
+            if row < row_start:
+                if filter_type in (0, 1):
+                    # None and Sub filters do not use previous row, so the dependency chain starts here
+                    previous = None
+                    pending = []
+                pending.append((filter_type, scanline))
+                if len(pending) > max_pending:
+                    defiltered_before += len(pending)
+                    previous = defilter(pending, previous)
+                    pending = []
+                continue
+            if row == row_start and filter_type in (0, 1):
+                # first band row does not depend on rows before the band
+                previous = None
+                pending = []
+            if pending:
+                defiltered_before += len(pending)
+                previous = defilter(pending, previous)
+                pending = []
+            previous = ReconstructingMethods.reconstruct_scanline(filter_type, scanline, previous, bytes_per_pixel)
+            region[row - row_start] = previous.reshape(ihdr.width, bytes_per_pixel)[col_slice]
+            if row + 1 == row_stop:
+                break
+        else:
+            raise ValueError(f"Image data ended before row {row_stop}")
+    finally:
+        scanlines.close()
+    logger.debug(f"Region {row_start}:{row_stop} decoded, {defiltered_before} of {row_start} rows before region defiltered")
+    return region
+
+
+def decode_thumbnail(ihdr: IHDRChunk, idat_payloads: Iterable[bytes], scale: int, plte: PLTEChunk = None) -> np.array:
+    '''
+    Decodes image in reduced resolution in one pass over scanlines. Each output pixel is mean of scale x scale box
+    of input pixels (boxes on right and bottom edge may be smaller). Scanlines are summed into integer accumulator
+    of one output row, so memory use depends on thumbnail size only.
+
+    Args:
+        *ihdr -> IHDRChunk: header of image
+        *idat_payloads -> Iterable[bytes]: Data of consecutive IDAT chunks
+        *scale -> int: reduction factor (2, 4 or 8)
+        *plte -> PLTEChunk = None: palette used to turn indices (color type 3) into RGB(A) before averaging
+
+    Return:
+        *thumbnail -> np.array: array with shape (ceil(height / scale), ceil(width / scale), channels)
+    '''
+    if scale not in (2, 4, 8):
+        raise ValueError(f"Wrong thumbnail scale: {scale}, allowed: 2, 4, 8")
+    width, height = ihdr.width, ihdr.height
+    out_width, out_height = -(-width // scale), -(-height // scale)
+    column_starts = np.arange(0, width, scale)
+    # number of input columns in each output column (last one may be narrower)
+    column_counts = np.diff(np.append(column_starts, width)).astype(np.uint32)[:, None]
+
+    accumulator = None
+    thumbnail = None
+    rows_in_band = 0
+    out_row = 0
+    for scanline in iter_scanlines(ihdr, idat_payloads):
+        pixels = scanline.reshape(width, -1)
+        if plte is not None and ihdr.color == 3:
+            pixels = plte.expand(pixels[:, 0])
+        if accumulator is None:
+            accumulator = np.zeros((out_width, pixels.shape[1]), dtype=np.uint32)
+            thumbnail = np.empty((out_height, out_width, pixels.shape[1]), dtype=np.uint8)
+        accumulator += np.add.reduceat(pixels, column_starts, axis=0, dtype=np.uint32)
+        rows_in_band += 1
+        if rows_in_band == scale:
+            thumbnail[out_row] = (accumulator + scale * column_counts // 2) // (scale * column_counts)
+            accumulator.fill(0)
+            rows_in_band = 0
+            out_row += 1
+    if rows_in_band:
+        counts = rows_in_band * column_counts
+        thumbnail[out_row] = (accumulator + counts // 2) // counts
+        out_row += 1
+    if out_row != out_height:
+        raise ValueError(f"Image data ended after {out_row} of {out_height} thumbnail rows")
+    return thumbnail
+
+
+def read_chunk_after_IEND(image_binary_data) -> Chunk:
+    '''
+    Reads chunk hidden after IEND (e.g. cnKS with ciphertext tail), data of other chunks is skipped with seek
+
+    Args:
+        *image_binary_data: PNG file opened in binary mode
+
+    Return:
+        *hidden_chunk -> Chunk: chunk stored after IEND or None
+    '''
+    image_binary_data.seek(len(SIGNATURE))
+    while True:
+        header = image_binary_data.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            return None
+        _length, _type = CHUNK_HEADER.unpack(header)
+        image_binary_data.seek(_length + CHUNK_CRC.size, os.SEEK_CUR)
+        if _type == b'IEND':
+            break
+    header = image_binary_data.read(CHUNK_HEADER.size)
+    if len(header) < CHUNK_HEADER.size:
+        return None
+    _length, _type = CHUNK_HEADER.unpack(header)
+    _data = image_binary_data.read(_length)
+    _crc = CHUNK_CRC.unpack(image_binary_data.read(CHUNK_CRC.size))[0]
+    return Chunk(_length, _type, _data, _crc)
+
+
+def decrypt_ecb_region(image_binary_data, ecb: ECB, row_start: int, row_stop: int) -> np.array:
+    '''
+    Decrypts rows row_start:row_stop of ECB encrypted image file. Only rows of encrypted image holding needed ciphertext
+    blocks are decoded (decompression stops after them) and hidden tail is read only if region reaches it.
+
+    Args:
+        *image_binary_data: encrypted PNG file opened in binary mode
+        *ecb -> ECB: cipher used for encryption (keys and shape of original image)
+        *row_start -> int: first decrypted row
+        *row_stop -> int: row after last decrypted row
+
+    Return:
+        *region -> np.array: original data of rows with shape (row_stop - row_start, width, bytes per pixel)
+    '''
+    height, width, bytes_per_pixel = ecb.image_shape
+    row_bytes = width * bytes_per_pixel
+    visible_length = height * row_bytes
+    cipher_start, cipher_stop = ecb.ciphertext_range(row_start, row_stop)
+
+    encrypted = np.empty(0, dtype=np.uint8)
+    encrypted_offset = 0
+    if cipher_start < visible_length:
+        first_row = cipher_start // row_bytes
+        last_row = -(-min(cipher_stop, visible_length) // row_bytes)
+        encrypted = ScanlineStream(image_binary_data).decode_region(first_row, last_row)
+        encrypted_offset = first_row * row_bytes
+    hidden_data = None
+    if cipher_stop > visible_length:
+        hidden_chunk = read_chunk_after_IEND(image_binary_data)
+        if hidden_chunk is None:
+            raise ValueError("Hidden chunk with ciphertext tail not found")
+        hidden_data = np.frombuffer(hidden_chunk.get_chunk_data_bytes(), dtype=np.uint8)
+    return ecb.decrypt_region(encrypted, hidden_data, row_start, row_stop, encrypted_offset)
+
+
+class ScanlineStream:
+    '''
+    Class reading PNG file chunk by chunk. Chunks before first IDAT are parsed on creation,
+    IDAT chunks are read from file only when next scanlines are requested.
+    '''
+
+    def __init__(self, image_binary_data):
+        self.binary_data = image_binary_data
+        self.IHDR = None
+        self.PLTE = None
+        self.ancillaryChunks = []
+        self._idat_header = None
+
+        if image_binary_data.read(8) != SIGNATURE:
+            raise ValueError("Wrong File Format!")
+        while True:
+            header = image_binary_data.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                raise ValueError("IDAT chunk not found")
+            _length, _type = CHUNK_HEADER.unpack(header)
+            if _type == b'IDAT':
+                self._idat_header = (_length, _type)
+                break
+            _data = image_binary_data.read(_length)
+            _crc = CHUNK_CRC.unpack(image_binary_data.read(CHUNK_CRC.size))[0]
+            chunk_class = chunk_bytes_parsing.get(_type, Chunk)
+            chunk = chunk_class(_length, _type, _data, _crc)
+            if _type == b'IHDR':
+                self.IHDR = chunk
+            elif _type == b'PLTE':
+                self.PLTE = chunk
+            elif _type[0:1].decode().islower():
+                if self.IHDR is not None:
+                    chunk.bind_header(self.IHDR)
+                self.ancillaryChunks.append(chunk)
+        if self.IHDR is None:
+            raise ValueError("IHDR chunk not found")
+        if self.PLTE is not None:
+            for chunk in self.ancillaryChunks:
+                if chunk.Type == b'tRNS':
+                    self.PLTE.apply_transparency(chunk.Data)
+
+    def idat_payloads(self) -> Iterator[bytes]:
+        '''
+        Yields Data of consecutive IDAT chunks read lazily from file
+        '''
+        _length, _type = self._idat_header
+        while _type == b'IDAT':
+            _data = self.binary_data.read(_length)
+            self.binary_data.read(CHUNK_CRC.size)
+            yield _data
+            header = self.binary_data.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            _length, _type = CHUNK_HEADER.unpack(header)
+
+    def filtered_scanlines(self) -> Iterator[Tuple[int, bytes]]:
+        return iter_filtered_scanlines(self.IHDR, self.idat_payloads())
+
+    def decode_region(self, row_start: int, row_stop: int, col_slice: slice = None) -> np.array:
+        '''
+        Decodes band of rows, IDAT chunks after last requested row are not read from file
+        '''
+        return decode_region(self.IHDR, self.idat_payloads(), row_start, row_stop, col_slice)
+
+    def decode_thumbnail(self, scale: int) -> np.array:
+        '''
+        Decodes box filtered image reduced 2, 4 or 8 times, palette indices are turned into RGB(A)
+        '''
+        return decode_thumbnail(self.IHDR, self.idat_payloads(), scale, self.PLTE)
+
+    def __iter__(self) -> Iterator[np.array]:
+        return iter_scanlines(self.IHDR, self.idat_payloads())
 
 
 filtering_methods = {
@@ -0,0 +1,184 @@
+import logging
+from dataclasses import dataclass
+from typing import Iterable, Tuple
+import numpy as np
+from e_media1.basechunks import Chunk
+
+
+logger = logging.getLogger("loger")
+
+# chromaticities (x, y) of sRGB primaries and D65 white point
+SRGB_PRIMARIES = ((0.64, 0.33), (0.30, 0.60), (0.15, 0.06))
+D65_WHITE_POINT = (0.3127, 0.3290)
+
+# Bradford cone response matrix used for white point adaptation
+BRADFORD = np.array([[0.8951, 0.2664, -0.1614],
+                     [-0.7502, 1.7135, 0.0367],
+                     [0.0389, -0.0685, 1.0296]])
+
+# number of entries of table encoding linear values, linear data is quantized to 16 bits before lookup
+ENCODE_LUT_SIZE = 65536
+
+COLOR_TARGETS = ('linear', 'srgb')
+
+
+def srgb_to_linear(values: np.array) -> np.array:
+    '''
+    sRGB transfer function (values in range [0, 1])
+    '''
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(values: np.array) -> np.array:
+    '''
+    Inverse of sRGB transfer function (values in range [0, 1])
+    '''
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+
+
+def _xyz(x: float, y: float) -> np.array:
+    # XYZ of chromaticity with luminance Y = 1
+    return np.array([x / y, 1.0, (1 - x - y) / y])
+
+
+def rgb_to_xyz_matrix(primaries: Iterable[Tuple[float, float]], white_point: Tuple[float, float]) -> np.array:
+    '''
+    Builds RGB -> XYZ matrix from chromaticities of primaries and white point (as stored in cHRM chunk)
+
+    Args:
+        *primaries -> Iterable[Tuple[float, float]]: (x, y) of red, green and blue primary
+        *white_point -> Tuple[float, float]: (x, y) of white point
+
+    Return:
+        *matrix -> np.array: 3 x 3 matrix, XYZ = matrix @ RGB (white RGB = 1, 1, 1 gives Y = 1)
+    '''
+    columns = np.stack([_xyz(x, y) for x, y in primaries], axis=1)
+    scale = np.linalg.solve(columns, _xyz(*white_point))
+    return columns * scale
+
+
+def chromatic_adaptation(source_white: Tuple[float, float], target_white: Tuple[float, float]) -> np.array:
+    '''
+    Bradford XYZ -> XYZ adaptation matrix between white points
+    '''
+    source, target = BRADFORD @ _xyz(*source_white), BRADFORD @ _xyz(*target_white)
+    return np.linalg.inv(BRADFORD) @ np.diag(target / source) @ BRADFORD
+
+
+@dataclass
+class ColorProfile:
+    '''
+    Color information of image read from ancillary chunks. File gamma None means sRGB transfer function,
+    primaries None means sRGB primaries. sRGB chunk overrides gAMA and cHRM (as PNG specification requires).
+    '''
+    gamma: float = None
+    primaries: Tuple[Tuple[float, float], ...] = None
+    white_point: Tuple[float, float] = None
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Chunk]) -> 'ColorProfile':
+        chunks = {chunk.Type: chunk for chunk in chunks}
+        if b'sRGB' in chunks:
+            return cls()
+        if b'iCCP' in chunks:
+            logger.debug("iCCP profile is not applied, gAMA and cHRM are used")
+        profile = cls()
+        gama = chunks.get(b'gAMA')
+        if gama is not None:
+            if gama.gamma <= 0:
+                raise ValueError(f"Wrong gamma value: {gama.gamma}")
+            profile.gamma = gama.gamma
+        chrm = chunks.get(b'cHRM')
+        if chrm is not None:
+            profile.primaries = ((chrm.red_x, chrm.red_y), (chrm.green_x, chrm.green_y), (chrm.blue_x, chrm.blue_y))
+            profile.white_point = (chrm.white_point_x, chrm.white_point_y)
+        return profile
+
+    def decode_lut(self, depth: int = 8) -> np.array:
+        '''
+        Table of linear light value (float32, range [0, 1]) for every sample value, 256 or 65536 entries
+        '''
+        values = np.arange(2 ** depth, dtype=np.float64) / (2 ** depth - 1)
+        # gAMA stores encoding exponent: sample = linear ** gamma
+        linear = srgb_to_linear(values) if self.gamma is None else values ** (1 / self.gamma)
+        return linear.astype(np.float32)
+
+    def to_srgb_matrix(self) -> np.array:
+        '''
+        Matrix converting linear RGB of image primaries to linear RGB of sRGB primaries (None if image uses sRGB primaries)
+        '''
+        if self.primaries is None:
+            return None
+        to_xyz = rgb_to_xyz_matrix(self.primaries, self.white_point)
+        adaptation = chromatic_adaptation(self.white_point, D65_WHITE_POINT)
+        return np.linalg.inv(rgb_to_xyz_matrix(SRGB_PRIMARIES, D65_WHITE_POINT)) @ adaptation @ to_xyz
+
+
+class ColorConverter:
+    '''
+    Converts decoded pixels to linear light or sRGB. Lookup tables and matrix are computed once on creation,
+    so converter can be used for many bands of rows of the same image. Alpha channel is not changed.
+    '''
+
+    def __init__(self, profile: ColorProfile, depth: int = 8, target: str = 'srgb'):
+        if target not in COLOR_TARGETS:
+            raise ValueError(f"Unknown color target: {target}")
+        if depth not in (8, 16):
+            raise ValueError(f"Color conversion needs 8 or 16 bit samples, got {depth}")
+        self.profile = profile
+        self.depth = depth
+        self.target = target
+        self.decode_table = profile.decode_lut(depth)
+        self.matrix = profile.to_srgb_matrix()
+        if self.matrix is not None and np.allclose(self.matrix, np.eye(3), atol=1e-4):
+            # cHRM with sRGB chromaticities (rounded) - matmul would not change samples
+            self.matrix = None
+        if self.matrix is not None:
+            self.matrix = self.matrix.T.astype(np.float32)
+        output_type = np.uint8 if depth == 8 else np.uint16
+        if target == 'srgb':
+            # 16 bit quantized linear value -> sRGB sample
+            encoded = linear_to_srgb(np.arange(ENCODE_LUT_SIZE, dtype=np.float64) / (ENCODE_LUT_SIZE - 1))
+            self.encode_table = np.rint(encoded * (2 ** depth - 1)).astype(output_type)
+
+    def convert(self, pixels: np.array) -> np.array:
+        '''
+        Args:
+            *pixels -> np.array: samples (rows x width x channels), uint8 or uint16, 1 - 4 channels
+
+        Return:
+            *converted -> np.array: float32 linear values in range [0, 1] for 'linear' target,
+                                    sRGB samples with the same bit depth for 'srgb' target
+        '''
+        channels = pixels.shape[-1]
+        color_channels = 3 if channels >= 3 else 1
+        linear = np.take(self.decode_table, pixels[..., :color_channels])
+        if self.matrix is not None and color_channels == 3:
+            linear = np.clip(linear @ self.matrix, 0, 1)
+        if self.target == 'linear':
+            color = linear
+            alpha = pixels[..., color_channels:].astype(np.float32) / (2 ** self.depth - 1)
+        else:
+            color = np.take(self.encode_table, np.rint(linear * (ENCODE_LUT_SIZE - 1)).astype(np.uint16))
+            alpha = pixels[..., color_channels:].astype(color.dtype)
+        if alpha.shape[-1] == 0:
+            return color
+        return np.concatenate((color, alpha), axis=-1)
+
+
+def convert_colors(pixels: np.array, chunks: Iterable[Chunk], depth: int = 8, target: str = 'srgb') -> np.array:
+    '''
+    Applies gAMA/cHRM color correction to pixel array
+
+    Args:
+        *pixels -> np.array: samples (rows x width x channels), palette has to be expanded before
+        *chunks -> Iterable[Chunk]: ancillary chunks of image (gAMA, cHRM, sRGB)
+        *depth -> int = 8: bit depth of samples
+        *target -> str = 'srgb': 'linear' (float32 linear light in sRGB primaries) or 'srgb'
+
+    Return:
+        *converted -> np.array
+    '''
+    profile = ColorProfile.from_chunks(chunks)
+    logger.info(f"Color conversion to {target}: gamma {profile.gamma or 'sRGB'}, primaries {profile.primaries or 'sRGB'}")
+    return ColorConverter(profile, depth, target).convert(pixels)
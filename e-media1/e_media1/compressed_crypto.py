@@ -0,0 +1,238 @@
+import io
+import logging
+import struct
+import zlib
+from typing import List, Tuple
+import numpy as np
+from e_media1.additional_data import SIGNATURE, color_type_bytes
+from e_media1.basechunks import Chunk
+from e_media1.chunksclasses import CriticalChunks, Image
+from e_media1.encrypt import AES, cipher_modes
+
+
+logger = logging.getLogger("loger")
+
+# private ancillary chunks (unsafe to copy - they depend on image data)
+CIPHER_HEADER_TYPE = b'ciHD'
+CIPHER_DATA_TYPE = b'ciPH'
+
+# ciHD: mode, length of compressed IDAT data, number of IDAT chunks, followed by length of each IDAT chunk
+CIPHER_HEADER = struct.Struct('>4sQI')
+
+def create_cipher(mode: str):
+    '''
+    Creates cipher for given mode ('ecb', 'cbc' or 'aes'), RSA keys are generated on creation
+    '''
+    cipher_class = cipher_modes.get(mode)
+    if cipher_class is None:
+        raise ValueError(f"Unknown encryption mode: {mode}")
+    return cipher_class()
+
+
+def encrypt_payload(cipher, payload: bytes, associated_data: bytes = None) -> bytes:
+    '''
+    Encrypts compressed IDAT data as one vector of bytes
+
+    Args:
+        *cipher -> ECB | CBC | AES: cipher with keys
+        *payload -> bytes: concatenated data of IDAT chunks
+        *associated_data -> bytes = None: data authenticated by AES (IHDR data)
+
+    Return:
+        *encrypted -> bytes: ciphertext (RSA: all 256 byte blocks, AES: nonce, ciphertext and tag)
+    '''
+    if isinstance(cipher, AES):
+        return cipher.encrypt_bytes(payload, associated_data)
+    cipher.image_shape = (len(payload),)
+    encrypted, padded = cipher.encrypt(np.frombuffer(payload, dtype=np.uint8))
+    return encrypted.tobytes() + padded.tobytes()
+
+
+def decrypt_payload(cipher, encrypted: bytes, payload_length: int, associated_data: bytes = None) -> bytes:
+    '''
+    Reverses encrypt_payload
+
+    Return:
+        *payload -> bytes: concatenated data of original IDAT chunks
+    '''
+    if isinstance(cipher, AES):
+        return cipher.decrypt_bytes(encrypted, associated_data)
+    cipher.image_shape = (payload_length,)
+    encrypted = np.frombuffer(encrypted, dtype=np.uint8)
+    return cipher.decrypt(encrypted[:payload_length], encrypted[payload_length:]).tobytes()
+
+
+def _make_chunk(chunk_type: bytes, data: bytes) -> Chunk:
+    return Chunk(len(data), chunk_type, data, zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def blank_idat_data(ihdr) -> bytes:
+    '''
+    Compressed data of black (all zero) image with dimensions from IHDR, compressed row by row
+    '''
+    compressor = zlib.compressobj(9)
+    row = bytes(1 + ihdr.width * color_type_bytes.get(ihdr.color, 1))
+    compressed = [compressor.compress(row) for _ in range(ihdr.height)]
+    compressed.append(compressor.flush())
+    return b''.join(compressed)
+
+
+def _ancillary_after(ancillary: List[Chunk], critical_type: bytes) -> List[Chunk]:
+    # chunks without known position (not read from file) are written after IHDR
+    return [chunk for chunk in ancillary if (chunk.follows or b'IHDR') == critical_type and chunk.Type not in (CIPHER_HEADER_TYPE, CIPHER_DATA_TYPE)]
+
+
+def chunk_sequence(critical: CriticalChunks, ancillary: List[Chunk], idat_chunks: List[Chunk] = None, before_idat: List[Chunk] = ()) -> List[Chunk]:
+    '''
+    Orders chunks as in PNG file: each ancillary chunk is kept on its original side of PLTE and IDAT
+
+    Args:
+        *critical -> CriticalChunks: IHDR, PLTE and IEND of image
+        *ancillary -> List[Chunk]: ancillary chunks (ciHD and ciPH are skipped)
+        *idat_chunks -> List[Chunk] = None: chunks written as image data, IDAT of critical if None
+        *before_idat -> List[Chunk] = (): chunks written directly before image data (ciHD and ciPH)
+
+    Return:
+        *chunks -> List[Chunk]
+    '''
+    chunks = [critical.IHDR] + _ancillary_after(ancillary, b'IHDR')
+    if critical.PLTE is not None:
+        chunks += [critical.PLTE] + _ancillary_after(ancillary, b'PLTE')
+    chunks += list(before_idat)
+    chunks += critical.IDAT if idat_chunks is None else idat_chunks
+    chunks += _ancillary_after(ancillary, b'IDAT') + [critical.IEND]
+    return chunks
+
+
+def build_encrypted_png(critical: CriticalChunks, ancillary: List[Chunk], cipher, mode: str, max_chunk_size: int = 65524) -> bytes:
+    '''
+    Builds PNG file with encrypted compressed IDAT data stored in ciPH chunks and blank image in IDAT,
+    so file stays valid PNG. Lengths of original IDAT chunks are stored in ciHD chunk.
+
+    Args:
+        *critical -> CriticalChunks: critical chunks of original image
+        *ancillary -> List[Chunk]: ancillary chunks of original image (copied unchanged)
+        *cipher -> ECB | CBC | AES: cipher with keys
+        *mode -> str: 'ecb', 'cbc' or 'aes'
+
+    Return:
+        *png_bytes -> bytes: content of encrypted PNG file
+    '''
+    payload = critical.return_only_IDAT_data()
+    encrypted = encrypt_payload(cipher, payload, critical.IHDR.Data)
+    lengths = [chunk.Lenght for chunk in critical.IDAT]
+    header = CIPHER_HEADER.pack(mode.encode().ljust(4), len(payload), len(lengths)) + struct.pack(f'>{len(lengths)}I', *lengths)
+
+    cipher_chunks = [_make_chunk(CIPHER_HEADER_TYPE, header)]
+    for start in range(0, len(encrypted), max_chunk_size):
+        cipher_chunks.append(_make_chunk(CIPHER_DATA_TYPE, encrypted[start:start + max_chunk_size]))
+    blank_idat = critical.create_IDAT_Chunk(blank_idat_data(critical.IHDR))
+
+    output_file = io.BytesIO()
+    output_file.write(SIGNATURE)
+    for chunk in chunk_sequence(critical, ancillary, blank_idat, cipher_chunks):
+        chunk.write_to(output_file)
+    return output_file.getvalue()
+
+
+def restore_png(critical: CriticalChunks, ancillary: List[Chunk], cipher) -> Tuple[bytes, str]:
+    '''
+    Decrypts data from ciPH chunks and rebuilds file with original IDAT chunks (byte for byte)
+
+    Args:
+        *critical -> CriticalChunks: critical chunks of encrypted image
+        *ancillary -> List[Chunk]: ancillary chunks of encrypted image (with ciHD and ciPH)
+        *cipher -> ECB | CBC | AES: cipher used for encryption
+
+    Return:
+        *png_bytes -> bytes: content of decrypted PNG file
+        *mode -> str: encryption mode read from ciHD
+    '''
+    headers = [chunk for chunk in ancillary if chunk.Type == CIPHER_HEADER_TYPE]
+    if not headers:
+        raise ValueError("ciHD chunk not found - image was not encrypted in compressed mode")
+    header = headers[0].Data
+    mode, payload_length, chunks_number = CIPHER_HEADER.unpack_from(header)
+    lengths = struct.unpack_from(f'>{chunks_number}I', header, CIPHER_HEADER.size)
+    encrypted = b''.join(chunk.Data for chunk in ancillary if chunk.Type == CIPHER_DATA_TYPE)
+    payload = decrypt_payload(cipher, encrypted, payload_length, critical.IHDR.Data)
+    if len(payload) != sum(lengths):
+        raise ValueError(f"Decrypted data has {len(payload)} bytes, expected {sum(lengths)}")
+
+    idat_chunks = []
+    start = 0
+    for length in lengths:
+        idat_chunks.append(_make_chunk(b'IDAT', payload[start:start + length]))
+        start += length
+
+    output_file = io.BytesIO()
+    output_file.write(SIGNATURE)
+    for chunk in chunk_sequence(critical, ancillary, idat_chunks):
+        chunk.write_to(output_file)
+    return output_file.getvalue(), mode.decode().strip()
+
+
+def read_chunks(path: str) -> Tuple[CriticalChunks, List[Chunk]]:
+    '''
+    Reads chunks of PNG file without decompressing IDAT data
+    '''
+    with open(path, 'rb') as image_binary:
+        critical, ancillary, _hidden_chunk = Image.read_image_binary_data(image_binary)
+    return CriticalChunks(critical), ancillary
+
+
+def encrypt_compressed_file(src_path: str, dst_path: str, mode: str = 'aes', cipher=None):
+    '''
+    Encrypts compressed IDAT data of PNG file, image data is never decompressed
+
+    Args:
+        *src_path -> str: path to PNG file
+        *dst_path -> str: path to encrypted PNG file
+        *mode -> str = 'aes': 'ecb', 'cbc' or 'aes'
+        *cipher = None: cipher with keys, new one is created if not given
+
+    Return:
+        *cipher -> ECB | CBC | AES: cipher needed for decryption
+    '''
+    cipher = cipher if cipher is not None else create_cipher(mode)
+    critical, ancillary = read_chunks(src_path)
+    png_bytes = build_encrypted_png(critical, ancillary, cipher, mode)
+    with open(dst_path, 'wb') as output_file:
+        output_file.write(png_bytes)
+    return cipher
+
+
+def decrypt_compressed_file(src_path: str, dst_path: str, cipher) -> None:
+    '''
+    Restores PNG file encrypted with encrypt_compressed_file
+    '''
+    critical, ancillary = read_chunks(src_path)
+    png_bytes, _mode = restore_png(critical, ancillary, cipher)
+    with open(dst_path, 'wb') as output_file:
+        output_file.write(png_bytes)
+
+
+def encrypt_and_decrypt_compressed(critical: CriticalChunks, ancillary: List[Chunk], save_path: str, mode: str) -> bool:
+    '''
+    Encrypts compressed IDAT data, saves {mode}_compressed_encrypt.png, decrypts it back and saves {mode}_compressed_decrypt.png
+
+    Return:
+        *restored -> bool: True if decrypted file has the same chunks in the same order as original
+    '''
+    encrypted_path = f"{save_path}/{mode}_compressed_encrypt.png"
+    decrypted_path = f"{save_path}/{mode}_compressed_decrypt.png"
+    cipher = create_cipher(mode)
+    logger.info(f"Saving image {mode}_compressed_encrypt.png")
+    with open(encrypted_path, 'wb') as output_file:
+        output_file.write(build_encrypted_png(critical, ancillary, cipher, mode))
+    logger.info(f"Saving image {mode}_compressed_decrypt.png")
+    decrypt_compressed_file(encrypted_path, decrypted_path, cipher)
+
+    restored_critical, restored_ancillary = read_chunks(decrypted_path)
+    restored = ([chunk.get_all_chunk_bytes() for chunk in chunk_sequence(restored_critical, restored_ancillary)]
+                == [chunk.get_all_chunk_bytes() for chunk in chunk_sequence(critical, ancillary)])
+    if restored:
+        logger.info("Decrypted chunks identical to original")
+    else:
+        logger.error("Decrypted chunks differ from original")
+    return restored
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict
+import numpy as np
+
+
+logger = logging.getLogger("loger")
+
+
+class DecodeCache:
+    '''
+    Content-addressed on-disk cache of decoded IDAT data (rawIDATData). Arrays are stored as .npy files
+    and opened as read-only memory maps. Least recently used files are evicted when size cap is exceeded.
+    '''
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(critical_chunks) -> str:
+        '''
+        Key of decoded data: hash of IHDR data and compressed IDAT payload
+
+        Args:
+            *critical_chunks -> CriticalChunks: critical chunks of image
+
+        Return:
+            *key -> str: hex digest
+        '''
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(critical_chunks.IHDR.Data)
+        for chunk in critical_chunks.IDAT:
+            digest.update(chunk.Data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npy"
+
+    def get(self, key: str) -> np.array:
+        '''
+        Returns cached array opened with mmap_mode='r' or None
+        '''
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            # modification time is used as last access time for LRU eviction
+            os.utime(path)
+        except OSError as e:
+            # read-only or shared cache, or entry evicted by other process - data is already mapped
+            logger.debug(f"Access time of cache entry {path.name} not updated: {e}")
+        self.hits += 1
+        return array
+
+    def put(self, key: str, array: np.array) -> None:
+        '''
+        Stores array in cache and evicts least recently used entries above size cap
+        '''
+        tmp_path = None
+        try:
+            file_descriptor, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(file_descriptor, 'wb') as tmp_file:
+                np.save(tmp_file, np.ascontiguousarray(array))
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.error(f"Saving decoded data to cache failed: {e}")
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            return
+        self._evict()
+
+    def get_or_decode(self, critical_chunks) -> np.array:
+        '''
+        Returns decoded IDAT data from cache or decodes it and stores result in cache
+        '''
+        key = self.key(critical_chunks)
+        array = self.get(key)
+        if array is None:
+            array = critical_chunks.reconstruct_IDAT_data()
+            self.put(key, array)
+        return array
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.directory.glob('*.npy'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def __str__(self) -> str:
+        return f"decode cache hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions}"
@@ -2,16 +2,63 @@ import numpy as np
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from collections import OrderedDict
 from dataclasses import dataclass,field
 import logging
+import hashlib
+import json
+import os
 import random
-from typing import Tuple, List
+from typing import Iterable, Iterator, Tuple, List
 from abc import ABC,abstractmethod
+from e_media1.scratch import ScratchSpace, IN_MEMORY
+from e_media1 import bigint
+from e_media1.shared_pool import SharedMemoryPool, rsa_blocks_worker
 
 
 logger = logging.getLogger("loger")
 
 
+class BlockCache:
+    '''
+    Bounded LRU memo of block results keyed by block bytes. ECB is deterministic, so identical plaintext
+    (or ciphertext) blocks, e.g. from uniform image regions, need only one modular exponentiation.
+    '''
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: bytes) -> bytes:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: bytes, value: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, entries=len(self._entries), hit_rate=self.hit_rate())
+
+    def __str__(self) -> str:
+        return f"hits: {self.hits}, misses: {self.misses}, hit rate: {self.hit_rate():.1%}"
+
+
 @dataclass
 class RSA(ABC):
     '''Base class for CBC and ECB encryption with RSA algorithm'''
@@ -24,12 +71,15 @@ class RSA(ABC):
     encrypt_max_block_size: int = 255
     decrypt_max_block_size: int = 256
     image_shape: tuple = field(default_factory=tuple)
+    scratch: ScratchSpace = None
 
 
     def __post_init__(self) -> None:
         """
-        Generate RSA key-pairs upon initialization.
+        Generate RSA key-pairs upon initialization, generation is skipped when both keys are given.
         """
+        if self.public_key is not None and self.private_key is not None:
+            return
         logger.info("Generating RSA key-pairs..")
         try:
             p = self.generate_large_prime()
@@ -45,34 +95,14 @@ class RSA(ABC):
 
     def generate_large_prime(self, bits=1024) -> int:
         while True:
-            num = random.getrandbits(bits)
+            # two highest bits set, so product of two primes has 2 * bits bits and is larger than every plaintext block
+            num = random.getrandbits(bits) | (0b11 << (bits - 2)) | 1
             if self.is_prime(num):
                 return num
 
     def is_prime(self, n: int, k=128) -> bool:
-        """ Miller-Rabin primality test """
-        if n == 2 or n == 3:
-            return True
-        if n <= 1 or n % 2 == 0:
-            return False
-        s = 0
-        r = n - 1
-        while r & 1 == 0:
-            s += 1
-            r //= 2
-        for _ in range(k):
-            a = random.randrange(2, n - 1)
-            x = pow(a, r, n)
-            if x != 1 and x != n - 1:
-                j = 1
-                while j < s and x != n - 1:
-                    x = pow(x, 2, n)
-                    if x == 1:
-                        return False
-                    j += 1
-                if x != n - 1:
-                    return False
-        return True
+        """ Miller-Rabin primality test (GMP implementation when gmpy2 is installed) """
+        return bigint.is_prime(n, k)
 
     def find_coprime(self, phi_n: int) -> int:
         while True:
@@ -97,6 +127,39 @@ class RSA(ABC):
             x1 += m0
         return x1
 
+    def key_fingerprint(self) -> str:
+        """
+        Short hash of public key, used to check that stored ciphertext was made with the same keys.
+        """
+        return hashlib.blake2b(self.get_public_key_bytes(), digest_size=16).hexdigest()
+
+    def save_keys(self, path: str) -> None:
+        """
+        Saves key-pairs (and CBC initialization vector) to JSON file readable only by owner.
+        """
+        keys = dict(public_key=list(self.public_key), private_key=list(self.private_key))
+        if hasattr(self, 'base_iv'):
+            keys['iv'] = self.base_iv.tobytes().hex()
+        # private key is never written to file with default (world readable) permissions
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(descriptor, 0o600)
+        with open(descriptor, 'w') as key_file:
+            json.dump(keys, key_file)
+
+    @classmethod
+    def from_key_file(cls, path: str, **kwargs):
+        """
+        Creates cipher with key-pairs read from file written by save_keys, key generation is skipped.
+        """
+        with open(path) as key_file:
+            keys = json.load(key_file)
+        cipher = cls(public_key=tuple(keys['public_key']), private_key=tuple(keys['private_key']), **kwargs)
+        if cipher.public_key[1] < 1 << (8 * cipher.encrypt_max_block_size):
+            raise ValueError(f"RSA modulus in {path} is smaller than {cipher.encrypt_max_block_size} byte block - keys cannot be used")
+        if 'iv' in keys:
+            cipher.base_iv = np.frombuffer(bytes.fromhex(keys['iv']), dtype=np.uint8)
+        return cipher
+
     def get_public_key_bytes(self):
         """
         Convert RSA public key to bytes.
@@ -157,57 +220,86 @@ class RSA(ABC):
         pass
 
 
-    def split_data(self,full_data: np.array, length_of_data_block: int = None) -> np.array:
+    @staticmethod
+    def iter_blocks(*sources: np.array, block_size: int) -> Iterator[np.array]:
         '''
-        Spliting image data to blocks with size of public RSA key.
-        
+        Yields consecutive blocks of data stored in one or more arrays (e.g. visible image data and hidden tail)
+        without joining them. Blocks are views of source arrays, only block crossing border between arrays
+        and last block (padded with zeros) are copied.
+
         Args:
-            *full_data -> np.array: whole image IDAT data after decompression and defiltration
+            *sources -> np.array: arrays with data, treated as one continuous vector
+            *block_size -> int: size of block in bytes
 
         Return:
-            *data_blocks -> np.array : data splited into blocks of size which equals length of RSA public keys (bytes)
+            *Iterator[np.array]: blocks with block_size bytes
         '''
-        try:
-            if length_of_data_block is None:
-                number_of_bytes = len(self.get_public_key_bytes())
-            else:
-                number_of_bytes = length_of_data_block
-            logger.info("Performing IDAT Data splitting")
-
-            #we take the original shape and create 1D vector with data
-            full_data = np.reshape(full_data,-1)
-            idx = 0
-            data_blocks = []
-
-            while idx < len(full_data):
-                #iterate over the data and split them into blocks
-                if idx + number_of_bytes <= len(full_data):    
-                    data_blocks.append(full_data[idx:idx+number_of_bytes])
-                    idx += number_of_bytes
-                else:
-                    #if we cannot get full block of data at the end we perform padding and add extra bytes to create full block
-                    diff = len(full_data) - idx
-                    last_data_bytes = full_data[idx:idx+diff]
-                    self.added_bytes = number_of_bytes - diff
-                    added_bytes_list = [0 for iter in range(self.added_bytes)]
-                    list_sum = np.concatenate((last_data_bytes,added_bytes_list),axis=0)
-                    data_blocks.append(list_sum)
-                    idx += diff
-            logger.info("Data succesfully splitted")
-            return np.array(data_blocks,dtype=np.uint8)
-        except Exception as e:
-            logger.error(f"Error - splitting data: {e}")
-            raise ValueError("Data splitting failed during ECB encryption")
+        buffer = np.zeros(block_size, dtype=np.uint8)
+        filled = 0
+        for source in sources:
+            flat = np.reshape(source, -1)
+            position = 0
+            if filled:
+                position = min(block_size - filled, len(flat))
+                buffer[filled:filled + position] = flat[:position]
+                filled += position
+                if filled < block_size:
+                    continue
+                yield buffer
+                buffer = np.zeros(block_size, dtype=np.uint8)
+                filled = 0
+            full_end = position + (len(flat) - position) // block_size * block_size
+            for start in range(position, full_end, block_size):
+                yield flat[start:start + block_size]
+            filled = len(flat) - full_end
+            buffer[:filled] = flat[full_end:]
+        if filled:
+            yield buffer
+
+    @staticmethod
+    def store_block(visible: np.array, tail: np.array, offset: int, block: bytes) -> None:
+        '''
+        Writes block of ciphertext at given offset of continuous vector made of visible data and tail
+        '''
+        end = offset + len(block)
+        visible_length = len(visible)
+        if end <= visible_length:
+            visible[offset:end] = np.frombuffer(block, dtype=np.uint8)
+            return
+        split = max(visible_length - offset, 0)
+        if split:
+            visible[offset:] = np.frombuffer(block[:split], dtype=np.uint8)
+        tail[offset + split - visible_length:end - visible_length] = np.frombuffer(block[split:], dtype=np.uint8)
+
+    def allocate_output(self, image_raw_data_size: int) -> Tuple[np.array, np.array]:
+        '''
+        Preallocates ciphertext: array with image shape (memory mapped if scratch directory is set) and tail
+        with bytes which do not fit into image. Sets number of padding bytes of last plaintext block.
+        '''
+        blocks_number = -(-image_raw_data_size // self.encrypt_max_block_size)
+        self.added_bytes = blocks_number * self.encrypt_max_block_size - image_raw_data_size
+        encrypted = (self.scratch or IN_MEMORY).empty(self.image_shape)
+        padded = np.empty(blocks_number * self.decrypt_max_block_size - encrypted.size, dtype=np.uint8)
+        return encrypted, padded
 
 @dataclass
 class ECB(RSA):
     added_bytes: int = None
+    memo_size: int = 4096
+    encrypt_memo: BlockCache = field(default=None, repr=False)
+    decrypt_memo: BlockCache = field(default=None, repr=False)
 
     def __post_init__(self) -> None:
         '''
-        Generate RSA key-pairs with super function.
+        Generate RSA key-pairs with super function. Memo caches of block results are created for encryption and decryption
+        (memo_size = 0 disables them).
         '''
+        self.encrypt_memo = BlockCache(self.memo_size)
+        self.decrypt_memo = BlockCache(self.memo_size)
         return super().__post_init__()
+
+    def memo_stats(self) -> dict:
+        return dict(encrypt=self.encrypt_memo.stats(), decrypt=self.decrypt_memo.stats())
     
     def encrypt(self,image_raw_data:np.array) -> Tuple[np.array, List, List]:
         '''
@@ -224,22 +316,22 @@ class ECB(RSA):
         '''
         logger.info("Starting ECB encryption...")
         try:
-            e, n = self.public_key
-            data_splitted_blocks = self.split_data(image_raw_data,self.encrypt_max_block_size)
-
-            length = self.image_shape[0] * self.image_shape[1] * self.image_shape[2]
-            encrypted_data = bytearray()
-
-            for i in range(len(data_splitted_blocks)):
-                data = data_splitted_blocks[i].tobytes()
-                integer = int.from_bytes(data,'big')
-                decrypted_integer = pow(integer, e, n)
-                encrypted_data.extend(decrypted_integer.to_bytes(self.decrypt_max_block_size,'big'))
-
-            int_table = np.frombuffer(encrypted_data,dtype=np.uint8)
-            encrypted = int_table[:length]
-            padded = int_table[length:]
-            return np.array(encrypted).reshape(self.image_shape),padded
+            e, n = map(bigint.to_backend, self.public_key)
+            encrypted, padded = self.allocate_output(image_raw_data.size)
+            visible = encrypted.reshape(-1)
+
+            offset = 0
+            for block in self.iter_blocks(image_raw_data, block_size=self.encrypt_max_block_size):
+                data = block.tobytes()
+                encrypted_bytes = self.encrypt_memo.get(data)
+                if encrypted_bytes is None:
+                    encrypted_integer = bigint.powmod(bigint.from_bytes(data), e, n)
+                    encrypted_bytes = bigint.to_bytes(encrypted_integer, self.decrypt_max_block_size)
+                    self.encrypt_memo.put(data, encrypted_bytes)
+                self.store_block(visible, padded, offset, encrypted_bytes)
+                offset += self.decrypt_max_block_size
+            logger.info(f"ECB encryption block memo - {self.encrypt_memo}")
+            return encrypted,padded
         except Exception as e:
             logger.error(f"ECB encryption failed: {e}")
             raise
@@ -258,26 +350,213 @@ class ECB(RSA):
         '''
         logger.info("Startin ECB decryption...")
         try:
-            full_encrypted = np.concatenate((encrypted.flatten(),hidden_data),axis=None)
-            d, n = self.private_key
-            data_splitted_blocks= self.split_data(full_encrypted,self.decrypt_max_block_size)
-
-
-            original_data = bytearray()
-            for i in range(len(data_splitted_blocks)):
-                data = data_splitted_blocks[i].tobytes()
-                integer = int.from_bytes(data,'big')
-                decrypted_integer = pow(integer, d, n)
-                original_data.extend(decrypted_integer.to_bytes(self.encrypt_max_block_size,'big'))
-            int_table = np.frombuffer(original_data,dtype=np.uint8)
-            original = int_table[:-self.added_bytes]
-            image_original_data = original.reshape(self.image_shape)
+            d, n = map(bigint.to_backend, self.private_key)
+            image_original_data = (self.scratch or IN_MEMORY).empty(self.image_shape)
+            original = image_original_data.reshape(-1)
+            length = len(original)
+
+            offset = 0
+            for block in self.iter_blocks(encrypted, hidden_data, block_size=self.decrypt_max_block_size):
+                decrypted_bytes = self.decrypt_block(block.tobytes(), d, n)
+                # last block contains padding added during encryption
+                count = min(self.encrypt_max_block_size, length - offset)
+                original[offset:offset + count] = np.frombuffer(decrypted_bytes[:count], dtype=np.uint8)
+                offset += count
+            logger.info(f"ECB decryption block memo - {self.decrypt_memo}")
             logger.info("ECB Decryption Succesful")
             return image_original_data
         except Exception as e:
             logger.error(f"ECB decryption failed: {e}")
             raise
 
+    def encrypt_parallel(self, image_raw_data: np.array, pool: SharedMemoryPool) -> Tuple[np.array, np.array]:
+        '''
+        ECB encryption with blocks divided between worker processes. Plaintext and ciphertext are exchanged through
+        shared memory, workers get only block ranges. Result is identical to encrypt (block memo is not used).
+
+        Args:
+            * image_raw_data -> np.array: original image data after decompression and filtering out.
+            * pool -> SharedMemoryPool: worker pool
+        Return:
+            * encrypted -> np.array: array containing encrypted data with original image shape
+            * padded -> np.array: remaining encrypted bytes which are needed to decrypt image
+        '''
+        logger.info(f"Starting parallel ECB encryption ({pool.processes} processes)...")
+        blocks_number = -(-image_raw_data.size // self.encrypt_max_block_size)
+        source = pool.share(np.reshape(image_raw_data, -1))
+        target = pool.empty(blocks_number * self.decrypt_max_block_size)
+        try:
+            e, n = self.public_key
+            pool.run(rsa_blocks_worker, blocks_number, source, target, e, n, self.encrypt_max_block_size, self.decrypt_max_block_size)
+            encrypted, padded = self.allocate_output(image_raw_data.size)
+            ciphertext = pool.view(target)
+            encrypted.reshape(-1)[:] = ciphertext[:encrypted.size]
+            padded[:] = ciphertext[encrypted.size:]
+            del ciphertext
+            return encrypted, padded
+        except Exception as e:
+            logger.error(f"Parallel ECB encryption failed: {e}")
+            raise
+        finally:
+            pool.release(source)
+            pool.release(target)
+
+    def decrypt_parallel(self, encrypted: np.array, hidden_data: np.array, pool: SharedMemoryPool) -> np.array:
+        '''
+        ECB decryption with blocks divided between worker processes (see encrypt_parallel)
+
+        Return:
+            * image_original_data -> np.array: original image data after decryption
+        '''
+        logger.info(f"Starting parallel ECB decryption ({pool.processes} processes)...")
+        visible = np.reshape(encrypted, -1)
+        tail = np.reshape(hidden_data, -1)
+        blocks_number = (visible.size + tail.size) // self.decrypt_max_block_size
+        source = pool.empty(visible.size + tail.size)
+        target = pool.empty(blocks_number * self.encrypt_max_block_size)
+        try:
+            ciphertext = pool.view(source)
+            ciphertext[:visible.size] = visible
+            ciphertext[visible.size:] = tail
+            del ciphertext
+            d, n = self.private_key
+            pool.run(rsa_blocks_worker, blocks_number, source, target, d, n, self.decrypt_max_block_size, self.encrypt_max_block_size)
+            image_original_data = (self.scratch or IN_MEMORY).empty(self.image_shape)
+            plaintext = pool.view(target)
+            image_original_data.reshape(-1)[:] = plaintext[:image_original_data.size]
+            del plaintext
+            return image_original_data
+        except Exception as e:
+            logger.error(f"Parallel ECB decryption failed: {e}")
+            raise
+        finally:
+            pool.release(source)
+            pool.release(target)
+
+    def decrypt_block(self, data: bytes, d: int, n: int) -> bytes:
+        '''
+        Decrypts single 256 bytes block, result is taken from memo if block was already decrypted
+        '''
+        decrypted_bytes = self.decrypt_memo.get(data)
+        if decrypted_bytes is None:
+            decrypted_integer = bigint.powmod(bigint.from_bytes(data), d, n)
+            decrypted_bytes = bigint.to_bytes(decrypted_integer, self.encrypt_max_block_size)
+            self.decrypt_memo.put(data, decrypted_bytes)
+        return decrypted_bytes
+
+    def block_digests(self, image_raw_data: np.array) -> np.array:
+        '''
+        Computes digest of each plaintext block (manifest used by incremental encryption)
+
+        Return:
+            * digests -> np.array: array (blocks number x 16) with blake2b digests
+        '''
+        blocks = self.iter_blocks(image_raw_data, block_size=self.encrypt_max_block_size)
+        digests = b''.join(hashlib.blake2b(block.tobytes(), digest_size=16).digest() for block in blocks)
+        return np.frombuffer(digests, dtype=np.uint8).reshape(-1, 16)
+
+    def encrypt_blocks(self, image_raw_data: np.array, encrypted: np.array, padded: np.array, block_indices: Iterable[int]) -> None:
+        '''
+        Encrypts only chosen blocks and writes them in place into existing ciphertext (visible data and tail)
+
+        Args:
+            * image_raw_data -> np.array: original image data
+            * encrypted -> np.array: ciphertext with image shape (modified in place)
+            * padded -> np.array: ciphertext tail (modified in place)
+            * block_indices -> Iterable[int]: indices of blocks to be encrypted
+        '''
+        e, n = map(bigint.to_backend, self.public_key)
+        plaintext = np.reshape(image_raw_data, -1)
+        visible = np.reshape(encrypted, -1)
+        for index in block_indices:
+            start = int(index) * self.encrypt_max_block_size
+            data = plaintext[start:start + self.encrypt_max_block_size].tobytes()
+            # last block is padded with zeros, as in encrypt
+            data = data.ljust(self.encrypt_max_block_size, b'\x00')
+            encrypted_bytes = self.encrypt_memo.get(data)
+            if encrypted_bytes is None:
+                encrypted_bytes = bigint.to_bytes(bigint.powmod(bigint.from_bytes(data), e, n), self.decrypt_max_block_size)
+                self.encrypt_memo.put(data, encrypted_bytes)
+            self.store_block(visible, padded, int(index) * self.decrypt_max_block_size, encrypted_bytes)
+
+    def encrypt_incremental(self, image_raw_data: np.array, encrypted: np.array, padded: np.array, previous_digests: np.array) -> Tuple[np.array, int]:
+        '''
+        Re-encrypts only blocks which plaintext changed since ciphertext was made (compared with manifest of digests),
+        stored ciphertext and tail are patched in place. Ciphertext has to be made with the same keys and image shape.
+
+        Args:
+            * image_raw_data -> np.array: new original image data
+            * encrypted -> np.array: stored ciphertext with image shape (writable)
+            * padded -> np.array: stored ciphertext tail (writable)
+            * previous_digests -> np.array: manifest of plaintext used for stored ciphertext
+        Return:
+            * digests -> np.array: manifest of new plaintext
+            * changed -> int: number of re-encrypted blocks
+        '''
+        digests = self.block_digests(image_raw_data)
+        if digests.shape != previous_digests.shape or encrypted.size != image_raw_data.size:
+            raise ValueError("Manifest does not match image data - full encryption needed")
+        changed_blocks = np.flatnonzero((digests != previous_digests).any(axis=1))
+        self.added_bytes = len(digests) * self.encrypt_max_block_size - image_raw_data.size
+        self.encrypt_blocks(image_raw_data, encrypted, padded, changed_blocks)
+        logger.info(f"ECB incremental encryption: {len(changed_blocks)} of {len(digests)} blocks changed")
+        return digests, len(changed_blocks)
+
+    def ciphertext_range(self, row_start: int, row_stop: int) -> Tuple[int, int]:
+        '''
+        Computes byte range of ciphertext (visible image data followed by hidden tail) covering rows of original image.
+        Each 255 bytes plaintext block is stored as 256 bytes ciphertext block at the same block index.
+
+        Return:
+            * start, stop -> Tuple[int, int]: offsets in concatenated ciphertext
+        '''
+        height, width, bytes_per_pixel = self.image_shape
+        if not 0 <= row_start < row_stop <= height:
+            raise ValueError(f"Wrong row range: {row_start}:{row_stop} for image with {height} rows")
+        row_bytes = width * bytes_per_pixel
+        first_block = row_start * row_bytes // self.encrypt_max_block_size
+        last_block = (row_stop * row_bytes - 1) // self.encrypt_max_block_size + 1
+        return first_block * self.decrypt_max_block_size, last_block * self.decrypt_max_block_size
+
+    def decrypt_region(self, encrypted: np.array, hidden_data: np.array, row_start: int, row_stop: int, encrypted_offset: int = 0) -> np.array:
+        '''
+        Decrypts only rows row_start:row_stop of image, cost is proportional to size of region.
+        Ciphertext blocks covering region are taken from visible image data or from hidden tail.
+
+        Args:
+            * encrypted -> np.array: image data after encryption, whole or only part starting at byte encrypted_offset
+              (e.g. rows decoded with decode_region)
+            * hidden_data -> np.array: bytes stored after IEND chunk, needed only if region reaches end of image
+            * row_start -> int: first decrypted row
+            * row_stop -> int: row after last decrypted row
+            * encrypted_offset -> int = 0: offset of first byte of encrypted in whole visible ciphertext
+        Return:
+            * region -> np.array: original data of rows with shape (row_stop - row_start, width, bytes per pixel)
+        '''
+        height, width, bytes_per_pixel = self.image_shape
+        row_bytes = width * bytes_per_pixel
+        visible_length = height * row_bytes
+        cipher_start, cipher_stop = self.ciphertext_range(row_start, row_stop)
+        visible = np.reshape(encrypted, -1)
+        tail = np.reshape(hidden_data, -1) if hidden_data is not None else np.empty(0, dtype=np.uint8)
+
+        parts = []
+        if cipher_start < visible_length:
+            parts.append(visible[cipher_start - encrypted_offset:min(cipher_stop, visible_length) - encrypted_offset])
+        if cipher_stop > visible_length:
+            parts.append(tail[max(cipher_start - visible_length, 0):cipher_stop - visible_length])
+        if sum(len(part) for part in parts) != cipher_stop - cipher_start or cipher_start < encrypted_offset:
+            raise ValueError(f"Ciphertext bytes {cipher_start}:{cipher_stop} needed for rows {row_start}:{row_stop} not available")
+
+        d, n = map(bigint.to_backend, self.private_key)
+        first_block = cipher_start // self.decrypt_max_block_size
+        plaintext = bytearray()
+        for block in self.iter_blocks(*parts, block_size=self.decrypt_max_block_size):
+            plaintext.extend(self.decrypt_block(block.tobytes(), d, n))
+        start = row_start * row_bytes - first_block * self.encrypt_max_block_size
+        region = np.frombuffer(plaintext, dtype=np.uint8)[start:start + (row_stop - row_start) * row_bytes]
+        return region.reshape(row_stop - row_start, width, bytes_per_pixel)
+
 
     def encrypt_with_library(self, image_raw_data: np.array) -> Tuple:
         """
@@ -358,23 +637,20 @@ class CBC(RSA):
         '''
         logger.info("Starting CBC encryption...")
         try:
-            e, n = self.public_key
-            data_splitted_blocks = self.split_data(image_raw_data,self.encrypt_max_block_size)
-            length = self.image_shape[0] * self.image_shape[1] * self.image_shape[2]
-            encrypted_data = bytearray()
+            e, n = map(bigint.to_backend, self.public_key)
+            encrypted, padded = self.allocate_output(image_raw_data.size)
+            visible = encrypted.reshape(-1)
             iv = self.base_iv
-            for i in range(len(data_splitted_blocks)):
-                XORed_data = np.array([a^b for a,b in zip(data_splitted_blocks[i],iv)])
-                data = XORed_data.tobytes()
-                integer = int.from_bytes(data,'big')
-                encrypted_integer = pow(integer, e, n)
-                encrypted_bytes = encrypted_integer.to_bytes(self.decrypt_max_block_size,'big')
-                encrypted_data.extend(encrypted_bytes)
+            offset = 0
+            for block in self.iter_blocks(image_raw_data, block_size=self.encrypt_max_block_size):
+                XORed_data = np.bitwise_xor(block, iv)
+                integer = bigint.from_bytes(XORed_data.tobytes())
+                encrypted_integer = bigint.powmod(integer, e, n)
+                encrypted_bytes = bigint.to_bytes(encrypted_integer, self.decrypt_max_block_size)
+                self.store_block(visible, padded, offset, encrypted_bytes)
+                offset += self.decrypt_max_block_size
                 iv = np.frombuffer(encrypted_bytes[:self.encrypt_max_block_size],dtype=np.uint8)
-            int_table = np.frombuffer(encrypted_data,dtype=np.uint8)
-            encrypted = int_table[:length]
-            padded = int_table[length:]
-            return np.array(encrypted).reshape(self.image_shape),padded
+            return encrypted,padded
         except Exception as e:
             logger.error(f"CBC encryption failed: {e}")
             raise
@@ -393,24 +669,119 @@ class CBC(RSA):
         '''
         logger.info("Startin CBC decryption...")
         try:
-            full_encrypted = np.concatenate((encrypted.flatten(),hidden_data),axis=None)
-            d, n = self.private_key
-            data_splitted_blocks = self.split_data(full_encrypted,self.decrypt_max_block_size)
-            original_data = bytearray()
+            d, n = map(bigint.to_backend, self.private_key)
+            image_original_data = (self.scratch or IN_MEMORY).empty(self.image_shape)
+            original = image_original_data.reshape(-1)
+            length = len(original)
             iv = self.base_iv
-            for i in range(len(data_splitted_blocks)):
-                data = data_splitted_blocks[i].tobytes()
-                integer = int.from_bytes(data,'big')
-                decrypted_integer = pow(integer, d, n)
-                bytes_after_rsa = decrypted_integer.to_bytes(self.encrypt_max_block_size,'big')
-                int_data = np.frombuffer(bytes_after_rsa,dtype=np.uint8)
-                decrypted = [a^b for a,b in zip(int_data,iv)]
-                original_data.extend(decrypted)
-                iv = np.frombuffer(data, dtype=np.uint8)
-            int_table = np.frombuffer(original_data,dtype=np.uint8)
-            original = int_table[:-self.added_bytes]
-            image_original_data = original.reshape((self.image_shape))
+            offset = 0
+            for block in self.iter_blocks(encrypted, hidden_data, block_size=self.decrypt_max_block_size):
+                integer = bigint.from_bytes(block.tobytes())
+                decrypted_integer = bigint.powmod(integer, d, n)
+                bytes_after_rsa = np.frombuffer(bigint.to_bytes(decrypted_integer, self.encrypt_max_block_size),dtype=np.uint8)
+                decrypted = np.bitwise_xor(bytes_after_rsa, iv)
+                count = min(self.encrypt_max_block_size, length - offset)
+                original[offset:offset + count] = decrypted[:count]
+                offset += count
+                # next block is XORed with first bytes of current ciphertext block
+                iv = block[:self.encrypt_max_block_size].copy()
             return image_original_data
         except Exception as e:
             logger.error(f"CBC decryption failed: {e}")
             raise
+
+    def decrypt_parallel(self, encrypted: np.array, hidden_data: np.array, pool: SharedMemoryPool) -> np.array:
+        '''
+        CBC decryption with RSA of blocks divided between worker processes. Unlike encryption, decryption of block
+        needs only ciphertext: plaintext_i = RSA(c_i) XOR c_(i-1)[:255], so XOR with previous blocks is done at once
+        after workers finish. Result is identical to decrypt.
+
+        Return:
+            * image_original_data -> np.array: original image data after decryption
+        '''
+        logger.info(f"Starting parallel CBC decryption ({pool.processes} processes)...")
+        visible = np.reshape(encrypted, -1)
+        tail = np.reshape(hidden_data, -1)
+        blocks_number = (visible.size + tail.size) // self.decrypt_max_block_size
+        source = pool.empty(visible.size + tail.size)
+        target = pool.empty(blocks_number * self.encrypt_max_block_size)
+        try:
+            ciphertext = pool.view(source)
+            ciphertext[:visible.size] = visible
+            ciphertext[visible.size:] = tail
+            d, n = self.private_key
+            pool.run(rsa_blocks_worker, blocks_number, source, target, d, n, self.decrypt_max_block_size, self.encrypt_max_block_size)
+            blocks = ciphertext[:blocks_number * self.decrypt_max_block_size].reshape(blocks_number, self.decrypt_max_block_size)
+            plaintext = pool.view(target).reshape(blocks_number, self.encrypt_max_block_size)
+            plaintext[0] ^= self.base_iv
+            plaintext[1:] ^= blocks[:-1, :self.encrypt_max_block_size]
+            image_original_data = (self.scratch or IN_MEMORY).empty(self.image_shape)
+            image_original_data.reshape(-1)[:] = plaintext.reshape(-1)[:image_original_data.size]
+            del ciphertext, blocks, plaintext
+            return image_original_data
+        except Exception as e:
+            logger.error(f"Parallel CBC decryption failed: {e}")
+            raise
+        finally:
+            pool.release(source)
+            pool.release(target)
+
+
+@dataclass
+class AES:
+    '''AES-GCM (cryptography library) encryption of byte sequences, used for compressed IDAT data'''
+    key: bytes = None
+    nonce_size: int = 12
+
+    def __post_init__(self) -> None:
+        if self.key is None:
+            self.key = AESGCM.generate_key(bit_length=256)
+
+    def encrypt_bytes(self, data: bytes, associated_data: bytes = None) -> bytes:
+        '''
+        Encrypts data with random nonce
+
+        Args:
+            * data -> bytes: data to be encrypted
+            * associated_data -> bytes = None: data which is authenticated but not encrypted (e.g. IHDR)
+        Return:
+            * encrypted -> bytes: nonce followed by ciphertext and authentication tag
+        '''
+        nonce = os.urandom(self.nonce_size)
+        return nonce + AESGCM(self.key).encrypt(nonce, data, associated_data)
+
+    def decrypt_bytes(self, encrypted: bytes, associated_data: bytes = None) -> bytes:
+        '''
+        Decrypts and verifies data encrypted with encrypt_bytes, raises InvalidTag if data was modified
+        '''
+        nonce = encrypted[:self.nonce_size]
+        return AESGCM(self.key).decrypt(nonce, encrypted[self.nonce_size:], associated_data)
+
+
+cipher_modes = {
+    'ecb': ECB,
+    'cbc': CBC,
+    'aes': AES
+}
+
+
+def save_manifest(path: str, digests: np.array, image_shape: tuple, key_fingerprint: str) -> None:
+    '''
+    Saves per-block digest manifest of encrypted image (sidecar file used by incremental encryption)
+    '''
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as manifest_file:
+        np.savez(manifest_file, digests=digests, image_shape=np.array(image_shape), key=np.array(key_fingerprint))
+    os.replace(tmp_path, path)
+
+
+def load_manifest(path: str) -> dict:
+    '''
+    Reads manifest saved by save_manifest, returns None if file does not exist or is damaged
+    '''
+    try:
+        with np.load(path) as manifest:
+            return dict(digests=manifest['digests'], image_shape=tuple(int(size) for size in manifest['image_shape']), key=str(manifest['key']))
+    except (OSError, ValueError, KeyError) as e:
+        logger.info(f"Manifest {path} not available: {e}")
+        return None
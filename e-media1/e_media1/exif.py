@@ -0,0 +1,187 @@
+import logging
+import struct
+from typing import Dict, Iterator
+from e_media1.additional_data import EXIF_TAGS, GPS_TAGS, INTEROP_TAGS, EXIF_SUB_IFD_POINTERS, data_format_bytes, data_format_struct
+
+
+logger = logging.getLogger("loger")
+
+# names of tags used in each IFD
+IFD_TAGS = {
+    'IFD0': EXIF_TAGS,
+    'IFD1': EXIF_TAGS,
+    'Exif': EXIF_TAGS,
+    'GPS': GPS_TAGS,
+    'Interop': INTEROP_TAGS,
+}
+
+# data formats which can store sub-IFD offset: unsigned long and IFD
+SUB_IFD_POINTER_FORMATS = (4, 13)
+
+
+class ExifEntry:
+    '''
+    Single IFD entry. Only position of value is stored during indexing, value is decoded on first access.
+    '''
+    __slots__ = ('ifd', 'tag', 'data_format', 'count', 'value_offset', '_buffer', '_endian', '_value')
+
+    def __init__(self, ifd: str, tag: int, data_format: int, count: int, value_offset: int, buffer: memoryview, endian: str):
+        self.ifd = ifd
+        self.tag = tag
+        self.data_format = data_format
+        self.count = count
+        self.value_offset = value_offset
+        self._buffer = buffer
+        self._endian = endian
+        self._value = None
+
+    @property
+    def name(self) -> str:
+        tag_info = IFD_TAGS[self.ifd].get(self.tag)
+        return tag_info[0] if tag_info is not None else f"Tag_0x{self.tag:04X}"
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = self.decode()
+        return self._value
+
+    def decode(self):
+        '''
+        Decodes value of entry with correct byte order
+
+        Return:
+            * value: str for ascii data, bytes for undefined data, float for rationals and int/float for numbers.
+              Entries with more than one component are returned as tuples.
+        '''
+        code = data_format_struct[self.data_format]
+        if code == 's':
+            raw = bytes(self._buffer[self.value_offset:self.value_offset + self.count])
+            tag_info = IFD_TAGS[self.ifd].get(self.tag)
+            if self.data_format == 2 or (tag_info is not None and tag_info[1] == 'string'):
+                return raw.rstrip(b'\x00').decode(errors='replace')
+            return raw
+        if self.data_format in (5, 10):
+            numbers = struct.unpack_from(f"{self._endian}{2 * self.count}{code}", self._buffer, self.value_offset)
+            values = tuple(nominator / denominator if denominator else 0.0 for nominator, denominator in zip(numbers[::2], numbers[1::2]))
+        else:
+            values = struct.unpack_from(f"{self._endian}{self.count}{code}", self._buffer, self.value_offset)
+        return values[0] if self.count == 1 else values
+
+    def __repr__(self) -> str:
+        return f"ExifEntry({self.ifd}.{self.name}, format={self.data_format}, count={self.count})"
+
+
+class ExifIndex:
+    '''
+    Index of all entries stored in eXIf data (IFD0, IFD1 and Exif, GPS and Interop sub-IFDs) built in one pass
+    over memoryview of chunk data, without copying it.
+    '''
+
+    def __init__(self, data: bytes):
+        self.buffer = memoryview(data)
+        self.ifds: Dict[str, Dict[int, ExifEntry]] = dict()
+
+        # checking byte align: MM - big endian | II - small endian
+        byte_align = bytes(self.buffer[0:2])
+        if byte_align == b'MM':
+            self.endian = '>'
+        elif byte_align == b'II':
+            self.endian = '<'
+        else:
+            raise ValueError(f"Wrong eXIf byte align: {byte_align}")
+        _tag_mark, first_ifd_offset = struct.unpack_from(self.endian + 'HL', self.buffer, 2)
+
+        visited = set()
+        pending = [('IFD0', first_ifd_offset)]
+        while pending:
+            ifd_name, offset = pending.pop(0)
+            if offset == 0 or offset in visited:
+                continue
+            visited.add(offset)
+            try:
+                next_ifd_offset = self._index_ifd(ifd_name, offset, pending)
+            except struct.error as e:
+                logger.error(f"Exception during {ifd_name} read: {e}")
+                continue
+            # IFD0 links to IFD1 (thumbnail), IFD1 ends the chain
+            if ifd_name == 'IFD0' and self._is_valid_offset(next_ifd_offset):
+                pending.append(('IFD1', next_ifd_offset))
+
+    def _is_valid_offset(self, offset: int) -> bool:
+        # IFD needs at least its entries counter and next IFD offset
+        return 8 <= offset and offset + 6 <= len(self.buffer)
+
+    def _index_ifd(self, ifd_name: str, offset: int, pending: list) -> int:
+        '''
+        Indexes entries of single IFD, sub-IFD pointers are added to pending list
+
+        Structure of each entry (12 bytes):
+            - Tag - 2 bytes
+            - Data Format - 2 bytes
+            - Components Number - 4 bytes -> (Data Format * Components Number) gives size of data:
+                * above 4 bytes *Values* stores offset to data
+                * 4 bytes or less *Values* stores data itself
+            - Values - 4 bytes
+
+        Sub-IFD pointer is followed only if it is single LONG/IFD value pointing inside eXIf data,
+        otherwise it is skipped.
+
+        Return:
+            *next_ifd_offset -> int: offset of next IFD in chain (0 if there is none)
+        '''
+        endian = self.endian
+        buffer = self.buffer
+        num_entries = struct.unpack_from(endian + 'H', buffer, offset)[0]
+        # next IFD offset is read first, so chain is followed even if entries are damaged
+        next_ifd_offset = struct.unpack_from(endian + 'L', buffer, offset + 2 + 12 * num_entries)[0]
+        entries = self.ifds.setdefault(ifd_name, dict())
+        position = offset + 2
+        for _ in range(num_entries):
+            tag, data_format, count, value = struct.unpack_from(endian + 'HHLL', buffer, position)
+            component_size = data_format_bytes.get(data_format)
+            if component_size is None:
+                logger.error(f"Unknown data format {data_format} of tag {tag} in {ifd_name}")
+                position += 12
+                continue
+            value_offset = value if component_size * count > 4 else position + 8
+            if value_offset + component_size * count > len(buffer):
+                logger.error(f"Value of tag {tag} in {ifd_name} outside of eXIf data")
+                position += 12
+                continue
+            entries[tag] = ExifEntry(ifd_name, tag, data_format, count, value_offset, buffer, endian)
+            sub_ifd = EXIF_SUB_IFD_POINTERS.get(tag)
+            if sub_ifd is not None and ifd_name in ('IFD0', 'IFD1', 'Exif'):
+                if data_format in SUB_IFD_POINTER_FORMATS and count == 1 and self._is_valid_offset(value):
+                    pending.append((sub_ifd, value))
+                else:
+                    logger.error(f"Skipping malformed {sub_ifd} pointer in {ifd_name} (format {data_format}, count {count}, offset {value})")
+            position += 12
+        return next_ifd_offset
+
+    def get(self, name: str, ifd: str = None):
+        '''
+        Returns decoded value of tag with given name (first found if ifd is not given) or None
+        '''
+        for entry in self.entries(ifd):
+            if entry.name == name:
+                return entry.value
+        return None
+
+    def entries(self, ifd: str = None) -> Iterator[ExifEntry]:
+        for ifd_name, entries in self.ifds.items():
+            if ifd is None or ifd == ifd_name:
+                yield from entries.values()
+
+    def to_dict(self, *ifds: str) -> Dict:
+        '''
+        Decodes all entries from given IFDs into dictionary {tag name: value}
+        '''
+        decoded = dict()
+        for ifd in ifds:
+            for entry in self.entries(ifd):
+                try:
+                    decoded[entry.name] = entry.value
+                except Exception as e:
+                    logger.error(f"Error reading IFD catalogue: {e}")
+        return decoded
@@ -0,0 +1,140 @@
+import importlib.util
+import logging
+import os
+import threading
+import numpy as np
+
+# numba is only looked up here, importing it takes ~0.2 s so it is imported when first kernel is compiled
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+
+logger = logging.getLogger("loger")
+
+# compiled kernels are used when numba is installed, E_MEDIA1_NO_JIT=1 forces pure Python/NumPy path
+USE_JIT = NUMBA_AVAILABLE and not os.environ.get("E_MEDIA1_NO_JIT")
+
+_compiled = None
+_compile_lock = threading.Lock()
+
+
+def _unfilter_average(x: np.array, prior: np.array, bpp: int) -> np.array:
+    out = np.empty_like(x)
+    for i in range(bpp):
+        out[i] = (x[i] + (prior[i] >> 1)) & 0xff
+    for i in range(bpp, x.shape[0]):
+        out[i] = (x[i] + ((np.int32(out[i - bpp]) + prior[i]) >> 1)) & 0xff
+    return out
+
+
+def _unfilter_paeth(x: np.array, prior: np.array, bpp: int) -> np.array:
+    out = np.empty_like(x)
+    for i in range(bpp):
+        out[i] = (x[i] + prior[i]) & 0xff
+    for i in range(bpp, x.shape[0]):
+        a = np.int32(out[i - bpp])
+        b = np.int32(prior[i])
+        c = np.int32(prior[i - bpp])
+        p = a + b - c
+        pa = abs(p - a)
+        pb = abs(p - b)
+        pc = abs(p - c)
+        if pa <= pb and pa <= pc:
+            predictor = a
+        elif pb <= pc:
+            predictor = b
+        else:
+            predictor = c
+        out[i] = (x[i] + predictor) & 0xff
+    return out
+
+
+def compiled_kernels() -> dict:
+    '''
+    Imports numba and wraps kernels on first call. Machine code is compiled on first call of each kernel
+    and cached in __pycache__ for next runs. Pure Python kernels are returned if numba cannot be imported.
+    '''
+    global _compiled
+    if _compiled is None:
+        with _compile_lock:
+            if _compiled is None:
+                kernels = dict(unfilter_average=_unfilter_average, unfilter_paeth=_unfilter_paeth)
+                try:
+                    from numba import njit
+                    kernels = {name: njit(cache=True, nogil=True)(kernel) for name, kernel in kernels.items()}
+                except ImportError as e:
+                    logger.error(f"Numba import failed, pure Python kernels are used: {e}")
+                _compiled = kernels
+    return _compiled
+
+
+def unfilter_scanline(filter_type: int, x: np.array, prior: np.array, bytes_number: int) -> np.array:
+    '''
+    Compiled reconstruction of Average (3) and Paeth (4) filtered scanline
+
+    Args:
+        * filter_type (int): 3 or 4
+        * x (np.array): filtered scanline (uint8)
+        * prior (np.array): reconstructed previous scanline (uint8)
+        * bytes_number (int): The number of bytes per pixel.
+
+    Returns:
+        * np.array: reconstructed scanline (uint8)
+    '''
+    if filter_type == 3:
+        return compiled_kernels()['unfilter_average'](x, prior, bytes_number)
+    if filter_type == 4:
+        return compiled_kernels()['unfilter_paeth'](x, prior, bytes_number)
+    raise ValueError(f"Filter type {filter_type} has no compiled kernel")
+
+
+def check_parity(width: int = 97, bytes_number: int = 3, seed: int = 0) -> bool:
+    '''
+    Compares selected kernels with per-byte ReconstructingMethods implementation on random scanlines
+    of all filter types.
+
+    Return:
+        * bool: True if all results are identical
+    '''
+    from e_media1.filtering_methods import ReconstructingMethods
+
+    per_byte = {
+        0: ReconstructingMethods.none,
+        1: ReconstructingMethods.Sub,
+        2: ReconstructingMethods.Up,
+        3: ReconstructingMethods.Average,
+        4: ReconstructingMethods.Paeth,
+    }
+    rng = np.random.default_rng(seed)
+    length = width * bytes_number
+    identical = True
+    for filter_type in range(5):
+        prior = rng.integers(0, 256, length, dtype=np.uint8)
+        x = rng.integers(0, 256, length, dtype=np.uint8)
+        # per-byte methods work on flat list of all reconstructed bytes, prior scanline is row 0
+        reconstructed = prior.tolist() + [0] * length
+        for col in range(length):
+            reconstructed[length + col] = per_byte[filter_type](int(x[col]), 1, col, reconstructed, width, bytes_number) & 0xff
+        expected = np.array(reconstructed[length:], dtype=np.uint8)
+        result = ReconstructingMethods.reconstruct_scanline(filter_type, x.tobytes(), prior, bytes_number)
+        if not np.array_equal(result, expected):
+            logger.error(f"Reconstruction of filter type {filter_type} differs from per-byte implementation")
+            identical = False
+    return identical
+
+
+if __name__ == '__main__':
+    import time
+    from e_media1.logger_setup import setup_color_logging
+    from e_media1.filtering_methods import ReconstructingMethods
+
+    setup_color_logging()
+    logger.info(f"Numba available: {NUMBA_AVAILABLE}, compiled kernels used: {USE_JIT}")
+    result = all(check_parity(width, bytes_number, seed) for width in (1, 2, 97) for bytes_number in (1, 2, 3, 4) for seed in range(3))
+    logger.info(f"Parity with per-byte implementation: {'OK' if result else 'FAILED'}")
+
+    x = np.random.default_rng(0).integers(0, 256, 4 * 4096, dtype=np.uint8)
+    prior = np.random.default_rng(1).integers(0, 256, 4 * 4096, dtype=np.uint8)
+    for filter_type in (3, 4):
+        start = time.perf_counter()
+        for _ in range(100):
+            ReconstructingMethods.reconstruct_scanline(filter_type, x.tobytes(), prior, 4)
+        logger.info(f"Filter {filter_type}: {(time.perf_counter() - start) * 10:.3f} ms per 4096 px RGBA scanline")
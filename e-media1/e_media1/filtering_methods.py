@@ -1,6 +1,7 @@
 import logging
 import math
 import numpy as np
+from e_media1 import filtering_kernels
 
 logger = logging.getLogger("loger")
 
@@ -186,6 +187,63 @@ class ReconstructingMethods:
             Pr = c
         return Pr
 
+    @staticmethod
+    def reconstruct_scanline(filter_type: int, scanline: bytes, previous: np.array, bytes_number: int) -> np.array:
+        '''
+        Reverses filtering of whole scanline at once. None, Sub and Up are vectorized, Average and Paeth are serial within row
+        and use compiled kernels from filtering_kernels when numba is installed.
+
+        Args:
+            * filter_type (int): filter type byte stored before scanline.
+            * scanline (bytes): filtered scanline without filter type byte.
+            * previous (np.array): reconstructed previous scanline or None for first row.
+            * bytes_number (int): The number of bytes per pixel.
+
+        Returns:
+            * np.array: reconstructed scanline (uint8).
+        '''
+        x = np.frombuffer(scanline, dtype=np.uint8)
+        if filter_type == 0:
+            return x.copy()
+        if filter_type == 1:
+            # Sub: running sum (mod 256) over pixels, separately for each byte of pixel
+            return np.cumsum(x.reshape(-1, bytes_number), axis=0, dtype=np.uint8).reshape(-1)
+        if previous is None:
+            previous = np.zeros_like(x)
+        if filter_type == 2:
+            return x + previous
+        if filter_type not in (3, 4):
+            raise ValueError(f"Unknown filter type: {filter_type}")
+        if filtering_kernels.USE_JIT:
+            return filtering_kernels.unfilter_scanline(filter_type, x, previous, bytes_number)
+
+        out = bytearray(x.tobytes())
+        prior = previous.tobytes()
+        bpp = bytes_number
+        if filter_type == 3:
+            for i in range(bpp):
+                out[i] = (out[i] + (prior[i] >> 1)) & 0xff
+            for i in range(bpp, len(out)):
+                out[i] = (out[i] + ((out[i - bpp] + prior[i]) >> 1)) & 0xff
+        else:
+            for i in range(bpp):
+                out[i] = (out[i] + prior[i]) & 0xff
+            for i in range(bpp, len(out)):
+                a = out[i - bpp]
+                b = prior[i]
+                c = prior[i - bpp]
+                p = a + b - c
+                pa = abs(p - a)
+                pb = abs(p - b)
+                pc = abs(p - c)
+                if pa <= pb and pa <= pc:
+                    out[i] = (out[i] + a) & 0xff
+                elif pb <= pc:
+                    out[i] = (out[i] + b) & 0xff
+                else:
+                    out[i] = (out[i] + c) & 0xff
+        return np.frombuffer(out, dtype=np.uint8)
+
 
 class FilteringMethods:
 
@@ -1,10 +1,69 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from e_media1.chunksclasses import Image
 import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable
+from e_media1.chunksclasses import Image, ScanlineStream
+from e_media1.additional_data import color_type_bytes
+
+try:
+    import scipy.fft as fft_backend
+    FFT_BACKEND = "scipy"
+except ImportError:
+    fft_backend = np.fft
+    FFT_BACKEND = "numpy"
 
 logger = logging.getLogger("loger")
 
+
+@dataclass
+class SpectrumResult:
+    '''
+    Result of headless Fourier analysis of single grayscale image
+    '''
+    magnitude: np.array = None
+    phase: np.array = None
+    inverse_error: float = None
+    plot_path: str = None
+
+
+@dataclass
+class WelchSpectrum:
+    '''
+    Averaged power spectrum computed from windowed image tiles
+    '''
+    power: np.array
+    tiles: int
+    tile_size: int
+
+    @property
+    def magnitude(self) -> np.array:
+        '''Power spectrum in dB'''
+        return 10 * np.log10(np.maximum(self.power, np.finfo(np.float64).tiny))
+
+
+def luminance(raw_image_data: np.array) -> np.array:
+    '''
+    Converts decoded IDAT data (height x width x channels) to grayscale with integer BT.601 weights.
+    Alpha channel is ignored, grayscale images are returned as they are (palette has to be expanded before).
+
+    Args:
+        *raw_image_data -> np.array: decoded image data (Image.rawIDATData)
+
+    Return:
+        *grayscale -> np.array: 2D uint8 array with luminance of each pixel
+    '''
+    channels = raw_image_data.shape[2]
+    if channels < 3:
+        return raw_image_data[:, :, 0]
+    # Y = 0.299 R + 0.587 G + 0.114 B in 16-bit fixed point
+    rgb = raw_image_data[:, :, :3].astype(np.uint32)
+    grayscale = (rgb[:, :, 0] * 19595 + rgb[:, :, 1] * 38470 + rgb[:, :, 2] * 7471 + 32768) >> 16
+    return grayscale.astype(np.uint8)
+
 def performFourierTransform(img:np.array) -> np.fft.fftshift:
     ft = np.fft.fftshift(img)
     ft = np.fft.fft2(ft)
@@ -23,6 +82,8 @@ def CompareTransformResults(base_img: np.array,img_after_transformations: np.arr
 
 
 def createFourierPlots(grayscale_img:np.array) -> None:
+    import matplotlib.pyplot as plt
+
     logger.info("Creating Fourier Plots")
     ft = performFourierTransform(grayscale_img)
     reversed_img = performInverseFourierTransform(ft)
@@ -46,4 +107,247 @@ def createFourierPlots(grayscale_img:np.array) -> None:
     # sprawdzenie rezultatów - porównanie wartości miedzy obrazem oryginalnym i po odwrotnej transformacie
     plt.figtext(x = 0.35, y=0.9,s = f"Difference between images: {np.around(diff,4)}")
     
-    plt.show() 
\ No newline at end of file
+    plt.show()
+
+
+def _real_fft2(img: np.array, workers: int) -> np.array:
+    if FFT_BACKEND == "scipy":
+        return fft_backend.rfft2(img, workers=workers)
+    return fft_backend.rfft2(img)
+
+
+def _inverse_real_fft2(ft: np.array, shape: tuple, workers: int) -> np.array:
+    if FFT_BACKEND == "scipy":
+        return fft_backend.irfft2(ft, s=shape, workers=workers)
+    return fft_backend.irfft2(ft, s=shape)
+
+
+def expand_half_spectrum(half: np.array, width: int, odd: bool = False) -> np.array:
+    '''
+    Rebuilds full spectrum from rfft2 output using hermitian symmetry F[k1,k2] = conj(F[-k1,-k2])
+
+    Args:
+        *half -> np.array: real valued array computed from rfft2 output (magnitude or phase), shape (height, width//2 + 1)
+        *width -> int: width of transformed image
+        *odd -> bool = False: True for odd functions of spectrum (phase), which change sign in mirrored part
+
+    Return:
+        *full -> np.array: array with shape (height, width)
+    '''
+    height, half_width = half.shape
+    full = np.empty((height, width), dtype=half.dtype)
+    full[:, :half_width] = half
+    mirrored_cols = np.arange(half_width, width)
+    if mirrored_cols.size:
+        mirrored_rows = (-np.arange(height)) % height
+        mirrored = half[mirrored_rows][:, width - mirrored_cols]
+        full[:, half_width:] = -mirrored if odd else mirrored
+    return full
+
+
+def analyze_spectrum(grayscale_img: np.array, check_inverse: bool = False, full_spectrum: bool = True, workers: int = -1) -> SpectrumResult:
+    '''
+    Headless Fourier analysis: real FFT computed in float32, with optional inverse transformation check
+
+    Args:
+        *grayscale_img -> np.array: 2D image data
+        *check_inverse -> bool = False: if True inverse transformation is performed and mean absolute difference is stored in result
+        *full_spectrum -> bool = True: if False only non-redundant half of spectrum (rfft2 output) is returned
+        *workers -> int = -1: number of scipy.fft workers (-1 means all CPUs), ignored with numpy backend
+
+    Return:
+        *result -> SpectrumResult: centered magnitude (dB) and phase arrays
+    '''
+    img = np.asarray(grayscale_img, dtype=np.float32)
+    ft = _real_fft2(img, workers)
+    magnitude = 20 * np.log10(np.maximum(np.abs(ft), np.finfo(np.float32).tiny))
+    phase = np.angle(ft)
+
+    inverse_error = None
+    if check_inverse:
+        reversed_img = _inverse_real_fft2(ft, img.shape, workers)
+        inverse_error = float(CompareTransformResults(img, reversed_img))
+    del ft
+
+    if full_spectrum:
+        width = img.shape[1]
+        magnitude = np.fft.fftshift(expand_half_spectrum(magnitude, width))
+        phase = np.fft.fftshift(expand_half_spectrum(phase, width, odd=True))
+    else:
+        magnitude = np.fft.fftshift(magnitude, axes=0)
+        phase = np.fft.fftshift(phase, axes=0)
+    return SpectrumResult(magnitude.astype(np.float32), phase.astype(np.float32), inverse_error)
+
+
+def save_spectrum_plots(grayscale_img: np.array, result: SpectrumResult, output_path: str) -> str:
+    '''
+    Saves original image, FFT magnitude and phase as PNG figure with Agg backend (no display needed)
+
+    Args:
+        *grayscale_img -> np.array: 2D image data
+        *result -> SpectrumResult: result of analyze_spectrum
+        *output_path -> str: path of output PNG file
+
+    Return:
+        *output_path -> str: path of saved file
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(12, 4))
+    FigureCanvasAgg(figure)
+    plots = [(grayscale_img, "Original Image"), (result.magnitude, "FFT Magnitude"), (result.phase, "FFT Phase")]
+    for idx, (data, title) in enumerate(plots):
+        axis = figure.add_subplot(1, 3, idx + 1)
+        axis.imshow(data, cmap='gray')
+        axis.axis("off")
+        axis.set_title(title)
+    if result.inverse_error is not None:
+        figure.text(x=0.35, y=0.02, s=f"Difference between images: {np.around(result.inverse_error,4)}")
+    figure.savefig(output_path)
+    return output_path
+
+
+def _analyze_file(path: str, output_dir: str, check_inverse: bool, workers: int) -> SpectrumResult:
+    with open(path, 'rb') as image_binary:
+        image = Image(image_binary, output_dir or "")
+    grayscale_img = luminance(image.criticalChunks.expand_palette(image.rawIDATData))
+    result = analyze_spectrum(grayscale_img, check_inverse=check_inverse, workers=workers)
+    if output_dir is not None:
+        plot_path = os.path.join(output_dir, Path(path).stem + "_fft.png")
+        save_spectrum_plots(grayscale_img, result, plot_path)
+        # arrays are already saved in figure, we return only lightweight result
+        result = SpectrumResult(inverse_error=result.inverse_error, plot_path=plot_path)
+    return result
+
+
+def analyze_images(paths: Iterable[str], output_dir: str = None, check_inverse: bool = False, workers: int = -1, processes: int = 1) -> Dict[str, SpectrumResult]:
+    '''
+    Batch Fourier analysis of many PNG images
+
+    Args:
+        *paths -> Iterable[str]: paths to PNG files
+        *output_dir -> str = None: if given spectrum plots are saved there and results contain only plot paths and inverse errors
+        *check_inverse -> bool = False: perform inverse transformation check for every image
+        *workers -> int = -1: number of scipy.fft workers per image
+        *processes -> int = 1: number of worker processes decoding and transforming images in parallel
+
+    Return:
+        *results -> Dict[str, SpectrumResult]: results for each succesfully analyzed path
+    '''
+    paths = [str(path) for path in paths]
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Fourier analysis of {len(paths)} images ({FFT_BACKEND} backend)")
+    results = dict()
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {path: executor.submit(_analyze_file, path, output_dir, check_inverse, workers) for path in paths}
+            for path, future in futures.items():
+                try:
+                    results[path] = future.result()
+                except Exception as e:
+                    logger.error(f"Fourier analysis of {path} failed: {e}")
+    else:
+        for path in paths:
+            try:
+                results[path] = _analyze_file(path, output_dir, check_inverse, workers)
+            except Exception as e:
+                logger.error(f"Fourier analysis of {path} failed: {e}")
+    return results
+
+
+def _tile_power(tile: np.array, window: np.array) -> np.array:
+    tile = (tile - tile.mean()) * window
+    ft = _real_fft2(tile, 1)
+    return ft.real.astype(np.float64) ** 2 + ft.imag.astype(np.float64) ** 2
+
+
+def welch_spectrum(image_binary_data, tile_size: int = 256, overlap: float = 0.5, max_workers: int = None) -> WelchSpectrum:
+    '''
+    Tiled (Welch method) power spectrum of PNG image. Scanlines are streamed from decoder and only
+    band of tile_size rows is kept in memory, tiles are windowed with Hann window and transformed in thread pool.
+
+    Args:
+        *image_binary_data: PNG file opened in binary mode
+        *tile_size -> int = 256: size of square tile
+        *overlap -> float = 0.5: overlap of neighbouring tiles (0 <= overlap < 1)
+        *max_workers -> int = None: number of threads transforming tiles
+
+    Return:
+        *result -> WelchSpectrum: centered power spectrum averaged over all tiles (tile_size x tile_size)
+    '''
+    if not 0 <= overlap < 1:
+        raise ValueError(f"Overlap must be in range [0, 1): {overlap}")
+    stream = ScanlineStream(image_binary_data)
+    width, height = stream.IHDR.width, stream.IHDR.height
+    channels = color_type_bytes.get(stream.IHDR.color)
+    tile_size = min(tile_size, width, height)
+    step = max(1, tile_size - int(tile_size * overlap))
+    logger.info(f"Tiled Fourier analysis: {tile_size}x{tile_size} tiles, step {step}")
+
+    hann = np.hanning(tile_size).astype(np.float32)
+    window = np.outer(hann, hann)
+    window_power = float(np.sum(window.astype(np.float64) ** 2))
+
+    band = np.empty((tile_size, width), dtype=np.float32)
+    filled = 0
+    power_sum = None
+    tiles = 0
+    max_workers = max_workers or os.cpu_count() or 1
+    pending = deque()
+
+    def collect(future):
+        nonlocal power_sum, tiles
+        power = future.result()
+        power_sum = power if power_sum is None else power_sum + power
+        tiles += 1
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for scanline in stream:
+            pixels = scanline.reshape(1, width, channels)
+            if stream.IHDR.color == 3 and stream.PLTE is not None:
+                pixels = stream.PLTE.expand(pixels[:, :, 0])
+            band[filled] = luminance(pixels)[0]
+            filled += 1
+            if filled < tile_size:
+                continue
+            for col in range(0, width - tile_size + 1, step):
+                # limiting number of tiles waiting in queue keeps memory bounded
+                while len(pending) >= 2 * max_workers:
+                    collect(pending.popleft())
+                pending.append(executor.submit(_tile_power, band[:, col:col + tile_size].copy(), window))
+            band[:tile_size - step] = band[step:]
+            filled = tile_size - step
+        while pending:
+            collect(pending.popleft())
+
+    if tiles == 0:
+        raise ValueError("Image too small for tiled analysis")
+    power = power_sum / (tiles * window_power)
+    power = np.fft.fftshift(expand_half_spectrum(power, tile_size))
+    return WelchSpectrum(power, tiles, tile_size)
+
+
+def save_power_spectrum_plot(result: WelchSpectrum, output_path: str) -> str:
+    '''
+    Saves averaged power spectrum as PNG figure with Agg backend
+
+    Args:
+        *result -> WelchSpectrum: result of welch_spectrum
+        *output_path -> str: path of output PNG file
+
+    Return:
+        *output_path -> str: path of saved file
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(5, 5))
+    FigureCanvasAgg(figure)
+    axis = figure.add_subplot(1, 1, 1)
+    axis.imshow(result.magnitude, cmap='gray')
+    axis.axis("off")
+    axis.set_title(f"Welch Power Spectrum ({result.tiles} tiles)")
+    figure.savefig(output_path)
+    return output_path
@@ -1,4 +1,6 @@
 import logging
+import time
+from contextlib import contextmanager
 import colorlog
 
 
@@ -23,4 +25,22 @@ def setup_color_logging():
     logger.addHandler(handler)
     logger.setLevel(logging.DEBUG)
 
-    return logger
\ No newline at end of file
+    return logger
+
+
+@contextmanager
+def timed(stage: str, details=None):
+    '''
+    Logs duration of code block, optional details (e.g. cache statistics) are added to log line.
+    Details can be callable, then they are evaluated after code block finishes.
+    '''
+    logger = logging.getLogger("loger")
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if callable(details):
+            details = details()
+        suffix = f" ({details})" if details is not None else ""
+        logger.info(f"{stage} took {elapsed:.3f} s{suffix}")
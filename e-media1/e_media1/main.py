@@ -1,12 +1,23 @@
 import argparse
+from contextlib import nullcontext
 from pathlib import Path
-import matplotlib.pyplot as plt
-from e_media1.chunksclasses import Image
-from e_media1.fourier import createFourierPlots
+from e_media1.chunksclasses import Image, ScanlineStream
+from e_media1.fourier import createFourierPlots, luminance, analyze_spectrum, save_spectrum_plots, welch_spectrum, save_power_spectrum_plot
 from e_media1.encrypt import ECB
 from e_media1.additional_data import *
-from e_media1.logger_setup import setup_color_logging
+from e_media1.logger_setup import setup_color_logging, timed
+from e_media1.decode_cache import DecodeCache
+from e_media1.passthrough import strip_chunks
+from e_media1.scratch import ScratchSpace
+from e_media1.shared_pool import SharedMemoryPool
+from e_media1.analytics import analyze_file
+from e_media1.verify import verify_files
+from e_media1.color import convert_colors, COLOR_TARGETS
+from e_media1.compressed_crypto import encrypt_and_decrypt_compressed, read_chunks
 import os
+import sys
+import png
+import numpy as np
 
 parser = argparse.ArgumentParser(description="Process PNG File")
 parser.add_argument('path',help = 'Path to PNG file')
@@ -14,11 +25,37 @@ parser.add_argument('-d','--displayImageData', action='store_true', required=Fal
 parser.add_argument('-r','--removeAnc', action='store_true', required=False, dest='remove_anc',help="Remove all Ancillary Chunks from file")
 parser.add_argument('-e', '--ecbencrypt', action='store_true',required=False,dest ='ECBencrypt',help="Encrypt Image with ECB algorithm")
 parser.add_argument('-c', '--cbcencrypt', action='store_true',required=False,dest ='CBCencrypt',help="Encrypt Image with CBC algorithm")
+parser.add_argument('-a', '--aesencrypt', action='store_true',required=False,dest ='AESencrypt',help="Encrypt compressed image data with AES-GCM")
+parser.add_argument('--compressed', action='store_true',required=False,dest ='compressed',help="Encrypt compressed IDAT data with -e/-c (image is not decoded, encrypted image is not viewable)")
+parser.add_argument('-j', '--jobs', type=int, required=False, dest='jobs', help="With -e encrypt and decrypt blocks, with -c decrypt blocks in given number of worker processes (data is passed through shared memory)")
+parser.add_argument('--incremental', action='store_true',required=False,dest ='incremental',help="With -e re-encrypt only blocks changed since previous run (needs --keys)")
+parser.add_argument('--keys', required=False, dest='key_file', help="JSON file with RSA keys used by --incremental, created if it does not exist")
+parser.add_argument('-f', '--fourierPlots', required=False, dest='fourier_dir', help="Save Fourier spectrum plots to given directory without displaying them")
+parser.add_argument('--fftCheck', action='store_true', required=False, dest='fft_check', help="Check Fourier transformation with inverse transformation (used with -f)")
+parser.add_argument('-w', '--welch', type=int, required=False, dest='welch_tile', help="Save tiled (Welch) power spectrum computed with given tile size, memory use depends only on tile size")
+parser.add_argument('--cache', required=False, dest='cache_dir', help="Directory of decoded data cache, repeated runs on same image skip decoding")
+parser.add_argument('--cacheSize', type=int, default=1024, required=False, dest='cache_size', help="Size cap of decoded data cache in MB (default 1024)")
+parser.add_argument('--scratch', required=False, dest='scratch_dir', help="Directory of memory mapped working arrays (decoded, encrypted, decrypted data) for images larger than RAM")
+parser.add_argument('--keep', required=False, dest='keep_chunks', help="Comma separated ancillary chunk types kept when removing ancillary chunks (e.g. iCCP,sRGB)")
+parser.add_argument('--drop', required=False, dest='drop_chunks', help="Comma separated ancillary chunk types removed from restored file (e.g. eXIf,tEXt)")
+parser.add_argument('-m', '--metrics', action='store_true', required=False, dest='metrics', help="Save cipher quality metrics (entropy, correlation, NPCR/UACI, duplicate blocks) of images encrypted with -e/-c as JSON, without -e/-c metrics of input image")
+parser.add_argument('--verify', action='store_true', required=False, dest='verify', help="Compare pixels of decrypted images of -e/-c with input image, exit code is 1 if they differ")
+parser.add_argument('--verifyAgainst', required=False, dest='verify_against', help="Compare pixels of image with given PNG file, exit code is 1 if they differ")
+parser.add_argument('--countMismatches', action='store_true', required=False, dest='count_mismatches', help="With --verify/--verifyAgainst count all mismatched rows instead of stopping at first one")
+parser.add_argument('--color', choices=COLOR_TARGETS, required=False, dest='color_target', help="Save image with gAMA/cHRM color correction applied: 'srgb' (8 bit) or 'linear' (16 bit linear light)")
+parser.add_argument('-t', '--thumbnail', type=int, choices=[2, 4, 8], required=False, dest='thumbnail_scale', help="Save box filtered thumbnail reduced 2, 4 or 8 times, decoded in one streaming pass")
 args = parser.parse_args()
+if args.incremental and not args.key_file:
+    parser.error("--incremental requires --keys (ciphertext of unchanged blocks can be reused only with the same keys)")
+if args.incremental and args.verify:
+    parser.error("--verify cannot be used with --incremental (incremental encryption does not write decrypted image)")
 
+# pypng mode of thumbnail for number of channels
+THUMBNAIL_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
 
 
-def main():
+
+def main() -> int:
     #setting up logger
     logger = setup_color_logging()
     logger.info("Starting the application")
@@ -26,28 +63,123 @@ def main():
     #sprawdzenie czy istnieje plik pod podana sciezka
     if Path(args.path).is_file():
 
-        # odczytanie i transformacja do grayscale 
-        img = plt.imread(args.path)
-        grayscale_image = img[:, :, :3].mean(axis=2)
-
         # creating directory for images
         save_path:str = os.path.dirname(os.path.abspath(__file__))+"/../output_images/"
         os.makedirs(save_path, exist_ok=True)
 
+        if(args.welch_tile):
+            # widmo liczone z kafelkow strumieniowo - bez dekodowania calego obrazu do pamieci
+            with open(args.path,'rb') as image_binary:
+                welch = welch_spectrum(image_binary, tile_size=args.welch_tile)
+            plot_dir = args.fourier_dir or save_path
+            os.makedirs(plot_dir, exist_ok=True)
+            plot_path = save_power_spectrum_plot(welch, os.path.join(plot_dir, Path(args.path).stem + "_welch.png"))
+            logger.info(f"Welch power spectrum saved: {plot_path}")
+
+        if(args.thumbnail_scale):
+            # miniatura liczona strumieniowo z kolejnych wierszy - bez pelnej tablicy obrazu
+            with open(args.path,'rb') as image_binary:
+                with timed("Decoding thumbnail"):
+                    thumbnail = ScanlineStream(image_binary).decode_thumbnail(args.thumbnail_scale)
+            height, width, channels = thumbnail.shape
+            thumbnail_path = os.path.join(save_path, Path(args.path).stem + "_thumbnail.png")
+            png.from_array(thumbnail.reshape(height, width * channels), mode=THUMBNAIL_MODES[channels]).save(thumbnail_path)
+            logger.info(f"Thumbnail saved: {thumbnail_path}")
+
+        decode_cache = DecodeCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+
+        # przepisanie chunkow bez dekodowania danych IDAT
+        with timed("Rewriting chunks"):
+            strip_chunks(args.path, save_path+"/restored.png", remove_ancillary=args.remove_anc,
+                         keep=args.keep_chunks.split(',') if args.keep_chunks else None,
+                         drop=args.drop_chunks.split(',') if args.drop_chunks else None)
+
+        # szyfrowanie skompresowanych danych IDAT - bez dekompresji i filtrowania
+        compressed_modes = [mode for mode, requested in (('ecb', args.ECBencrypt and args.compressed),
+                                                         ('cbc', args.CBCencrypt and args.compressed),
+                                                         ('aes', args.AESencrypt)) if requested]
+        if compressed_modes:
+            critical, ancillary = read_chunks(args.path)
+            for mode in compressed_modes:
+                with timed(f"{mode.upper()} encryption of compressed data"):
+                    encrypt_and_decrypt_compressed(critical, ancillary, save_path, mode)
+
+        # obraz dekodowany tylko gdy dane pikseli sa potrzebne
+        pixel_encryption = not args.compressed and (args.ECBencrypt or args.CBCencrypt)
+        # kod wyjscia 1 gdy ktorakolwiek weryfikacja sie nie powiodla
+        verification_failed = False
+        if args.verify_against:
+            with timed("Verification"):
+                verification_failed |= not verify_files(args.path, args.verify_against, stop_at_first=not args.count_mismatches).identical
+        if args.metrics and not pixel_encryption:
+            with timed("Cipher metrics"):
+                analyze_file(args.path).to_json(os.path.join(save_path, Path(args.path).stem + "_metrics.json"))
+        if not (args.display_data or args.fourier_dir or args.color_target or pixel_encryption):
+            return int(verification_failed)
+
+        # sciezki obrazow zapisanych w tym uruchomieniu - metryki i weryfikacja nie uzywaja starych plikow
+        outputs = dict()
         with open(args.path,'r+b') as image_binary:
-            image = Image(image_binary, save_path)
+            with timed("Decoding image", lambda: decode_cache):
+                image = Image(image_binary, save_path, decode_cache=decode_cache, scratch=ScratchSpace(args.scratch_dir))
             if(args.display_data):
                 image.displayImageData()
-                createFourierPlots(grayscale_image)
-            if(args.ECBencrypt):
-                image.encrypt_and_decrypt_image_using_ecb(library_func=True)
-            if(args.CBCencrypt):
-                image.encrypt_and_decrypt_image_using_cbc()
-            with open(save_path+"/restored.png",'wb') as out_image:
-                out_image = image.recreate_png_with_chunks(out_image, args.remove_anc)
+                # transformacja do grayscale z juz zdekodowanych danych IDAT
+                createFourierPlots(luminance(image.criticalChunks.expand_palette(image.rawIDATData)))
+            if(args.fourier_dir):
+                grayscale_image = luminance(image.criticalChunks.expand_palette(image.rawIDATData))
+                spectrum = analyze_spectrum(grayscale_image, check_inverse=args.fft_check)
+                os.makedirs(args.fourier_dir, exist_ok=True)
+                plot_path = save_spectrum_plots(grayscale_image, spectrum, os.path.join(args.fourier_dir, Path(args.path).stem + "_fft.png"))
+                logger.info(f"Fourier plots saved: {plot_path}")
+            if(args.color_target):
+                # korekcja kolorow z tablic LUT (gAMA) i macierzy (cHRM)
+                with timed("Color conversion"):
+                    converted = convert_colors(image.criticalChunks.expand_palette(image.rawIDATData), image.ancillaryChunks.ChunkList,
+                                               target=args.color_target)
+                height, width, channels = converted.shape
+                color_path = os.path.join(save_path, Path(args.path).stem + f"_{args.color_target}.png")
+                if args.color_target == 'linear':
+                    converted = np.rint(converted * 65535).astype(np.uint16)
+                    png.from_array(converted.reshape(height, width * channels), mode=f"{THUMBNAIL_MODES[channels]};16", info={'gamma': 1.0}).save(color_path)
+                else:
+                    png.from_array(converted.reshape(height, width * channels), mode=THUMBNAIL_MODES[channels]).save(color_path)
+                logger.info(f"Color corrected image saved: {color_path}")
+            if(args.ECBencrypt and args.incremental and not args.compressed):
+                if os.path.exists(args.key_file):
+                    ecb = ECB.from_key_file(args.key_file)
+                else:
+                    ecb = ECB()
+                    ecb.save_keys(args.key_file)
+                with timed("ECB incremental encryption"):
+                    image.encrypt_ecb_incremental(ecb)
+                outputs['ecb'] = dict(encrypted=os.path.join(save_path, "ecb_encrypt.png"))
+            elif(args.ECBencrypt and not args.compressed):
+                with timed("ECB encryption"), SharedMemoryPool(args.jobs) if args.jobs else nullcontext() as pool:
+                    outputs['ecb'] = image.encrypt_and_decrypt_image_using_ecb(library_func=True, pool=pool)
+            if(args.CBCencrypt and not args.compressed):
+                with timed("CBC encryption"), SharedMemoryPool(args.jobs) if args.jobs else nullcontext() as pool:
+                    outputs['cbc'] = image.encrypt_and_decrypt_image_using_cbc(pool=pool)
+        if args.metrics:
+            # metryki liczone strumieniowo z zapisanych zaszyfrowanych obrazow, porownanie z oryginalem
+            for mode, paths in outputs.items():
+                if 'encrypted' in paths:
+                    with timed(f"{mode.upper()} cipher metrics"):
+                        analyze_file(paths['encrypted'], args.path).to_json(os.path.join(save_path, f"{mode}_encrypt_metrics.json"))
+        if args.verify:
+            # porownanie odszyfrowanych obrazow z oryginalem wiersz po wierszu
+            for mode, paths in outputs.items():
+                if 'decrypted' not in paths:
+                    logger.error(f"{mode.upper()} decrypted image was not saved - nothing to verify")
+                    verification_failed = True
+                    continue
+                with timed(f"{mode.upper()} verification"):
+                    verification_failed |= not verify_files(args.path, paths['decrypted'], stop_at_first=not args.count_mismatches).identical
+        return int(verification_failed)
     else:
         logger.error(f"Invalid path to file! - {Path(args.path)}")
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List
+from e_media1.chunksclasses import ScanlineStream
+
+
+logger = logging.getLogger("loger")
+
+CHRM_COLUMNS = ['white_x', 'white_y', 'red_x', 'red_y', 'green_x', 'green_y', 'blue_x', 'blue_y']
+CHRM_ATTRIBUTES = ['white_point_x', 'white_point_y', 'red_x', 'red_y', 'green_x', 'green_y', 'blue_x', 'blue_y']
+
+COLUMNS = ['path', 'size', 'mtime_ns', 'chunk_crcs', 'width', 'height', 'bit_depth', 'color_type',
+           'interlace', 'gamma'] + CHRM_COLUMNS + ['exif']
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    chunk_crcs TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    bit_depth INTEGER,
+    color_type INTEGER,
+    interlace INTEGER,
+    gamma REAL,
+    {", ".join(column + " REAL" for column in CHRM_COLUMNS)},
+    exif TEXT
+);
+CREATE INDEX IF NOT EXISTS images_dimensions ON images (width, height);
+CREATE INDEX IF NOT EXISTS images_color_type ON images (color_type);
+'''
+
+
+def _json_value(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, tuple):
+        return [_json_value(item) for item in value]
+    return value
+
+
+def scan_png_header(path: str) -> Dict:
+    '''
+    Reads chunks stored before first IDAT chunk, IDAT data is never read
+
+    Args:
+        *path -> str: path to PNG file
+
+    Return:
+        *record -> Dict: values of all index columns except size and mtime_ns
+    '''
+    with open(path, 'rb') as image_binary:
+        stream = ScanlineStream(image_binary)
+    header_chunks = [stream.IHDR] + ([stream.PLTE] if stream.PLTE is not None else []) + stream.ancillaryChunks
+    ihdr = stream.IHDR
+    record = {
+        'path': path,
+        'chunk_crcs': ",".join(f"{chunk.CRC:08x}" for chunk in header_chunks),
+        'width': ihdr.width,
+        'height': ihdr.height,
+        'bit_depth': ihdr.depth,
+        'color_type': ihdr.color,
+        'interlace': ihdr.interlace,
+        'gamma': None,
+        'exif': None,
+    }
+    record.update(dict.fromkeys(CHRM_COLUMNS))
+    for chunk in stream.ancillaryChunks:
+        if chunk.Type == b'gAMA':
+            record['gamma'] = chunk.gamma
+        elif chunk.Type == b'cHRM':
+            for column, attribute in zip(CHRM_COLUMNS, CHRM_ATTRIBUTES):
+                record[column] = getattr(chunk, attribute)
+        elif chunk.Type == b'eXIf':
+            main_ifd, sub_ifd = chunk.readEXIF()
+            main_ifd.update(sub_ifd)
+            record['exif'] = json.dumps({name: _json_value(value) for name, value in main_ifd.items()})
+    return record
+
+
+class MetadataIndex:
+    '''
+    Persistent SQLite index of PNG header metadata keyed by path, size, mtime and CRCs of header chunks
+    '''
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def index(self, paths: Iterable[str], max_workers: int = 8, prune_root: str = None) -> Dict[str, int]:
+        '''
+        Indexes given PNG files, files with unchanged size and mtime are skipped without opening them
+
+        Args:
+            *paths -> Iterable[str]: paths to PNG files
+            *max_workers -> int = 8: number of threads reading headers
+            *prune_root -> str = None: if given, rows of files under this directory which no longer exist are removed
+
+        Return:
+            *stats -> Dict[str, int]: number of scanned, updated, skipped, failed and removed files
+        '''
+        stats = dict(scanned=0, updated=0, skipped=0, failed=0, removed=0)
+        known = {row['path']: (row['size'], row['mtime_ns'], row['chunk_crcs'])
+                 for row in self.connection.execute("SELECT path, size, mtime_ns, chunk_crcs FROM images")}
+
+        to_scan = []
+        present = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            present.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.error(f"Cannot access {path}: {e}")
+                stats['failed'] += 1
+                continue
+            previous = known.get(path)
+            if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                stats['skipped'] += 1
+            else:
+                to_scan.append((path, stat))
+
+        def scan(item):
+            path, stat = item
+            try:
+                record = scan_png_header(path)
+            except Exception as e:
+                logger.error(f"Indexing {path} failed: {e}")
+                return None
+            record['size'] = stat.st_size
+            record['mtime_ns'] = stat.st_mtime_ns
+            return record
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for record in executor.map(scan, to_scan):
+                if record is None:
+                    stats['failed'] += 1
+                    continue
+                stats['scanned'] += 1
+                previous = known.get(record['path'])
+                if previous is not None and previous[2] == record['chunk_crcs']:
+                    # header chunks did not change, only file stat is refreshed
+                    self.connection.execute("UPDATE images SET size = ?, mtime_ns = ? WHERE path = ?",
+                                            (record['size'], record['mtime_ns'], record['path']))
+                else:
+                    self.connection.execute(
+                        f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                        [record[column] for column in COLUMNS])
+                    stats['updated'] += 1
+
+        if prune_root is not None:
+            root = os.path.join(os.path.abspath(prune_root), '')
+            removed = [(path,) for path in known if path.startswith(root) and path not in present]
+            self.connection.executemany("DELETE FROM images WHERE path = ?", removed)
+            stats['removed'] = len(removed)
+        self.connection.commit()
+        logger.info(f"Indexing finished: {stats}")
+        return stats
+
+    def index_directory(self, directory: str, max_workers: int = 8) -> Dict[str, int]:
+        '''
+        Indexes all *.png files in directory (recursively) and removes rows of deleted files
+        '''
+        paths = (str(path) for path in Path(directory).rglob('*') if path.suffix.lower() == '.png' and path.is_file())
+        return self.index(paths, max_workers=max_workers, prune_root=directory)
+
+    def query(self, **filters) -> List[Dict]:
+        '''
+        Answers query from index only, images are not opened
+
+        Args:
+            *filters: column=value for equality, min_<column>=value and max_<column>=value for ranges,
+                      exif_<tag name>=value for equality of eXIF field
+
+        Return:
+            *rows -> List[Dict]: matching rows, exif column is decoded from JSON
+        '''
+        conditions = []
+        params = []
+        for key, value in filters.items():
+            if key.startswith('exif_'):
+                conditions.append("json_extract(exif, ?) = ?")
+                params.extend([f"$.{key[5:]}", value])
+                continue
+            operator = '='
+            column = key
+            if key.startswith('min_'):
+                operator, column = '>=', key[4:]
+            elif key.startswith('max_'):
+                operator, column = '<=', key[4:]
+            if column not in COLUMNS:
+                raise ValueError(f"Unknown column: {column}")
+            conditions.append(f"{column} {operator} ?")
+            params.append(value)
+        where = " AND ".join(conditions) if conditions else "1"
+        rows = self.connection.execute(f"SELECT * FROM images WHERE {where} ORDER BY path", params)
+        return [self._row_to_dict(row) for row in rows]
+
+    def get(self, path: str) -> Dict:
+        '''
+        Returns indexed metadata of single file or None
+        '''
+        row = self.connection.execute("SELECT * FROM images WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict:
+        record = dict(row)
+        if record['exif'] is not None:
+            record['exif'] = json.loads(record['exif'])
+        return record
+
+
+def _parse_filter_value(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+if __name__ == '__main__':
+    from e_media1.logger_setup import setup_color_logging
+
+    parser = argparse.ArgumentParser(description="Index and query metadata of PNG collections")
+    parser.add_argument('--db', required=True, help="Path to SQLite index database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    index_parser = subparsers.add_parser('index', help="Index PNG files in directory (only changed files are rescanned)")
+    index_parser.add_argument('directory', help="Directory with PNG files")
+    index_parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of threads reading headers")
+    query_parser = subparsers.add_parser('query', help="Query index, filters: column=value, min_<column>=value, max_<column>=value, exif_<tag>=value")
+    query_parser.add_argument('filters', nargs='*', help="Filters in form key=value")
+    args = parser.parse_args()
+
+    setup_color_logging()
+    with MetadataIndex(args.db) as metadata_index:
+        if args.command == 'index':
+            metadata_index.index_directory(args.directory, max_workers=args.jobs)
+        else:
+            filters = dict(item.split('=', 1) for item in args.filters)
+            for record in metadata_index.query(**{key: _parse_filter_value(value) for key, value in filters.items()}):
+                print(json.dumps(record))
@@ -0,0 +1,101 @@
+import logging
+import os
+from typing import Dict, Iterable
+from e_media1.additional_data import SIGNATURE
+from e_media1.basechunks import CHUNK_HEADER, CHUNK_CRC
+
+
+logger = logging.getLogger("loger")
+
+
+
+def is_critical(chunk_type: bytes) -> bool:
+    '''
+    Chunk is critical when bit 5 of first type byte (ancillary bit) is 0 - first letter is uppercase
+    '''
+    return chunk_type[0] & 0x20 == 0
+
+
+def _copy_range(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    '''
+    Copies byte range from source to current position of destination file.
+    Kernel side copy (copy_file_range, sendfile) is used when available, read/write loop otherwise.
+    '''
+    while count > 0:
+        copied = 0
+        try:
+            if hasattr(os, 'copy_file_range'):
+                copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+            elif hasattr(os, 'sendfile'):
+                copied = os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError:
+            # e.g. different file systems or not supported file type
+            copied = 0
+        if copied == 0:
+            data = os.pread(src_fd, min(count, 1 << 20), offset)
+            if not data:
+                raise ValueError("Unexpected end of file")
+            copied = os.write(dst_fd, data)
+        offset += copied
+        count -= copied
+
+
+def _normalize_types(chunk_types: Iterable) -> set:
+    return {chunk_type.encode() if isinstance(chunk_type, str) else bytes(chunk_type) for chunk_type in chunk_types or ()}
+
+
+def strip_chunks(src_path: str, dst_path: str, remove_ancillary: bool = True, keep: Iterable = None, drop: Iterable = None) -> Dict[str, int]:
+    '''
+    Rewrites PNG copying byte ranges of chosen chunks verbatim, IDAT data is never decompressed.
+    Critical chunks (uppercase first letter of type, e.g. IHDR, PLTE, IDAT, IEND) are always copied, data after IEND is never copied.
+
+    Args:
+        *src_path -> str: path to input PNG file
+        *dst_path -> str: path to output PNG file
+        *remove_ancillary -> bool = True: if True all ancillary chunks are removed (except these in keep)
+        *keep -> Iterable = None: ancillary chunk types which are always kept (e.g. ['iCCP', 'sRGB'])
+        *drop -> Iterable = None: ancillary chunk types which are removed when remove_ancillary is False
+
+    Return:
+        *stats -> Dict[str, int]: number of kept and dropped chunks and number of copied bytes
+    '''
+    keep = _normalize_types(keep)
+    drop = _normalize_types(drop)
+    stats = dict(kept=0, dropped=0, bytes=0)
+    with open(src_path, 'rb', buffering=0) as src, open(dst_path, 'wb', buffering=0) as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        file_size = os.fstat(src_fd).st_size
+        if os.pread(src_fd, len(SIGNATURE), 0) != SIGNATURE:
+            raise ValueError("Wrong File Format!")
+        os.write(dst_fd, SIGNATURE)
+
+        offset = len(SIGNATURE)
+        # neighbouring kept chunks are copied with one call
+        range_start, range_end = offset, offset
+        chunk_type = None
+        while chunk_type != b'IEND':
+            header = os.pread(src_fd, CHUNK_HEADER.size, offset)
+            if len(header) < CHUNK_HEADER.size:
+                logger.error("End of file reached before IEND chunk")
+                break
+            length, chunk_type = CHUNK_HEADER.unpack(header)
+            chunk_end = offset + CHUNK_HEADER.size + length + CHUNK_CRC.size
+            if chunk_end > file_size:
+                raise ValueError(f"Chunk {chunk_type} exceeds file size")
+            if is_critical(chunk_type) or chunk_type in keep:
+                keep_chunk = True
+            else:
+                keep_chunk = not remove_ancillary and chunk_type not in drop
+            if keep_chunk:
+                if range_end != offset:
+                    _copy_range(src_fd, dst_fd, range_start, range_end - range_start)
+                    range_start = offset
+                range_end = chunk_end
+                stats['kept'] += 1
+            else:
+                stats['dropped'] += 1
+            offset = chunk_end
+        _copy_range(src_fd, dst_fd, range_start, range_end - range_start)
+        stats['bytes'] = os.fstat(dst_fd).st_size
+    logger.info(f"Chunks rewritten to {dst_path}: {stats}")
+    return stats
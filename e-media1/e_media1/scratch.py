@@ -0,0 +1,66 @@
+import logging
+import os
+import tempfile
+from typing import List
+import numpy as np
+
+
+logger = logging.getLogger("loger")
+
+
+class ScratchSpace:
+    '''
+    Allocator of working arrays. Without directory ordinary in-memory arrays are returned, with directory arrays
+    are backed by np.memmap files, so image data larger than RAM is paged to disk by operating system.
+    Scratch files are unlinked right after mapping (they disappear when last array using them is freed),
+    files which cannot be unlinked while mapped (e.g. on Windows) are removed by cleanup().
+    '''
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self.allocated_bytes = 0
+        self._leftovers: List[str] = []
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def empty(self, shape, dtype=np.uint8) -> np.array:
+        '''
+        Returns uninitialized array (np.memmap if scratch directory is set)
+
+        Args:
+            *shape -> tuple: shape of array
+            *dtype = np.uint8: type of array elements
+
+        Return:
+            *array -> np.array: array with given shape
+        '''
+        if self.directory is None or int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=dtype)
+        file_descriptor, path = tempfile.mkstemp(dir=self.directory, suffix='.scratch')
+        os.close(file_descriptor)
+        array = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+        try:
+            os.unlink(path)
+        except OSError:
+            self._leftovers.append(path)
+        self.allocated_bytes += array.nbytes
+        logger.debug(f"Scratch array {shape} ({array.nbytes} bytes) mapped in {self.directory}")
+        return array
+
+    def cleanup(self) -> None:
+        for path in self._leftovers:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.error(f"Removing scratch file {path} failed: {e}")
+        self._leftovers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+
+# scratch space used when none is given - plain in-memory arrays
+IN_MEMORY = ScratchSpace()
@@ -0,0 +1,453 @@
+import argparse
+import asyncio
+import base64
+import copy
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import tempfile
+import time
+from collections import deque
+from typing import Dict, Iterator, Tuple
+import numpy as np
+from e_media1.aio import AsyncRunner
+from e_media1.chunksclasses import Image, ScanlineStream
+from e_media1.additional_data import color_type_bytes
+from e_media1.encrypt import ECB, CBC
+from e_media1.passthrough import strip_chunks
+from e_media1.shared_pool import SharedMemoryPool
+
+
+logger = logging.getLogger("loger")
+
+
+def default_socket_path() -> str:
+    '''
+    Socket in per-user runtime directory ($XDG_RUNTIME_DIR), or in e_media1-<uid> directory in temp directory
+    if it is not set - other users cannot replace or connect to socket
+    '''
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), f"e_media1-{os.getuid()}")
+    return os.path.join(runtime_dir, "e_media1.sock")
+
+
+DEFAULT_SOCKET = default_socket_path()
+
+# number of latency samples kept per operation
+LATENCY_WINDOW = 1000
+
+# seconds to wait for answer of service already listening on socket
+PROBE_TIMEOUT = 5.0
+
+
+def load_ciphers(key_file: str = None) -> Dict[str, object]:
+    '''
+    Creates ECB and CBC ciphers once for whole service life. Keys are read from key_file if it exists,
+    otherwise generated (and saved to key_file if given, ECB and CBC get separate files).
+    '''
+    ciphers = dict()
+    for mode, cipher_class in (('ecb', ECB), ('cbc', CBC)):
+        path = f"{key_file}.{mode}.json" if key_file else None
+        if path and os.path.exists(path):
+            ciphers[mode] = cipher_class.from_key_file(path)
+        else:
+            ciphers[mode] = cipher_class()
+            if path:
+                ciphers[mode].save_keys(path)
+    return ciphers
+
+
+def _prepare_socket_directory(socket_path: str) -> None:
+    # directory is created private, existing one has to belong to current user
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.stat(directory).st_uid != os.getuid():
+        raise ValueError(f"Socket directory {directory} belongs to another user")
+
+
+def _socket_in_use(socket_path: str) -> bool:
+    '''
+    Checks if service is listening on socket (ping request), socket file left by crashed service refuses connection
+    '''
+    try:
+        with ServiceClient(socket_path, timeout=PROBE_TIMEOUT) as client:
+            client.call('ping')
+        return True
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    except (OSError, ValueError):
+        # something else accepts connections on this path - it is not removed either
+        return True
+
+
+class ProcessingService:
+    '''
+    Long running local service processing PNG files on requests sent to Unix socket. Requests and responses are
+    JSON objects, one per line. Cipher keys and worker processes are created once, so requests do not pay
+    interpreter startup, imports and RSA key generation. Each request gets 'accepted' event, operation events
+    (e.g. decoded rows) and final 'result' or 'error' event, all with id of request.
+
+    Operations: ping, stats, shutdown, decode, strip, encrypt, decrypt
+    '''
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, key_file: str = None, processes: int = None, max_jobs: int = 4):
+        '''
+        Args:
+            *socket_path -> str: path of Unix socket
+            *key_file -> str = None: prefix of key files, keys are generated on every start if None
+            *processes -> int = None: number of worker processes of ECB and decryption (default os.cpu_count())
+            *max_jobs -> int = 4: number of requests processed at once, other requests wait in queue
+        '''
+        self.socket_path = socket_path
+        self.key_file = key_file
+        self.max_jobs = max_jobs
+        self.runner = AsyncRunner(max_concurrency=max_jobs * 2, cpu_workers=max_jobs)
+        self.pool = SharedMemoryPool(processes)
+        self.ciphers = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.started = None
+        self.latency: Dict[str, deque] = dict()
+        self.operations = {
+            'decode': self._decode,
+            'strip': self._strip,
+            'encrypt': self._encrypt,
+            'decrypt': self._decrypt,
+        }
+        self._slots = None
+        self._server = None
+        self._stopped = None
+        # handler tasks of open client connections, cancelled on close
+        self._connections = set()
+
+    async def start(self) -> None:
+        self._slots = asyncio.Semaphore(self.max_jobs)
+        self._stopped = asyncio.Event()
+        # SIGTERM stops service cleanly (socket and shared memory are removed)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._stopped.set)
+        _prepare_socket_directory(self.socket_path)
+        if os.path.exists(self.socket_path):
+            if _socket_in_use(self.socket_path):
+                raise ValueError(f"Service is already running on {self.socket_path}")
+            # stale socket of service which was not stopped cleanly
+            os.unlink(self.socket_path)
+        with_keys = self.key_file is not None and os.path.exists(f"{self.key_file}.ecb.json")
+        logger.info("Reading RSA keys.." if with_keys else "Generating RSA keys for service..")
+        self.ciphers = await self.runner.run_cpu(load_ciphers, self.key_file)
+        self._server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path, limit=1 << 20)
+        self.started = time.monotonic()
+        logger.info(f"Service listening on {self.socket_path}")
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # idle clients would keep their handlers waiting for next request
+            for connection in list(self._connections):
+                connection.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+            # socket is removed only by service which created it
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        await asyncio.get_running_loop().run_in_executor(None, self.pool.close)
+        await asyncio.get_running_loop().run_in_executor(None, self.runner.close)
+        logger.info("Service stopped")
+
+    def stats(self) -> dict:
+        '''
+        Queue depth, counters and latency (ms) of each operation over last LATENCY_WINDOW requests
+        '''
+        latency = dict()
+        for operation, samples in self.latency.items():
+            values = np.array(samples) * 1000
+            latency[operation] = dict(count=len(values), mean=round(float(values.mean()), 3),
+                                      p50=round(float(np.percentile(values, 50)), 3),
+                                      p95=round(float(np.percentile(values, 95)), 3),
+                                      max=round(float(values.max()), 3))
+        return dict(queue_depth=self.queued, running=self.running, completed=self.completed, failed=self.failed,
+                    uptime=round(time.monotonic() - self.started, 3), processes=self.pool.processes, latency=latency)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def send(message: dict) -> None:
+            async with lock:
+                writer.write(json.dumps(message).encode() + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    await send(dict(id=None, event='error', error=f"Invalid request: {e}"))
+                    continue
+                # requests of one connection are processed concurrently, responses are matched by id
+                task = asyncio.create_task(self._process(request, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError as e:
+            logger.error(f"Client connection lost: {e}")
+        except asyncio.CancelledError:
+            # service is closing, requests of this connection are cancelled and connection ends normally
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+    async def _process(self, request: dict, send) -> None:
+        request_id, operation = request.get('id'), request.get('op')
+        if operation == 'ping':
+            await send(dict(id=request_id, event='result', pong=True))
+            return
+        if operation == 'stats':
+            await send(dict(id=request_id, event='result', **self.stats()))
+            return
+        if operation == 'shutdown':
+            await send(dict(id=request_id, event='result', stopping=True))
+            self._stopped.set()
+            return
+        handler = self.operations.get(operation)
+        if handler is None:
+            await send(dict(id=request_id, event='error', error=f"Unknown operation: {operation}"))
+            return
+
+        start = time.perf_counter()
+        self.queued += 1
+        waiting = True
+        try:
+            await send(dict(id=request_id, event='accepted', queue_depth=self.queued))
+            async with self._slots:
+                self.queued -= 1
+                waiting = False
+                self.running += 1
+                try:
+                    result = await handler(request, lambda message: send(dict(id=request_id, **message)))
+                finally:
+                    self.running -= 1
+            self.completed += 1
+            self.latency.setdefault(operation, deque(maxlen=LATENCY_WINDOW)).append(time.perf_counter() - start)
+            await send(dict(id=request_id, event='result', seconds=round(time.perf_counter() - start, 6), **result))
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Request {request_id} ({operation}) failed: {e}")
+            try:
+                await send(dict(id=request_id, event='error', error=str(e)))
+            except ConnectionError:
+                pass
+        finally:
+            if waiting:
+                self.queued -= 1
+
+    def _cipher(self, mode: str, image_shape: tuple):
+        cipher = self.ciphers.get(mode)
+        if cipher is None:
+            raise ValueError(f"Unknown encryption mode: {mode}")
+        # keys are shared, per image state (shape, added bytes) is kept in copy
+        cipher = copy.copy(cipher)
+        cipher.image_shape = image_shape
+        return cipher
+
+    async def _decode(self, request: dict, send) -> dict:
+        '''
+        Decodes image. With 'output' decoded data is saved as .npy file, otherwise rows are streamed
+        in 'rows' events (base64 data of band of 'rows' rows, default 64).
+        '''
+        path = request['path']
+        if request.get('output'):
+            image = await Image.aopen(path, os.path.dirname(path), runner=self.runner)
+            await self.runner.run_io(np.save, request['output'], image.rawIDATData)
+            return dict(output=request['output'], shape=list(image.rawIDATData.shape))
+
+        rows = int(request.get('rows', 64))
+        with open(path, 'rb') as image_binary:
+            stream = await self.runner.run_io(ScanlineStream, image_binary)
+            shape = (stream.IHDR.height, stream.IHDR.width, color_type_bytes.get(stream.IHDR.color))
+            scanlines = iter(stream)
+            row = 0
+            while True:
+                band = await self.runner.run_io(lambda: list(itertools.islice(scanlines, rows)))
+                if not band:
+                    break
+                await send(dict(event='rows', start=row, count=len(band), data=base64.b64encode(b''.join(scanline.tobytes() for scanline in band)).decode()))
+                row += len(band)
+        return dict(shape=list(shape))
+
+    async def _strip(self, request: dict, send) -> dict:
+        statistics = await self.runner.run_io(strip_chunks, request['path'], request['output'],
+                                              remove_ancillary=request.get('remove_ancillary', True),
+                                              keep=request.get('keep'), drop=request.get('drop'))
+        return dict(output=request['output'], statistics=statistics)
+
+    async def _encrypt(self, request: dict, send) -> dict:
+        '''
+        Encrypts image with service keys ('mode' ecb or cbc) and saves it to 'output'.
+        ECB blocks are encrypted by warm worker processes, CBC (sequential) in thread.
+        '''
+        mode, output = request.get('mode', 'ecb'), request['output']
+        image = await Image.aopen(request['path'], os.path.dirname(os.path.abspath(output)), runner=self.runner)
+        cipher = self._cipher(mode, image.rawIDATData.shape)
+        if mode == 'ecb':
+            encrypted, padded = await self.runner.run_io(cipher.encrypt_parallel, image.rawIDATData, self.pool)
+        else:
+            encrypted, padded = await self.runner.run_cpu(cipher.encrypt, image.rawIDATData)
+        path = await image.asave(os.path.basename(output), encrypted, padded, runner=self.runner)
+        return dict(output=path, mode=mode)
+
+    async def _decrypt(self, request: dict, send) -> dict:
+        '''
+        Decrypts image encrypted by service ('mode' ecb or cbc) and saves it to 'output',
+        blocks of both modes are decrypted by warm worker processes
+        '''
+        mode, output = request.get('mode', 'ecb'), request['output']
+        image = await Image.aopen(request['path'], os.path.dirname(os.path.abspath(output)), runner=self.runner)
+        if image.hidden_chunk is None:
+            raise ValueError("Hidden chunk with ciphertext tail not found - image was not encrypted")
+        hidden_data = np.frombuffer(image.hidden_chunk.get_chunk_data_bytes(), dtype=np.uint8)
+        cipher = self._cipher(mode, image.rawIDATData.shape)
+        decrypted = await self.runner.run_io(cipher.decrypt_parallel, image.rawIDATData, hidden_data, self.pool)
+        path = await image.asave(os.path.basename(output), decrypted, runner=self.runner)
+        return dict(output=path, mode=mode)
+
+
+class ServiceClient:
+    '''
+    Thin blocking client of ProcessingService, one connection is kept for all requests
+    '''
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+        self._ids = itertools.count(1)
+
+    def _connect(self) -> None:
+        if self._socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            try:
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                raise
+            # client keeps socket only after successful connection, so close() works after failed connect
+            self._socket = connection
+            self._file = connection.makefile('rb')
+
+    def stream(self, operation: str, **params) -> Iterator[dict]:
+        '''
+        Sends request and yields its events, last event is 'result' or 'error'
+        '''
+        self._connect()
+        request_id = next(self._ids)
+        self._socket.sendall(json.dumps(dict(id=request_id, op=operation, **params)).encode() + b'\n')
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("Service closed connection")
+            event = json.loads(line)
+            if event.get('id') not in (request_id, None):
+                continue
+            yield event
+            if event['event'] in ('result', 'error'):
+                return
+
+    def call(self, operation: str, **params) -> dict:
+        '''
+        Sends request and returns its result, error reported by service is raised as ValueError
+        '''
+        for event in self.stream(operation, **params):
+            if event['event'] == 'error':
+                raise ValueError(event['error'])
+            if event['event'] == 'result':
+                return event
+
+    def iter_rows(self, path: str, rows: int = 64) -> Iterator[Tuple[int, np.array]]:
+        '''
+        Decodes image in service and yields (first row, band of rows as uint8 array rows x row bytes)
+        '''
+        for event in self.stream('decode', path=path, rows=rows):
+            if event['event'] == 'error':
+                raise ValueError(event['error'])
+            if event['event'] == 'rows':
+                data = np.frombuffer(base64.b64decode(event['data']), dtype=np.uint8)
+                yield event['start'], data.reshape(event['count'], -1)
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _parse_value(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main() -> None:
+    from e_media1.logger_setup import setup_color_logging
+
+    parser = argparse.ArgumentParser(description="Local PNG processing service and its client")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, dest='socket_path', help=f"Path of Unix socket (default {DEFAULT_SOCKET})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve = subparsers.add_parser('serve', help="Start service")
+    serve.add_argument('--keys', dest='key_file', help="Prefix of RSA key files (<prefix>.ecb.json, <prefix>.cbc.json), created if they do not exist")
+    serve.add_argument('-j', '--jobs', type=int, default=None, dest='processes', help="Number of worker processes (ECB encryption, ECB and CBC decryption)")
+    serve.add_argument('--maxJobs', type=int, default=4, dest='max_jobs', help="Number of requests processed at once")
+    call = subparsers.add_parser('call', help="Send request to running service, events are printed as JSON lines")
+    call.add_argument('operation', choices=['ping', 'stats', 'shutdown', 'decode', 'strip', 'encrypt', 'decrypt'])
+    call.add_argument('params', nargs='*', help="Request parameters as key=value (e.g. path=images/dice.png mode=ecb)")
+    args = parser.parse_args()
+
+    setup_color_logging()
+    if args.command == 'serve':
+        service = ProcessingService(args.socket_path, args.key_file, args.processes, args.max_jobs)
+        try:
+            asyncio.run(service.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        except ValueError as e:
+            logger.error(f"Service not started: {e}")
+            raise SystemExit(1)
+        return
+    params = dict(param.split('=', 1) for param in args.params)
+    with ServiceClient(args.socket_path) as client:
+        for event in client.stream(args.operation, **{key: _parse_value(value) for key, value in params.items()}):
+            if event['event'] == 'rows':
+                event['data'] = f"<{len(event['data'])} base64 characters>"
+            print(json.dumps(event))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, Tuple
+import numpy as np
+
+
+logger = logging.getLogger("loger")
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    '''
+    Description of array placed in shared memory segment - only this (name, shape, type) is sent to workers
+    '''
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str = 'uint8'
+
+    @contextmanager
+    def attach(self) -> Iterator[np.array]:
+        '''
+        Maps segment in current process and yields array using it, segment is closed (not removed) at exit.
+        Array must not be used after exit.
+        '''
+        segment = shared_memory.SharedMemory(name=self.name)
+        try:
+            yield np.ndarray(self.shape, dtype=self.dtype, buffer=segment.buf)
+        finally:
+            segment.close()
+
+
+class SharedMemoryPool:
+    '''
+    Process pool exchanging large arrays through shared memory. Arrays are copied once into shared segments,
+    workers receive only SharedArray descriptors and index ranges and write results in place.
+    All segments are removed on close (also when processing fails).
+    '''
+
+    def __init__(self, processes: int = None):
+        self.processes = processes or os.cpu_count()
+        self._executor = None
+        self._segments: Dict[str, shared_memory.SharedMemory] = dict()
+        # pool is used from many threads (e.g. service requests), executor is created and closed under lock
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # workers are started on first use, so pool can be kept warm between tasks
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.processes)
+            return self._executor
+
+    def empty(self, shape, dtype=np.uint8) -> SharedArray:
+        '''
+        Allocates uninitialized array in new shared memory segment
+        '''
+        shape = tuple(int(size) for size in np.atleast_1d(shape))
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        segment = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._segments[segment.name] = segment
+        return SharedArray(segment.name, shape, np.dtype(dtype).str)
+
+    def share(self, array: np.array) -> SharedArray:
+        '''
+        Copies array into new shared memory segment
+        '''
+        shared = self.empty(array.shape, array.dtype)
+        self.view(shared)[...] = array
+        return shared
+
+    def view(self, shared: SharedArray) -> np.array:
+        '''
+        Array using segment in this process, valid until segment is released
+        '''
+        segment = self._segments[shared.name]
+        return np.ndarray(shared.shape, dtype=shared.dtype, buffer=segment.buf)
+
+    def release(self, shared: SharedArray) -> None:
+        '''
+        Removes segment, views of it must not be used afterwards
+        '''
+        segment = self._segments.pop(shared.name, None)
+        if segment is None:
+            return
+        try:
+            segment.close()
+        except BufferError:
+            # views of segment still exist, memory is freed when they are garbage collected
+            logger.debug(f"Shared memory segment {shared.name} still in use")
+        segment.unlink()
+
+    def run(self, func, total: int, *args, tasks: int = None) -> None:
+        '''
+        Splits range(total) into contiguous parts and runs func(start, stop, *args) in workers.
+        Args should contain SharedArray descriptors, func attaches them and writes results in place.
+        First exception raised by worker is re-raised, remaining tasks are cancelled.
+
+        Args:
+            *func: module level function (picklable)
+            *total -> int: number of items (e.g. blocks or rows)
+            *args: additional arguments of func
+            *tasks -> int = None: number of parts (default 4 per worker for load balancing)
+        '''
+        if total <= 0:
+            return
+        tasks = max(1, min(total, tasks or 4 * self.processes))
+        bounds = np.linspace(0, total, tasks + 1).astype(int)
+        executor = self._get_executor()
+        futures = [executor.submit(func, int(start), int(stop), *args) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                wait(not_done)
+                raise error
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        for name in list(self._segments):
+            segment = self._segments.pop(name)
+            try:
+                segment.close()
+                segment.unlink()
+            except (FileNotFoundError, BufferError) as e:
+                logger.error(f"Removing shared memory segment {name} failed: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if self._segments:
+            self.close()
+
+
+def rsa_blocks_worker(start: int, stop: int, source: SharedArray, target: SharedArray, exponent: int, modulus: int,
+                      input_block_size: int, output_block_size: int) -> None:
+    '''
+    Worker of parallel ECB and CBC decryption: computes block ** exponent mod modulus for blocks start:stop of source and writes
+    results into target. Last source block is padded with zeros.
+    '''
+    from e_media1 import bigint
+
+    exponent, modulus = bigint.to_backend(exponent), bigint.to_backend(modulus)
+    with source.attach() as source_array, target.attach() as target_array:
+        for index in range(start, stop):
+            data = source_array[index * input_block_size:(index + 1) * input_block_size].tobytes()
+            result = bigint.powmod(bigint.from_bytes(data.ljust(input_block_size, b'\x00')), exponent, modulus)
+            target_array[index * output_block_size:(index + 1) * output_block_size] = np.frombuffer(bigint.to_bytes(result, output_block_size), dtype=np.uint8)
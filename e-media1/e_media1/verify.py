@@ -0,0 +1,112 @@
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import List
+import numpy as np
+from e_media1.chunksclasses import ScanlineStream
+from e_media1.additional_data import color_type_bytes
+
+
+logger = logging.getLogger("loger")
+
+
+@dataclass
+class RowDiff:
+    '''
+    Differences in single row of compared images
+    '''
+    row: int
+    pixels: int
+    first_column: int
+    max_difference: int
+
+
+@dataclass
+class VerifyResult:
+    '''
+    Result of comparison of two PNG images
+    '''
+    identical: bool
+    rows_compared: int = 0
+    mismatched_rows: int = 0
+    mismatched_pixels: int = 0
+    row_diffs: List[RowDiff] = field(default_factory=list)
+    reason: str = None
+
+    def __str__(self) -> str:
+        if self.identical:
+            return f"Images identical ({self.rows_compared} rows compared)"
+        if self.reason is not None:
+            return f"Images differ: {self.reason}"
+        return (f"Images differ: {self.mismatched_rows} rows, {self.mismatched_pixels} pixels "
+                f"({self.rows_compared} rows compared), first row {self.row_diffs[0].row}")
+
+
+def _pixel_rows(stream: ScanlineStream):
+    # palette images are compared by colors, not by indices
+    width = stream.IHDR.width
+    channels = color_type_bytes.get(stream.IHDR.color)
+    for scanline in stream:
+        pixels = scanline.reshape(width, channels)
+        if stream.IHDR.color == 3 and stream.PLTE is not None:
+            pixels = stream.PLTE.expand(pixels[:, 0])
+        yield pixels
+
+
+def verify_images(first_binary, second_binary, stop_at_first: bool = True, max_row_diffs: int = 100) -> VerifyResult:
+    '''
+    Compares pixels of two PNG files decoded in lockstep, scanline by scanline. Only current (and previous, needed
+    for defiltering) scanline of each image is kept in memory and each file is decoded once.
+
+    Args:
+        *first_binary: first PNG file opened in binary mode
+        *second_binary: second PNG file opened in binary mode
+        *stop_at_first -> bool = True: stop decoding at first mismatched row, otherwise all mismatches are counted
+        *max_row_diffs -> int = 100: max number of RowDiff kept in result (counting continues)
+
+    Return:
+        *result -> VerifyResult
+    '''
+    first, second = ScanlineStream(first_binary), ScanlineStream(second_binary)
+    if (first.IHDR.width, first.IHDR.height) != (second.IHDR.width, second.IHDR.height):
+        return VerifyResult(False, reason=f"dimensions {first.IHDR.width}x{first.IHDR.height} and {second.IHDR.width}x{second.IHDR.height}")
+
+    result = VerifyResult(True)
+    for row, (first_row, second_row) in enumerate(itertools.zip_longest(_pixel_rows(first), _pixel_rows(second))):
+        if first_row is None or second_row is None:
+            result.identical = False
+            result.reason = f"image data ends at row {row}"
+            break
+        if first_row.shape != second_row.shape:
+            result.identical = False
+            result.reason = f"pixel formats with {first_row.shape[1]} and {second_row.shape[1]} channels"
+            break
+        result.rows_compared += 1
+        mismatched = np.any(first_row != second_row, axis=1)
+        if not mismatched.any():
+            continue
+        result.identical = False
+        result.mismatched_rows += 1
+        pixels = int(np.count_nonzero(mismatched))
+        result.mismatched_pixels += pixels
+        if len(result.row_diffs) < max_row_diffs:
+            max_difference = int(np.abs(first_row.astype(np.int16) - second_row).max())
+            result.row_diffs.append(RowDiff(row, pixels, int(np.argmax(mismatched)), max_difference))
+        if stop_at_first:
+            break
+    return result
+
+
+def verify_files(first_path: str, second_path: str, stop_at_first: bool = True, max_row_diffs: int = 100) -> VerifyResult:
+    '''
+    Opens both files and compares them with verify_images, result is logged
+    '''
+    with open(first_path, 'rb') as first_binary, open(second_path, 'rb') as second_binary:
+        result = verify_images(first_binary, second_binary, stop_at_first, max_row_diffs)
+    if result.identical:
+        logger.info(f"{first_path} and {second_path}: {result}")
+    else:
+        logger.error(f"{first_path} and {second_path}: {result}")
+        for diff in result.row_diffs:
+            logger.error(f"Row {diff.row}: {diff.pixels} pixels differ, first at column {diff.first_column}, max difference {diff.max_difference}")
+    return result
@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+from e_media1 import filtering_kernels
+from e_media1.filtering_methods import ReconstructingMethods
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILTER_TYPES = range(5)
+BYTES_NUMBERS = (1, 2, 3, 4, 6, 8)
+WIDTHS = (1, 2, 97)
+PER_BYTE = {
+    0: ReconstructingMethods.none,
+    1: ReconstructingMethods.Sub,
+    2: ReconstructingMethods.Up,
+    3: ReconstructingMethods.Average,
+    4: ReconstructingMethods.Paeth,
+}
+
+requires_numba = pytest.mark.skipif(not filtering_kernels.NUMBA_AVAILABLE, reason="numba not installed")
+
+
+def random_scanlines(seed: int, width: int, bytes_number: int):
+    rng = np.random.default_rng(seed)
+    length = width * bytes_number
+    return rng.integers(0, 256, length, dtype=np.uint8), rng.integers(0, 256, length, dtype=np.uint8)
+
+
+def per_byte_reconstruct(filter_type: int, x: np.array, prior: np.array, width: int, bytes_number: int) -> np.array:
+    # per-byte methods work on flat list of all reconstructed bytes, prior scanline is row 0
+    length = len(x)
+    reconstructed = prior.tolist() + [0] * length
+    for col in range(length):
+        reconstructed[length + col] = PER_BYTE[filter_type](int(x[col]), 1, col, reconstructed, width, bytes_number) & 0xff
+    return np.array(reconstructed[length:], dtype=np.uint8)
+
+
+@pytest.mark.parametrize("use_jit", (pytest.param(True, marks=requires_numba), False), ids=("jit", "no_jit"))
+@pytest.mark.parametrize("filter_type", FILTER_TYPES)
+@pytest.mark.parametrize("bytes_number", BYTES_NUMBERS)
+@pytest.mark.parametrize("width", WIDTHS)
+def test_reconstruct_matches_per_byte(monkeypatch, use_jit, filter_type, bytes_number, width):
+    monkeypatch.setattr(filtering_kernels, "USE_JIT", use_jit)
+    for seed in range(3):
+        x, prior = random_scanlines(seed, width, bytes_number)
+        result = ReconstructingMethods.reconstruct_scanline(filter_type, x.tobytes(), prior, bytes_number)
+        np.testing.assert_array_equal(result, per_byte_reconstruct(filter_type, x, prior, width, bytes_number))
+
+
+@pytest.mark.parametrize("no_jit", ("", "1"), ids=("default", "E_MEDIA1_NO_JIT"))
+def test_check_parity_with_environment(no_jit):
+    code = ("from e_media1 import filtering_kernels as k; "
+            "print(k.USE_JIT, all(k.check_parity(w, b, s) for w in (1, 2, 97) for b in (1, 3, 4) for s in range(2)))")
+    env = dict(os.environ, E_MEDIA1_NO_JIT=no_jit)
+    result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True)
+    use_jit, identical = result.stdout.split()
+    assert use_jit == str(filtering_kernels.NUMBA_AVAILABLE and not no_jit)
+    assert identical == "True"
+
+
+@requires_numba
+@pytest.mark.parametrize("filter_type", FILTER_TYPES)
+@pytest.mark.parametrize("bytes_number", BYTES_NUMBERS)
+@pytest.mark.parametrize("width", WIDTHS)
+def test_reconstruct_jit_matches_fallback(monkeypatch, filter_type, bytes_number, width):
+    for seed in range(5):
+        x, prior = random_scanlines(seed, width, bytes_number)
+        monkeypatch.setattr(filtering_kernels, "USE_JIT", True)
+        compiled = ReconstructingMethods.reconstruct_scanline(filter_type, x.tobytes(), prior, bytes_number)
+        monkeypatch.setattr(filtering_kernels, "USE_JIT", False)
+        fallback = ReconstructingMethods.reconstruct_scanline(filter_type, x.tobytes(), prior, bytes_number)
+        np.testing.assert_array_equal(compiled, fallback)
+
+
+@requires_numba
+@pytest.mark.parametrize("filter_type", (3, 4))
+def test_unfilter_kernels_match_python(filter_type):
+    kernel = 'unfilter_average' if filter_type == 3 else 'unfilter_paeth'
+    python_kernel = filtering_kernels._unfilter_average if filter_type == 3 else filtering_kernels._unfilter_paeth
+    for seed in range(5):
+        x, prior = random_scanlines(seed, 33, 3)
+        # uint8 scalars of pure Python kernel wrap around like compiled ones
+        with np.errstate(over='ignore'):
+            expected = python_kernel(x, prior, 3)
+        np.testing.assert_array_equal(filtering_kernels.compiled_kernels()[kernel](x, prior, 3), expected)
+
+
+def test_import_does_not_load_numba():
+    code = "import sys, e_media1.filtering_methods; print('numba' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"